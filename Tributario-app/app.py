@@ -1,24 +1,20 @@
+import io
 import os
-import re
 import json
+import hashlib
 import streamlit as st
 import pandas as pd
-from src.parser.xml_parser import ler_xml_universal
+from src.calculo.tabela_cst import TabelaCSTError, ler_tabela_cst_compilada, normalizar_cst
+from src.exportador.csv_streaming import csv_dataframe, formatar_moeda_br
+from src.parser.xml_parser import extrair_itens_xml
+from src.regras.indice_ncm import IndiceNCM
+from src.regras.registro import RegistroRegras, registro_padrao
 from st_aggrid import AgGrid, GridOptionsBuilder
 
-# Default de alíquotas se não houver arquivo JSON
-DEFAULT_RATES = {
-    '000': {'PIS': 0.0065, 'COFINS': 0.03, 'ICMS': 0.18},
-    '010': {'PIS': 0.0065, 'COFINS': 0.03, 'ICMS': 0.12},
-    '020': {'PIS': 0.0065, 'COFINS': 0.03, 'ICMS': 0.07},
-    '060': {'PIS': 0.0,    'COFINS': 0.0,  'ICMS': 0.0},
-}
-BOOL_MAP = {'SIM': True, 'NÃO': False, 'NAO': False}
-
-def extrai_item(path: str) -> int:
-    """Extrai índice do item do XML a partir do path 'det[i]'."""
-    m = re.search(r"det\[(\d+)\]", path)
-    return int(m.group(1)) if m else -1
+def normalizar_csts(codigos: pd.Series) -> pd.Series:
+    """Normaliza CSTs para três dígitos ('00' -> '000', '0.01' -> '010'), uma vez por código distinto"""
+    unicos = codigos.dropna().unique()
+    return codigos.map({c: normalizar_cst(c) for c in unicos})
 
 
 def fmt(valor: float) -> str:
@@ -27,6 +23,87 @@ def fmt(valor: float) -> str:
     return f"R$ {s}"
 
 
+def digest(conteudo: bytes) -> str:
+    """Hash do conteúdo enviado (chave dos caches entre reruns)"""
+    return hashlib.sha256(conteudo).hexdigest()
+
+
+def mtime(caminho: str):
+    """Data de modificação do arquivo (None se não existir), para invalidar caches"""
+    return os.path.getmtime(caminho) if os.path.exists(caminho) else None
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def carregar_cst(chave: str, _conteudo: bytes, aliquotas_mtime) -> pd.DataFrame:
+    """Tabela CST normalizada (compilada em disco por conteúdo) com as alíquotas por CST"""
+    cst_df = ler_tabela_cst_compilada(io.BytesIO(_conteudo), digest=chave)
+    # Alíquotas do CST pelo registro de regras (aliquotas.json acrescenta regras por CST)
+    registro = registro_padrao()
+    if os.path.exists('aliquotas.json'):
+        with open('aliquotas.json', encoding='utf-8') as arquivo:
+            registro = registro.com(*RegistroRegras.regras_por_chave(json.load(arquivo), 'cst', 'aliquotas.json'))
+    cst_df = cst_df.drop_duplicates('CST').reset_index(drop=True)
+    aliquotas = registro.instantaneo().resolver_lote(cst_df['CST'])
+    for col in ['PIS','COFINS','ICMS']:
+        cst_df[col] = aliquotas[col]
+
+    return cst_df
+
+
+@st.cache_resource(show_spinner=False)
+def carregar_ncm_rates(caminho: str, arquivo_mtime) -> IndiceNCM:
+    """Índice de alíquotas por prefixo de NCM do JSON, recompilado só quando o arquivo muda"""
+    return IndiceNCM.de_json(caminho)
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def ler_xml(chave: str, _conteudo: bytes) -> pd.DataFrame:
+    """Itens do XML enviado (tabela tipada por item), refeito só quando o conteúdo muda"""
+    # Parse direto do buffer do upload: sem arquivo temporário compartilhado entre sessões
+    return extrair_itens_xml(_conteudo)
+
+
+def calcular_relatorio(df_itens: pd.DataFrame, cst_df: pd.DataFrame, rates_ncm: IndiceNCM,
+                       cbs_rate: float, ibs_rate: float) -> pd.DataFrame:
+    """
+    Despesa antes/depois da reforma por item, em operações vetoriais
+
+    PIS, COFINS e IPI usam o valor destacado no XML; sem o grupo no XML, são
+    estimados pelas alíquotas do NCM (ncm_rates.json, regra do prefixo mais
+    específico: código, subposição, posição ou capítulo). ICMS usa a alíquota
+    do CST e CBS/IBS as reduções da planilha.
+    """
+    df_all = df_itens.reset_index()
+    df_all['CST'] = normalizar_csts(df_all['cst'])
+    df_all = df_all.merge(cst_df, on='CST', how='left')
+    aliquotas_ncm = rates_ncm.resolver_coluna(df_all['ncm'])
+    for tributo in ['PIS', 'COFINS', 'IPI']:
+        df_all[f'{tributo}_json'] = aliquotas_ncm[tributo]
+    df_all['ncm_regra'] = aliquotas_ncm['ncm_regra']
+
+    valor = df_all['valor_produto']
+    for pct_col in ['% Red. CBS', '% Red. IBS']:
+        if pct_col in df_all.columns:
+            df_all[pct_col] = pd.to_numeric(df_all[pct_col], errors='coerce').fillna(0)
+        else:
+            df_all[pct_col] = 0.0
+
+    # Cálculos Antes da Reforma
+    for tributo in ['pis', 'cofins', 'ipi']:
+        aliquota_ncm = df_all[f'{tributo.upper()}_json'].fillna(0)
+        df_all[f'valor_{tributo}'] = df_all[f'valor_{tributo}'].fillna(valor * aliquota_ncm)
+    icms = pd.to_numeric(df_all['ICMS'], errors='coerce') if 'ICMS' in df_all.columns else 0.0
+    df_all['valor_icms'] = (valor * icms).fillna(0)
+    df_all['Despesa Antes Reforma'] = df_all[['valor_pis', 'valor_cofins', 'valor_icms', 'valor_ipi']].sum(axis=1)
+
+    # Cálculos Pós da Reforma
+    df_all['CBS (%)'] = valor * cbs_rate * (1 - df_all['% Red. CBS'])
+    df_all['IBS (%)'] = valor * ibs_rate * (1 - df_all['% Red. IBS'])
+    df_all['Despesa Pós Reforma'] = df_all['CBS (%)'] + df_all['IBS (%)']
+    df_all['Diferença Tributária'] = df_all['Despesa Pós Reforma'] - df_all['Despesa Antes Reforma']
+    return df_all
+
+
 def main():
     st.set_page_config(page_title="Relatório Tributário", layout="wide")
     st.title('🌟 Relatório Executivo & Simulação (CBS+IBS)')
@@ -50,41 +127,14 @@ def main():
         st.info('Carregue o XML e a planilha CST para prosseguir.')
         return
 
-        # Processamento da planilha CST
-    raw = pd.read_excel(cst_upl, header=None, dtype=str)
-    header_row = raw.apply(lambda r: r.astype(str).str.contains('CST', na=False).any(), axis=1).idxmax()
-    cst_df = pd.read_excel(cst_upl, header=header_row)
-    cst_df = cst_df.loc[:, ~cst_df.columns.str.contains('^Unnamed')]
-    # Remove espaços em branco de colunas
-    cst_df.columns = cst_df.columns.str.strip()
+    # Processamento da planilha CST (cacheado pelo conteúdo do arquivo)
+    cst_bytes = cst_upl.getvalue()
+    try:
+        cst_df = carregar_cst(digest(cst_bytes), cst_bytes, mtime('aliquotas.json'))
+    except TabelaCSTError as e:
+        st.error(str(e)); return
     # Debug colunas CST
     st.write('▶ CST columns:', list(cst_df.columns))
-    if 'CST' not in cst_df.columns and 'Código' in cst_df.columns:
-        cst_df.rename(columns={'Código':'CST'}, inplace=True)
-    cst_df['CST'] = cst_df['CST'].astype(str).str.strip()
-    # Flags booleans
-    for flag in ['Exige Trib','Monofásica','Red. Alíq','Diferimento']:
-        cst_df[flag] = cst_df.get(flag,'NÃO').map(lambda v: BOOL_MAP.get(str(v).upper(), False))
-    # Percentuais de redução
-    for pct in ['% Red. IBS','% Red. CBS']:
-        if pct in cst_df.columns:
-            col = cst_df[pct].astype(str).str.rstrip('%')
-            cst_df[pct] = pd.to_numeric(col, errors='coerce').fillna(0) / 100
-        else:
-            cst_df[pct] = 0.0
-    # Alíquotas do CST
-    rates_dict = DEFAULT_RATES
-    if os.path.exists('aliquotas.json'):
-        rates_dict = json.load(open('aliquotas.json', encoding='utf-8'))
-    rates_df = pd.DataFrame.from_dict(rates_dict, orient='index').reset_index().rename(columns={'index':'CST'})
-    rates_df['CST'] = rates_df['CST'].astype(str).str.strip()
-    rates_df['PIS'] = pd.to_numeric(rates_df.get('PIS',0),errors='coerce').fillna(0)
-    rates_df['COFINS'] = pd.to_numeric(rates_df.get('COFINS',0),errors='coerce').fillna(0)
-    rates_df['ICMS'] = rates_df.get('ICMS',0).apply(lambda v: float(v) if str(v).replace('.','',1).isdigit() else v)
-    fb = DEFAULT_RATES['000']
-    for col in ['PIS','COFINS','ICMS']:
-        rates_df[col] = rates_df[col].where(rates_df[col].notna(), fb[col])
-    cst_df = cst_df.merge(rates_df, on='CST', how='left')
 
     # Parâmetros da Reforma
     st.sidebar.header('⚙️ Simulação Reforma')
@@ -92,62 +142,19 @@ def main():
     ibs_rate = st.sidebar.number_input('IBS (%)', 0.0, 100.0, 0.1) / 100
     st.markdown('---')
 
-    # Parse do XML e extração de dados
-    tmp = 'temp_nf.xml'
-    open(tmp, 'wb').write(xml_upl.read())
-    df_xml = ler_xml_universal(tmp)
-    os.remove(tmp)
-
-    # Valores do XML
-    df_val = df_xml[df_xml['path'].str.endswith('/prod/vProd')].assign(valor_produto=lambda d: d['text'].astype(float))[['path','valor_produto']]
-    df_val['item'] = df_val['path'].apply(extrai_item)
-    # CST do XML
-    df_cstxml = df_xml[df_xml['tag']=='CST'].rename(columns={'text':'CST'})[['path','CST']]
-    df_cstxml['item'] = df_cstxml['path'].apply(extrai_item)
-    # Merge CST + valores
-    df_itens = df_val.merge(df_cstxml[['item','CST']], on='item', how='left').merge(cst_df, on='CST', how='left')
+    # Itens do XML: uma linha por item, já tipada
+    xml_buffer = xml_upl.getbuffer()
+    df_itens = ler_xml(digest(xml_buffer), xml_buffer)
 
     # Integração NCM + tributos JSON
-    try:
-        ncm_dict = json.load(open('ncm_rates.json', encoding='utf-8'))
-    except FileNotFoundError:
+    if not os.path.exists('ncm_rates.json'):
         st.error('ncm_rates.json não encontrado.'); return
-    rates_ncm = pd.DataFrame.from_dict(ncm_dict, orient='index').reset_index().rename(columns={'index':'ncm'})
-    rates_ncm.rename(columns={'PIS':'PIS_json','COFINS':'COFINS_json','IPI':'IPI_json'}, inplace=True)
-    rates_ncm['ncm'] = rates_ncm['ncm'].astype(str).str.zfill(8)
-    for col in ['PIS_json','COFINS_json','IPI_json']:
-        rates_ncm[col] = pd.to_numeric(rates_ncm.get(col,0), errors='coerce').fillna(0)
-    df_ncm = df_xml[df_xml['path'].str.endswith('/prod/NCM')].assign(ncm=lambda d: d['text'])[['path','ncm']]
-    df_ncm['item'] = df_ncm['path'].apply(extrai_item)
-    df_all = df_itens.merge(df_ncm[['item','ncm']], on='item', how='left').merge(rates_ncm, on='ncm', how='left')
-    # Nome do produto
-    df_prod = df_xml[df_xml['path'].str.endswith('/prod/xProd')].assign(produto=lambda d: d['text'])[['path','produto']]
-    df_prod['item'] = df_prod['path'].apply(extrai_item)
-    df_all = df_all.merge(df_prod[['item','produto']], on='item', how='left')
-
-    # Cálculos Antes da Reforma
-    # Preparação de dados numéricos
-    # Coerce valor_produto para float e preencher nulos
-    df_all['valor_produto'] = pd.to_numeric(df_all['valor_produto'], errors='coerce').fillna(0)
-    # Garantir colunas de redução existam e preencham nulos
-    for pct_col in ['% Red. CBS','% Red. IBS']:
-        if pct_col in df_all.columns:
-            df_all[pct_col] = pd.to_numeric(df_all[pct_col], errors='coerce').fillna(0)
-        else:
-            df_all[pct_col] = 0.0
-    # Cálculos Antes da Reforma
-    df_all[['PIS_json','COFINS_json','IPI_json']] = df_all[['PIS_json','COFINS_json','IPI_json']].fillna(0)
-    df_all['valor_pis']    = df_all['valor_produto'] * df_all['PIS_json']
-    df_all['valor_cofins'] = df_all['valor_produto'] * df_all['COFINS_json']
-    df_all['valor_ipi']    = df_all['valor_produto'] * df_all['IPI_json']
-    df_all['valor_icms']   = df_all.apply(lambda r: r['valor_produto'] * r['ICMS'] if isinstance(r['ICMS'], (int,float)) else 0, axis=1)
-    df_all['Despesa Antes Reforma'] = df_all[['valor_pis','valor_cofins','valor_icms','valor_ipi']].sum(axis=1)
-
-    # Cálculos Pós da Reforma
-    df_all['CBS (%)']             = df_all['valor_produto'] * cbs_rate * (1 - df_all['% Red. CBS'])
-    df_all['IBS (%)']             = df_all['valor_produto'] * ibs_rate * (1 - df_all['% Red. IBS'])
-    df_all['Despesa Pós Reforma'] = df_all['CBS (%)'] + df_all['IBS (%)']
-    df_all['Diferença Tributária'] = df_all['Despesa Pós Reforma'] - df_all['Despesa Antes Reforma']
+    rates_ncm = carregar_ncm_rates('ncm_rates.json', mtime('ncm_rates.json'))
+    df_all = calcular_relatorio(df_itens, cst_df, rates_ncm, cbs_rate, ibs_rate)
+    sem_regra = df_all.loc[df_all['ncm_regra'].isna(), 'ncm'].dropna().unique()
+    if len(sem_regra):
+        st.warning(f"{len(sem_regra)} NCM(s) sem regra em ncm_rates.json (PIS/COFINS/IPI estimados em zero): "
+                   + ', '.join(map(str, sem_regra[:10])))
 
     # Debug de tipos e valores
     st.write("▶ Debug de Tipos e Valores:")
@@ -190,10 +197,11 @@ def main():
         'IBS (%)':'IBS (%)','Despesa Pós Reforma':'Despesa Pós Reforma',
         'Diferença Tributária':'Diferença Tributária'
     })
-    for c in ['Valor Produto','Despesa Antes Reforma','CBS (%)','IBS (%)','Despesa Pós Reforma','Diferença Tributária']:
-        csv_df[c] = csv_df[c].apply(fmt)
-    csv_cols = ['Produto','NCM','Valor Produto','Despesa Antes Reforma','CBS (%)','IBS (%)','Despesa Pós Reforma','Diferença Tributária']
-    csv_buffer = csv_df[csv_cols].to_csv(index=False, sep=';', encoding='utf-8-sig')
+    moeda_cols = ['Valor Produto','Despesa Antes Reforma','CBS (%)','IBS (%)','Despesa Pós Reforma','Diferença Tributária']
+    csv_cols = ['Produto','NCM'] + moeda_cols
+    # Formatação vetorizada (mesmo texto de fmt), gravada em blocos
+    with csv_dataframe(csv_df[csv_cols], formatos={c: formatar_moeda_br for c in moeda_cols}) as arquivo:
+        csv_buffer = arquivo.read()
     st.download_button('📥 Baixar CSV Formatado', csv_buffer, file_name='relatorio_reforma.csv', mime='text/csv')
 
 if __name__=='__main__':
@@ -9,13 +9,24 @@ from plotly.subplots import make_subplots
 import io
 import base64
 from decimal import Decimal
-from typing import List, Dict, Any
+from itertools import chain
+from typing import IO, List, Dict, Any
 import os
 
 # Imports locais
+from src.parser.cache import CACHE_DIR_PADRAO, hash_conteudo
 from src.parser.nf_parser import NFParser, NFParserError
 from src.calculo.calculadora_rti import CalculadoraTributaria
+from src.calculo.recalculo import AgregadosRTI
+from src.calculo.tabela_cst import ler_tabela_cst_compilada, TabelaCSTError
+from src.exportador.csv_streaming import csv_comparativos
+from src.exportador.excel_streaming import gerar_excel_streaming
+from src.exportador.linhas import COLUNAS_ITENS
+from src.processamento.arquivos import contar_xmls, e_compactado, iter_xmls
+from src.processamento.pipeline import ProcessadorLote, ResultadoArquivo
 from src.models import ConfigTributacao, NotaFiscal, CalculoComparativo
+from src.regras.registro import aliquota_padrao
+from src.util import telemetria
 from src.util.formatters import (
     format_currency, format_percentage, get_economy_message, 
     generate_summary_stats, validate_xml_nfe
@@ -91,16 +102,60 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 
+@st.cache_data(show_spinner=False, max_entries=8)
+def ler_tabela_cst_cache(digest: str, _conteudo: bytes) -> pd.DataFrame:
+    """Planilha de CST normalizada, lida uma única vez por conteúdo (digest; compilada em disco entre sessões)"""
+    return ler_tabela_cst_compilada(io.BytesIO(_conteudo), digest=digest)
+
+
+# Estado que precisa sobreviver aos reruns do Streamlit (interação com widgets)
+ESTADO_SESSAO = {
+    'calculator': None,
+    'notas_processadas': [],
+    'comparativos': [],
+    'comparativos_detalhados': None,
+    'agregados': None,
+    'cst_digest': None,
+    'xml_digests': None,
+    'telemetria': None,
+}
+
+
+def _estado_sessao(nome: str) -> property:
+    """Atributo da aplicação guardado em st.session_state"""
+    return property(lambda self: st.session_state[nome],
+                    lambda self, valor: st.session_state.__setitem__(nome, valor))
+
+
 class TributaryApp:
     """Classe principal da aplicação tributária"""
     
+    calculator: CalculadoraTributaria = _estado_sessao('calculator')
+    notas_processadas: List[NotaFiscal] = _estado_sessao('notas_processadas')
+    comparativos: List[CalculoComparativo] = _estado_sessao('comparativos')
+    agregados: AgregadosRTI = _estado_sessao('agregados')
+    
+    def definir_comparativos(self, comparativos: List[CalculoComparativo], com_detalhes: bool = False):
+        """Troca os comparativos; os detalhes por item só são remontados quando pedidos"""
+        self.comparativos = comparativos
+        st.session_state.comparativos_detalhados = comparativos if com_detalhes else None
+    
+    def comparativos_detalhados(self) -> List[CalculoComparativo]:
+        """Comparativos com detalhes por item, montados só para a tabela e as exportações"""
+        if st.session_state.comparativos_detalhados is None:
+            st.session_state.comparativos_detalhados = (
+                self.agregados.comparativos(self.calculator.config_rti, incluir_detalhes=True)
+                if self.agregados is not None and self.calculator else self.comparativos
+            )
+        return st.session_state.comparativos_detalhados
+    
     def __init__(self):
         self.parser = NFParser()
-        self.calculator = None
-        self.notas_processadas: List[NotaFiscal] = []
-        self.comparativos: List[CalculoComparativo] = []
         
         # Inicializa session state
+        for nome, padrao in ESTADO_SESSAO.items():
+            if nome not in st.session_state:
+                st.session_state[nome] = padrao
         if 'processed_files' not in st.session_state:
             st.session_state.processed_files = []
         if 'cst_loaded' not in st.session_state:
@@ -142,69 +197,20 @@ class TributaryApp:
     def load_cst_table(self, uploaded_file) -> bool:
         """Carrega e processa a tabela de CST"""
         try:
-            # Lê o arquivo Excel
-            df_raw = pd.read_excel(uploaded_file, header=None)
-            
-            # Encontra a linha do cabeçalho (onde está "CST")
-            header_row = None
-            for idx, row in df_raw.iterrows():
-                if any('CST' in str(cell) for cell in row if cell is not None):
-                    header_row = idx
-                    break
-            
-            if header_row is None:
-                st.error("Não foi possível encontrar o cabeçalho 'CST' na planilha")
-                return False
+            conteudo = uploaded_file.getvalue()
+            digest = hash_conteudo(conteudo)
+            df_cst = ler_tabela_cst_cache(digest, conteudo)
             
-            # Lê novamente com o cabeçalho correto
-            df_cst = pd.read_excel(uploaded_file, header=header_row)
-            
-            # Remove colunas unnamed
-            df_cst = df_cst.loc[:, ~df_cst.columns.str.contains('^Unnamed')]
-            
-            # Limpa nomes das colunas
-            df_cst.columns = df_cst.columns.str.strip()
-            
-            # Verifica colunas essenciais
-            required_cols = ['CST']
-            missing_cols = [col for col in required_cols if col not in df_cst.columns]
-            
-            if missing_cols:
-                st.error(f"Colunas obrigatórias não encontradas: {missing_cols}")
-                return False
-            
-            # Processa dados
-            df_cst = df_cst.dropna(subset=['CST'])
-            
-            # Padroniza coluna CST
-            df_cst['CST'] = df_cst['CST'].astype(str).str.strip()
-            
-            # Converte flags booleanos
-            bool_columns = ['Exige Trib', 'Monofásica', 'Red. Alíq', 'Diferimento']
-            for col in bool_columns:
-                if col in df_cst.columns:
-                    df_cst[col] = df_cst[col].astype(str).str.upper().map({
-                        'SIM': True, 'NÃO': False, 'NAO': False, 'TRUE': True, 'FALSE': False
-                    }).fillna(False)
-                else:
-                    df_cst[col] = False
-            
-            # Processa porcentagens de redução
-            pct_columns = ['% Red. CBS', '% Red. IBS']
-            for col in pct_columns:
-                if col in df_cst.columns:
-                    df_cst[col] = (df_cst[col].astype(str)
-                                  .str.replace('%', '')
-                                  .str.replace(',', '.')
-                                  .apply(lambda x: float(x) / 100 if x and x != 'nan' else 0))
-                else:
-                    df_cst[col] = 0.0
-            
-            # Inicializa calculadora
-            config = ConfigTributacao()
+            # Inicializa calculadora (por sessão: a configuração é alterada pela sidebar)
+            config = self.calculator.config_rti if self.calculator else ConfigTributacao()
             self.calculator = CalculadoraTributaria(config)
             self.calculator.carregar_tabela_cst(df_cst)
             
+            # Resultados calculados com outra tabela deixam de valer
+            self.definir_comparativos([])
+            self.agregados = None
+            st.session_state.xml_digests = None
+            st.session_state.cst_digest = digest
             st.session_state.cst_loaded = True
             
             # Mostra preview dos dados
@@ -215,6 +221,9 @@ class TributaryApp:
             
             return True
             
+        except TabelaCSTError as e:
+            st.error(str(e))
+            return False
         except Exception as e:
             st.error(f"Erro ao carregar tabela CST: {str(e)}")
             return False
@@ -222,35 +231,45 @@ class TributaryApp:
     def process_xml_files(self, uploaded_files: List) -> bool:
         """Processa arquivos XML das notas fiscais"""
         self.notas_processadas = []
-        self.comparativos = []
+        self.definir_comparativos([])
         
         progress_bar = st.progress(0)
         status_text = st.empty()
+        # Lotes ZIP/tar/gz são lidos membro a membro, direto da memória. tar.gz não é
+        # contado de antemão (seria descompactado duas vezes): o total cresce com o processamento
+        contagens = [contar_xmls(f.getvalue()) if e_compactado(f.name) else 1 for f in uploaded_files]
+        total = sum(contagem or 1 for contagem in contagens)
+        status_text.text(f"Processando {total}{'+' if None in contagens else ''} arquivo(s)...")
+        
+        def on_resultado(resultado: ResultadoArquivo, concluidos: int, total: int):
+            if resultado.descartado:
+                st.warning(f"⚠️ {resultado.nome} ignorado: {resultado.erro}")
+            elif resultado.erro_parser:
+                st.error(f"❌ Erro ao processar {resultado.nome}: {resultado.erro}")
+            elif not resultado.sucesso:
+                st.error(f"❌ Erro inesperado ao processar {resultado.nome}: {resultado.erro}")
+            status_text.text(f"Processado {resultado.nome} ({concluidos}/{total})")
+            progress_bar.progress(concluidos / total)
+        
+        # Só o parse vai para os workers (XMLs já vistos vêm do cache); resultados voltam na ordem do upload
+        processador = ProcessadorLote(cache_dir=CACHE_DIR_PADRAO)
+        entradas = chain.from_iterable(
+            iter_xmls(f.getvalue(), f.name) if e_compactado(f.name) else ((f.name, f.getbuffer()),)
+            for f in uploaded_files
+        )
+        resultados = processador.processar(entradas, on_resultado=on_resultado, total=total)
         
-        for i, uploaded_file in enumerate(uploaded_files):
-            try:
-                status_text.text(f"Processando {uploaded_file.name}...")
-                
-                # Lê conteúdo do arquivo
-                xml_content = uploaded_file.read().decode('utf-8')
-                
-                # Faz parse da nota fiscal (a validação já é feita internamente)
-                nota_fiscal = self.parser.parse_nota_fiscal(xml_content)
-                self.notas_processadas.append(nota_fiscal)
-                
-                # Calcula comparativo se calculadora estiver disponível
-                if self.calculator:
-                    comparativo = self.calculator.realizar_comparacao(nota_fiscal)
-                    self.comparativos.append(comparativo)
-                
-                progress_bar.progress((i + 1) / len(uploaded_files))
-                
-            except NFParserError as e:
-                st.error(f"❌ Erro ao processar {uploaded_file.name}: {str(e)}")
-                continue
-            except Exception as e:
-                st.error(f"❌ Erro inesperado ao processar {uploaded_file.name}: {str(e)}")
-                continue
+        for resultado in resultados:
+            if resultado.sucesso:
+                self.notas_processadas.append(resultado.nota_fiscal)
+        
+        # Somas por nota/faixa de redução: o resultado inicial e os recálculos da sidebar
+        # saem do mesmo motor (e do mesmo arredondamento)
+        if self.notas_processadas and self.calculator:
+            with telemetria.span('calculo') as span:
+                self.agregados = AgregadosRTI(self.notas_processadas, self.calculator.regras_cst)
+                self.definir_comparativos(self.agregados.comparativos(self.calculator.config_rti))
+                span.itens = len(self.agregados.colunas)
         
         status_text.text("Processamento concluído!")
         progress_bar.empty()
@@ -481,16 +500,20 @@ class TributaryApp:
         
         st.plotly_chart(fig, use_container_width=True)
     
-    def render_detailed_table(self):
-        """Renderiza tabela detalhada por item"""
+    def render_detailed_table(self) -> int:
+        """Renderiza tabela detalhada por item (devolve o número de itens exibidos)"""
         if not self.comparativos:
-            return
+            return 0
         
         st.markdown("### 📋 Detalhamento por Item")
         
+        # Os detalhes só são montados (e recalculados a cada alíquota) com a tabela aberta
+        if not st.checkbox("Mostrar detalhamento por item", value=False):
+            return 0
+        
         # Consolida todos os detalhes
         all_details = []
-        for i, comparativo in enumerate(self.comparativos):
+        for i, comparativo in enumerate(self.comparativos_detalhados()):
             for detail in comparativo.detalhes_por_item:
                 detail_copy = detail.copy()
                 detail_copy['nota'] = f"NF {comparativo.nota_fiscal.numero}"
@@ -498,7 +521,7 @@ class TributaryApp:
         
         if not all_details:
             st.warning("Nenhum detalhe disponível para exibição")
-            return
+            return 0
         
         # Cria DataFrame
         df_details = pd.DataFrame(all_details)
@@ -550,6 +573,8 @@ class TributaryApp:
             st.metric("📈 Itens com Aumento", stats['itens_com_aumento'])
         with col4:
             st.metric("➡️ Sem Alteração", stats['itens_sem_alteracao'])
+        
+        return len(all_details)
     
     def render_download_section(self):
         """Renderiza seção de download de relatórios"""
@@ -558,12 +583,13 @@ class TributaryApp:
         
         st.markdown("### 💾 Download de Relatórios")
         
-        col1, col2 = st.columns(2)
+        col1, col2, col3 = st.columns(3)
         
         with col1:
             # CSV detalhado
             if st.button("📄 Gerar Relatório CSV"):
-                csv_data = self.generate_csv_report()
+                with self.generate_csv_report() as arquivo:
+                    csv_data = arquivo.read()
                 st.download_button(
                     label="⬇️ Download CSV",
                     data=csv_data,
@@ -581,21 +607,41 @@ class TributaryApp:
                     file_name="resumo_executivo_rti.txt",
                     mime="text/plain"
                 )
+        
+        with col3:
+            # Planilha por item (gravada em streaming, com abas de resumo)
+            if st.button("📗 Gerar Planilha Excel"):
+                buffer = io.BytesIO()
+                gerar_excel_streaming(self.comparativos_detalhados(), buffer)
+                st.download_button(
+                    label="⬇️ Download Excel",
+                    data=buffer.getvalue(),
+                    file_name="relatorio_tributario_rti.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                )
     
-    def generate_csv_report(self) -> str:
-        """Gera relatório CSV detalhado"""
-        all_details = []
-        for comparativo in self.comparativos:
-            for detail in comparativo.detalhes_por_item:
-                detail_copy = detail.copy()
-                detail_copy['nota_numero'] = comparativo.nota_fiscal.numero
-                detail_copy['nota_serie'] = comparativo.nota_fiscal.serie
-                detail_copy['nota_data'] = comparativo.nota_fiscal.data_emissao
-                detail_copy['emitente'] = comparativo.nota_fiscal.razao_social_emitente
-                all_details.append(detail_copy)
+    def render_performance_panel(self):
+        """Tempos por etapa e arquivos mais lentos (com a medição ligada na sidebar)"""
+        coletor = st.session_state.telemetria
+        if coletor is None or not coletor.eventos:
+            return
         
-        df = pd.DataFrame(all_details)
-        return df.to_csv(index=False, sep=';', encoding='utf-8-sig')
+        with st.expander("⏱️ Tempos por etapa"):
+            st.dataframe(pd.DataFrame(coletor.resumo()), use_container_width=True, hide_index=True)
+            
+            lentos = sorted((span for span in coletor.spans() if span.get('arquivo')),
+                            key=lambda span: span['duracao_ms'], reverse=True)[:10]
+            if lentos:
+                st.markdown("**Arquivos mais lentos**")
+                st.dataframe(pd.DataFrame(lentos).reindex(columns=['arquivo', 'etapa', 'duracao_ms', 'itens']),
+                             use_container_width=True, hide_index=True)
+            
+            if st.button("🧹 Limpar medições"):
+                coletor.drenar()
+    
+    def generate_csv_report(self) -> IO[bytes]:
+        """Gera relatório CSV detalhado (em blocos, num arquivo temporário)"""
+        return csv_comparativos(self.comparativos_detalhados(), selecao=COLUNAS_ITENS[1:])
     
     def generate_executive_summary(self) -> str:
         """Gera resumo executivo em texto"""
@@ -649,7 +695,7 @@ Gerado em: {pd.Timestamp.now().strftime('%d/%m/%Y às %H:%M')}
             "CBS (%)",
             min_value=0.0,
             max_value=5.0,
-            value=0.9,
+            value=float(aliquota_padrao('CBS') * 100),
             step=0.1,
             help="Alíquota da Contribuição sobre Bens e Serviços"
         )
@@ -658,7 +704,7 @@ Gerado em: {pd.Timestamp.now().strftime('%d/%m/%Y às %H:%M')}
             "IBS (%)",
             min_value=0.0,
             max_value=30.0,
-            value=26.0,
+            value=float(aliquota_padrao('IBS') * 100),
             step=0.5,
             help="Alíquota do Imposto sobre Bens e Serviços"
         )
@@ -677,7 +723,7 @@ Gerado em: {pd.Timestamp.now().strftime('%d/%m/%Y às %H:%M')}
             "ISS (%)",
             min_value=0.0,
             max_value=10.0,
-            value=5.0,
+            value=float(aliquota_padrao('ISS') * 100),
             step=0.1,
             disabled=not incluir_iss,
             help="Percentual do ISS sobre a base de cálculo"
@@ -685,20 +731,41 @@ Gerado em: {pd.Timestamp.now().strftime('%d/%m/%Y às %H:%M')}
         
         # Atualiza configuração se mudou
         if self.calculator:
-            self.calculator.config_rti.aliquota_cbs = Decimal(str(cbs_rate / 100))
-            self.calculator.config_rti.aliquota_ibs = Decimal(str(ibs_rate / 100))
-            self.calculator.config_rti.incluir_iss = incluir_iss
-            self.calculator.config_rti.iss_percentual = Decimal(str(iss_rate / 100))
+            config = self.calculator.config_rti
+            anterior = (config.cbs_aliquota, config.ibs_aliquota, config.incluir_iss, config.iss_percentual)
+            config.cbs_aliquota = Decimal(str(cbs_rate)) / 100
+            config.ibs_aliquota = Decimal(str(ibs_rate)) / 100
+            config.incluir_iss = incluir_iss
+            config.iss_percentual = Decimal(str(iss_rate)) / 100
+            
+            # Recalcula a partir dos agregados: só os totais por faixa; os itens ficam para quando forem pedidos
+            if self.agregados and anterior != (config.cbs_aliquota, config.ibs_aliquota,
+                                               config.incluir_iss, config.iss_percentual):
+                self.definir_comparativos(self.agregados.comparativos(config))
+        
+        st.sidebar.markdown("---")
+        st.sidebar.markdown("### ⏱️ Desempenho")
+        
+        medir = st.sidebar.checkbox(
+            "Medir tempos por etapa",
+            value=st.session_state.telemetria is not None,
+            help="Registra triagem, parse, extração, cálculo, renderização e exportação de cada arquivo"
+        )
+        if medir:
+            if st.session_state.telemetria is None:
+                st.session_state.telemetria = telemetria.ColetorMemoria()
+            telemetria.adicionar(st.session_state.telemetria)
+        elif st.session_state.telemetria is not None:
+            telemetria.remover(st.session_state.telemetria)
+            st.session_state.telemetria = None
         
         st.sidebar.markdown("---")
         st.sidebar.markdown("### 📚 Recursos")
         
         if st.sidebar.button("🔄 Reprocessar Cálculos"):
             if self.notas_processadas and self.calculator:
-                self.comparativos = []
-                for nota in self.notas_processadas:
-                    comparativo = self.calculator.realizar_comparacao(nota)
-                    self.comparativos.append(comparativo)
+                self.agregados = AgregadosRTI(self.notas_processadas, self.calculator.regras_cst)
+                self.definir_comparativos(self.agregados.comparativos(self.calculator.config_rti))
                 st.rerun()
         
         st.sidebar.markdown("### ℹ️ Sobre a Aplicação")
@@ -729,7 +796,9 @@ Gerado em: {pd.Timestamp.now().strftime('%d/%m/%Y às %H:%M')}
                 help="Arquivo Excel com as configurações de CST para a RTI"
             )
             
-            if cst_file and not st.session_state.cst_loaded:
+            # Só relê a planilha quando o arquivo enviado muda
+            if cst_file and (not st.session_state.cst_loaded or self.calculator is None
+                             or hash_conteudo(cst_file.getvalue()) != st.session_state.cst_digest):
                 if self.load_cst_table(cst_file):
                     st.session_state.cst_loaded = True
         
@@ -737,29 +806,38 @@ Gerado em: {pd.Timestamp.now().strftime('%d/%m/%Y às %H:%M')}
             st.markdown("### 📄 Notas Fiscais (XML)")
             xml_files = st.file_uploader(
                 "Carregue os arquivos XML das Notas Fiscais",
-                type=['xml'],
+                type=['xml', 'zip', 'gz', 'tgz', 'tar'],
                 accept_multiple_files=True,
-                help="Aceita múltiplos arquivos XML de NF-e ou NFC-e"
+                help="Aceita múltiplos arquivos XML de NF-e ou NFC-e, soltos ou em lotes ZIP/tar.gz"
             )
         
         # Processamento
         if xml_files and st.session_state.cst_loaded:
             if st.button("🚀 Processar Análise Tributária", type="primary"):
-                if self.process_xml_files(xml_files):
+                digests = tuple(hash_conteudo(f.getbuffer()) for f in xml_files)
+                if digests == st.session_state.xml_digests and self.agregados is not None:
+                    # Mesmos arquivos: só recalcula com a configuração atual, sem novo parse
+                    self.definir_comparativos(self.agregados.comparativos(self.calculator.config_rti))
+                elif self.process_xml_files(xml_files):
                     st.session_state.processed_files = xml_files
+                    st.session_state.xml_digests = digests
         
         # Resultados
         if self.comparativos:
             st.markdown("---")
             st.markdown("## 📈 Resultados da Análise")
             
-            self.render_summary_metrics()
+            with telemetria.span('render', secao='metricas'):
+                self.render_summary_metrics()
             st.markdown("---")
-            self.render_detailed_comparison()
+            with telemetria.span('render', secao='comparacao'):
+                self.render_detailed_comparison()
             st.markdown("---")
-            self.render_detailed_table()
+            with telemetria.span('render', secao='tabela') as span:
+                span.itens = self.render_detailed_table()
             st.markdown("---")
             self.render_download_section()
+            self.render_performance_panel()
         
         elif xml_files and not st.session_state.cst_loaded:
             st.warning("⚠️ Carregue primeiro a tabela de CST para processar as notas fiscais")
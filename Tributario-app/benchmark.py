@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Benchmark reprodutível do parser, da calculadora e da geração de relatório
+
+Gera um corpus sintético de NF-e (tamanho, estilo de namespace e mistura de
+ICMS00/ICMS10/CSOSN/PISNT configuráveis) e mede cada etapa em um processo
+separado, para que o pico de RSS de uma etapa não contamine a outra.
+
+Exemplos:
+    python benchmark.py --notas 500 --itens 1,10,50
+    python benchmark.py --namespace misto --saida data/outputs/bench.json
+    python benchmark.py --comparar data/outputs/bench.json --tolerancia 0.25
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Dict, List, Optional
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+ETAPAS = ['parse_nota_fiscal', 'ler_xml_universal', 'extrair_itens_xml', 'realizar_comparacao', 'generate_csv_report']
+NAMESPACES = ['com', 'sem', 'prefixo', 'misto']
+NFE_NS = 'http://www.portalfiscal.inf.br/nfe'
+
+# Grupos de tributos sorteados por item: (peso, XML)
+ICMS_GRUPOS = [
+    (4, '<ICMS00><orig>0</orig><CST>00</CST><modBC>3</modBC><vBC>{v}</vBC><pICMS>18.00</pICMS>'
+        '<vICMS>{icms}</vICMS></ICMS00>'),
+    (2, '<ICMS10><orig>0</orig><CST>10</CST><modBC>3</modBC><vBC>{v}</vBC><pICMS>18.00</pICMS>'
+        '<vICMS>{icms}</vICMS><modBCST>4</modBCST><vBCST>{v}</vBCST><pICMSST>18.00</pICMSST>'
+        '<vICMSST>0.00</vICMSST></ICMS10>'),
+    (3, '<ICMSSN102><orig>0</orig><CSOSN>102</CSOSN></ICMSSN102>'),
+]
+PIS_GRUPOS = [
+    (3, '<PISAliq><CST>01</CST><vBC>{v}</vBC><pPIS>1.65</pPIS><vPIS>{pis}</vPIS></PISAliq>'),
+    (1, '<PISNT><CST>07</CST></PISNT>'),
+]
+NCMS = ['02061000', '22021000', '30049099', '84713012', '61091000']
+
+
+def _sortear(rng: random.Random, grupos):
+    return rng.choices([xml for _, xml in grupos], weights=[peso for peso, _ in grupos])[0]
+
+
+def gerar_nfe(rng: random.Random, numero: int, n_itens: int, namespace: str = 'com') -> str:
+    """Gera o XML de uma NF-e sintética (nfeProc) com ``n_itens`` itens"""
+    if namespace == 'misto':
+        namespace = rng.choice(NAMESPACES[:3])
+    prefixo = 'nfe:' if namespace == 'prefixo' else ''
+    xmlns = {'com': f' xmlns="{NFE_NS}"', 'sem': '', 'prefixo': f' xmlns:nfe="{NFE_NS}"'}[namespace]
+
+    dets = []
+    total = 0
+    for i in range(1, n_itens + 1):
+        valor_centavos = rng.randint(100, 500000)
+        total += valor_centavos
+        v = f'{valor_centavos / 100:.2f}'
+        icms = f'{valor_centavos * 0.18 / 100:.2f}'
+        pis = f'{valor_centavos * 0.0165 / 100:.2f}'
+        cofins = f'{valor_centavos * 0.076 / 100:.2f}'
+        dets.append(
+            f'<det nItem="{i}"><prod><cProd>{i}</cProd><xProd>Produto {numero}-{i}</xProd>'
+            f'<NCM>{rng.choice(NCMS)}</NCM><CFOP>5102</CFOP><uCom>UN</uCom><qCom>1.0000</qCom>'
+            f'<vUnCom>{v}</vUnCom><vProd>{v}</vProd></prod><imposto>'
+            f'<ICMS>{_sortear(rng, ICMS_GRUPOS).format(v=v, icms=icms)}</ICMS>'
+            f'<PIS>{_sortear(rng, PIS_GRUPOS).format(v=v, pis=pis)}</PIS>'
+            f'<COFINS><COFINSAliq><CST>01</CST><vBC>{v}</vBC><pCOFINS>7.60</pCOFINS>'
+            f'<vCOFINS>{cofins}</vCOFINS></COFINSAliq></COFINS></imposto></det>'
+        )
+
+    chave = f'2625060775062800015365012{numero:09d}1027022603'[:44]
+    xml = (
+        f'<?xml version="1.0" encoding="UTF-8"?><nfeProc{xmlns} versao="4.00"><NFe>'
+        f'<infNFe Id="NFe{chave}" versao="4.00">'
+        f'<ide><cUF>26</cUF><serie>1</serie><nNF>{numero}</nNF><dhEmi>2025-06-10T10:00:00-03:00</dhEmi>'
+        f'<mod>55</mod></ide>'
+        f'<emit><CNPJ>07750628000153</CNPJ><xNome>Emitente SA</xNome></emit>'
+        f'<dest><CNPJ>12345678000195</CNPJ><xNome>Destinatario LTDA</xNome></dest>'
+        + ''.join(dets) +
+        f'<total><ICMSTot><vProd>{total / 100:.2f}</vProd><vNF>{total / 100:.2f}</vNF></ICMSTot></total>'
+        f'</infNFe></NFe></nfeProc>'
+    )
+    if prefixo:
+        # Mesmo documento com todos os elementos qualificados pelo prefixo nfe:
+        xml = xml.replace('</', '\0').replace('<', '<' + prefixo).replace('\0', '</' + prefixo)
+        xml = xml.replace('<' + prefixo + '?xml', '<?xml')
+    return xml
+
+
+def gerar_corpus(notas: int, itens: List[int], namespace: str, seed: int) -> List[str]:
+    """Corpus determinístico: a contagem de itens alterna entre os valores de ``itens``"""
+    rng = random.Random(seed)
+    return [gerar_nfe(rng, n + 1, itens[n % len(itens)], namespace) for n in range(notas)]
+
+
+def pico_rss_mb() -> Optional[float]:
+    """Pico de memória residente do processo atual, em MB"""
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / (1024 * 1024)
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa em KB, macOS em bytes
+    return pico / (1024 * 1024) if sys.platform == 'darwin' else pico / 1024
+
+
+def _criar_calculadora():
+    import pandas as pd
+    from src.calculo.calculadora_rti import CalculadoraTributaria
+
+    calculadora = CalculadoraTributaria()
+    calculadora.carregar_tabela_cst(pd.DataFrame({
+        'CST': ['000', '200', '410'],
+        'Exige Trib': [True, True, False],
+        '% Red. CBS': [0, 0.6, 0],
+        '% Red. IBS': [0, 0.6, 0],
+    }))
+    return calculadora
+
+
+def executar_etapa(etapa: str, notas: int, itens: List[int], namespace: str, seed: int,
+                   repeticoes: int = 1) -> Dict:
+    """Executa uma etapa sobre o corpus e devolve tempo (melhor repetição) e pico de RSS"""
+    from src.parser.nf_parser import NFParser
+
+    corpus = gerar_corpus(notas, itens, namespace, seed)
+    parser = NFParser()
+    total_itens = sum(itens[n % len(itens)] for n in range(notas))
+
+    # Entradas de cada etapa são preparadas fora da medição
+    if etapa == 'parse_nota_fiscal':
+        def rodar():
+            for xml in corpus:
+                parser.parse_nota_fiscal(xml)
+    elif etapa == 'ler_xml_universal':
+        from src.parser.xml_parser import ler_xml_universal
+        conteudos = [xml.encode('utf-8') for xml in corpus]
+
+        def rodar():
+            for conteudo in conteudos:
+                ler_xml_universal(io.BytesIO(conteudo))
+    elif etapa == 'extrair_itens_xml':
+        from src.parser.xml_parser import extrair_itens_xml
+        conteudos = [xml.encode('utf-8') for xml in corpus]
+
+        def rodar():
+            for conteudo in conteudos:
+                extrair_itens_xml(io.BytesIO(conteudo))
+    elif etapa == 'realizar_comparacao':
+        calculadora = _criar_calculadora()
+        notas_fiscais = [parser.parse_nota_fiscal(xml) for xml in corpus]
+
+        def rodar():
+            for nota in notas_fiscais:
+                calculadora.realizar_comparacao(nota)
+    elif etapa == 'generate_csv_report':
+        # Mesmo exportador do botão "Gerar Relatório CSV" do app_new
+        from src.exportador.csv_streaming import csv_comparativos
+        from src.exportador.linhas import COLUNAS_ITENS
+
+        calculadora = _criar_calculadora()
+        comparativos = [calculadora.realizar_comparacao(parser.parse_nota_fiscal(xml)) for xml in corpus]
+
+        def rodar():
+            with csv_comparativos(comparativos, selecao=COLUNAS_ITENS[1:]) as arquivo:
+                arquivo.read()
+    else:
+        raise ValueError(f"Etapa desconhecida: {etapa}")
+
+    rss_base = pico_rss_mb()
+    tempos = []
+    for _ in range(max(1, repeticoes)):
+        inicio = time.perf_counter()
+        rodar()
+        tempos.append(time.perf_counter() - inicio)
+
+    segundos = min(tempos)
+    pico = pico_rss_mb()
+    return {
+        'segundos': round(segundos, 6),
+        'docs_por_s': round(notas / segundos, 2) if segundos else None,
+        'itens_por_s': round(total_itens / segundos, 2) if segundos else None,
+        'pico_rss_mb': round(pico, 2) if pico is not None else None,
+        'rss_base_mb': round(rss_base, 2) if rss_base is not None else None,
+    }
+
+
+def comparar(atual: Dict, base: Dict, tolerancia: float) -> List[str]:
+    """Lista as etapas cuja vazão caiu mais que ``tolerancia`` em relação à base"""
+    regressoes = []
+    for etapa, medida in atual['etapas'].items():
+        anterior = base.get('etapas', {}).get(etapa)
+        if not anterior or not anterior.get('docs_por_s') or not medida.get('docs_por_s'):
+            continue
+        queda = 1 - medida['docs_por_s'] / anterior['docs_por_s']
+        if queda > tolerancia:
+            regressoes.append(f"{etapa}: {anterior['docs_por_s']:.1f} -> {medida['docs_por_s']:.1f} docs/s "
+                              f"({queda:.0%} mais lento)")
+    return regressoes
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark do parser, cálculo RTI e relatório CSV.")
+    parser.add_argument('--notas', type=int, default=200, help="Número de notas do corpus (padrão: 200)")
+    parser.add_argument('--itens', default='1,10,50',
+                        help="Itens por nota, separados por vírgula; alternados entre as notas (padrão: 1,10,50)")
+    parser.add_argument('--namespace', choices=NAMESPACES, default='com', help="Estilo de namespace dos XMLs")
+    parser.add_argument('--etapas', default=','.join(ETAPAS), help="Etapas a medir, separadas por vírgula")
+    parser.add_argument('--repeticoes', type=int, default=3, help="Repetições por etapa; vale a melhor (padrão: 3)")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--saida', default=None, help="Arquivo JSON de saída (padrão: stdout)")
+    parser.add_argument('--comparar', default=None, help="JSON de uma execução anterior para detectar regressões")
+    parser.add_argument('--tolerancia', type=float, default=0.2,
+                        help="Queda de vazão tolerada em --comparar (padrão: 0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    itens = [int(n) for n in args.itens.split(',') if n.strip()]
+    etapas = [e.strip() for e in args.etapas.split(',') if e.strip()]
+    desconhecidas = set(etapas) - set(ETAPAS)
+    if desconhecidas or not itens or args.notas < 1:
+        print(f"❌ Parâmetros inválidos: etapas {sorted(desconhecidas)}" if desconhecidas
+              else "❌ --notas e --itens precisam ser positivos", file=sys.stderr)
+        return 2
+
+    resultado = {
+        'corpus': {'notas': args.notas, 'itens': itens, 'namespace': args.namespace, 'seed': args.seed,
+                   'total_itens': sum(itens[n % len(itens)] for n in range(args.notas))},
+        'ambiente': {'python': platform.python_version(), 'plataforma': platform.platform(),
+                     'cpus': os.cpu_count()},
+        'etapas': {},
+    }
+
+    # Um processo novo por etapa: o pico de RSS fica isolado
+    for etapa in etapas:
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+            medida = executor.submit(executar_etapa, etapa, args.notas, itens, args.namespace,
+                                     args.seed, args.repeticoes).result()
+        resultado['etapas'][etapa] = medida
+        print(f"⏱️ {etapa}: {medida['segundos']:.3f}s | {medida['docs_por_s']} docs/s | "
+              f"{medida['itens_por_s']} itens/s | pico {medida['pico_rss_mb']} MB", file=sys.stderr)
+
+    texto = json.dumps(resultado, indent=2, ensure_ascii=False)
+    if args.saida:
+        os.makedirs(os.path.dirname(os.path.abspath(args.saida)), exist_ok=True)
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            f.write(texto)
+    else:
+        print(texto)
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            regressoes = comparar(resultado, json.load(f), args.tolerancia)
+        for regressao in regressoes:
+            print(f"⚠️ Regressão: {regressao}", file=sys.stderr)
+        if regressoes:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
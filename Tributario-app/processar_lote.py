@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Processamento em lote (sem interface) de NF-e: comparação Atual vs RTI
+
+Exemplos:
+    python processar_lote.py data/xmls/
+    python processar_lote.py "data/xmls/2025-*/*.xml" --workers 8 --cbs 0.9 --ibs 26
+    python processar_lote.py downloads/sefaz_2025-06.zip
+    python processar_lote.py data/xmls/ --xsd data/schemas/
+    python processar_lote.py data/xmls/ --excel
+
+Arquivos de lote (raiz <enviNFe>) e XMLs acima de LIMITE_STREAMING são lidos em
+streaming (NFStreamParser), uma nota por vez, sem carregar o documento inteiro;
+cada nota vai ao pipeline já parseada, só para o cálculo.
+"""
+import argparse
+import csv
+import glob
+import os
+import sys
+import time
+from datetime import datetime
+from itertools import chain
+from decimal import Decimal
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Tuple
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from src.calculo.calculadora_rti import CalculadoraTributaria
+from src.calculo.calculadora_vetorizada import ARREDONDAMENTO, CENTAVO
+from src.calculo.tabela_cst import CACHE_CST_DIR_PADRAO, TabelaCSTError, ler_tabela_cst_compilada
+from src.exportador.linhas import COLUNAS_ITENS, COLUNAS_MONETARIAS, COLUNAS_PERCENTUAIS, linhas_comparativo
+from src.models import ConfigTributacao
+from src.parser.nf_parser import NFParserError
+from src.parser.nf_stream import NFStreamParser
+from src.parser.triagem import triar
+from src.processamento.arquivos import MembroInvalido, e_compactado, iter_xmls
+from src.processamento.pipeline import Conteudo, ProcessadorLote, ResultadoArquivo
+from src.regras.registro import aliquota_padrao
+from src.util import telemetria
+
+# Parquet (pyarrow) e Excel (openpyxl) só são importados com --parquet/--excel
+if TYPE_CHECKING:
+    from src.armazenamento.corpus_parquet import CorpusParquet
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CST_PADRAO = os.path.join(BASE_DIR, '..', 'dados', 'Tabela de CST e CLASSIFICAÇÃO TRIBUTARIA.xlsx')
+SAIDA_PADRAO = os.path.join(BASE_DIR, 'data', 'outputs')
+LOTE_PARQUET = 5000
+LIMITE_STREAMING = 16 * 1024 * 1024  # XMLs maiores que isso são lidos nota a nota
+RAIZES_LOTE = {'enviNFe'}
+
+COLUNAS_NOTAS = [
+    'arquivo', 'numero', 'serie', 'data_emissao', 'chave_acesso', 'cnpj_emitente', 'emitente',
+    'valor_total_produtos', 'PIS', 'COFINS', 'IPI', 'ICMS', 'ISS', 'total_atual',
+    'CBS', 'IBS', 'total_rti', 'diferenca'
+]
+_POSICOES_DECIMAIS = [COLUNAS_ITENS.index(coluna) for coluna in COLUNAS_MONETARIAS + COLUNAS_PERCENTUAIS]
+
+
+def centavos(valor: Decimal) -> Decimal:
+    """Valor gravado no CSV com 2 casas (CBS/IBS e percentuais saem do cálculo sem arredondar)"""
+    return valor.quantize(CENTAVO, rounding=ARREDONDAMENTO) if isinstance(valor, Decimal) else valor
+
+
+def listar_xmls(entradas: List[str], recursivo: bool = False) -> List[Path]:
+    """Expande diretórios, globs e arquivos em uma lista ordenada de XMLs e lotes compactados"""
+    arquivos = set()
+    for entrada in entradas:
+        caminho = Path(entrada)
+        if caminho.is_dir():
+            padrao = '**/*' if recursivo else '*'
+            arquivos.update(p for p in caminho.glob(padrao)
+                            if (p.suffix.lower() == '.xml' or e_compactado(p.name)) and p.is_file())
+        elif caminho.is_file():
+            arquivos.add(caminho)
+        else:
+            arquivos.update(Path(p) for p in glob.glob(entrada, recursive=recursivo) if os.path.isfile(p))
+    return sorted(arquivos)
+
+
+def e_lote(caminho: Path) -> bool:
+    """True para arquivos de lote (<enviNFe>) ou grandes demais para o parse completo"""
+    try:
+        if caminho.stat().st_size > LIMITE_STREAMING:
+            return True
+        with open(caminho, 'rb') as arquivo:
+            return triar(arquivo).raiz in RAIZES_LOTE
+    except OSError:
+        return False  # o erro de leitura aparece no resultado do próprio arquivo
+
+
+def notas_do_lote(caminho: Path) -> Iterator[Tuple[str, Conteudo]]:
+    """Uma entrada ``arquivo#n`` por nota do lote, extraída em streaming"""
+    try:
+        for numero, nota in enumerate(NFStreamParser().iter_notas(caminho), 1):
+            yield f"{caminho.name}#{numero}", nota
+    except (NFParserError, OSError) as e:
+        yield caminho.name, MembroInvalido(str(e))
+
+
+def expandir_arquivos(arquivos: Iterable[Path], streaming: bool = True) -> Iterator[Tuple[str, Conteudo]]:
+    """
+    Pares (nome, conteúdo) para o pipeline; ZIP/tar/gz são lidos membro a membro,
+    sem extrair, e lotes (com ``streaming``) nota a nota
+    """
+    def expandir(caminho: Path) -> Iterable[Tuple[str, Conteudo]]:
+        if e_compactado(caminho.name):
+            return iter_xmls(caminho, caminho.name)
+        if streaming and e_lote(caminho):
+            return notas_do_lote(caminho)
+        return ((caminho.name, caminho),)
+
+    return chain.from_iterable(map(expandir, arquivos))
+
+
+def criar_calculadora(args: argparse.Namespace) -> CalculadoraTributaria:
+    """Monta a calculadora com a tabela de CST e as alíquotas informadas"""
+    config = ConfigTributacao(
+        cbs_aliquota=Decimal(str(args.cbs)) / 100,
+        ibs_aliquota=Decimal(str(args.ibs)) / 100,
+        incluir_iss=args.iss is not None,
+        iss_percentual=Decimal(str(args.iss)) / 100 if args.iss is not None else aliquota_padrao('ISS')
+    )
+    calculadora = CalculadoraTributaria(config)
+    # Planilha compilada em disco: só o primeiro processamento de cada versão lê o Excel
+    calculadora.carregar_tabela_cst(ler_tabela_cst_compilada(args.cst, cache_dir=args.cache or CACHE_CST_DIR_PADRAO))
+    return calculadora
+
+
+def linhas_resultado(resultado: ResultadoArquivo) -> Tuple[Iterator[list], list]:
+    """Gera as linhas de itens e a linha consolidada de uma nota processada"""
+    nota = resultado.nota_fiscal
+    comparativo = resultado.comparativo
+    atual = {tributo: centavos(valor) for tributo, valor in comparativo.tributacao_atual.items()}
+    nova = {tributo: centavos(valor) for tributo, valor in comparativo.tributacao_nova.items()}
+
+    def item(linha: list) -> list:
+        for posicao in _POSICOES_DECIMAIS:
+            linha[posicao] = centavos(linha[posicao])
+        return linha
+
+    itens = (item(linha) for linha in linhas_comparativo(comparativo, resultado.nome))
+
+    linha_nota = [
+        resultado.nome, nota.numero, nota.serie, nota.data_emissao, nota.chave_acesso,
+        nota.cnpj_emitente, nota.razao_social_emitente, nota.valor_total_produtos,
+        atual['PIS'], atual['COFINS'], atual['IPI'], atual['ICMS'], atual['ISS'], atual['TOTAL'],
+        nova['CBS'], nova['IBS'], nova['TOTAL'], nova['TOTAL'] - atual['TOTAL']
+    ]
+    return itens, linha_nota
+
+
+def gravar_parquet(corpus: 'CorpusParquet', notas: list):
+    with telemetria.span('exportacao', formato='parquet', notas=len(notas)) as span:
+        corpus.gravar(notas)
+        span.itens = sum(len(nota.itens) for nota in notas)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Compara a tributação atual com a RTI para um diretório de NF-e, sem interface."
+    )
+    parser.add_argument('entradas', nargs='+', help="Diretórios, arquivos ou globs de XML (ex.: data/xmls/)")
+    parser.add_argument('--cst', default=CST_PADRAO, help="Planilha de CST e Classificação Tributária")
+    parser.add_argument('--saida', default=SAIDA_PADRAO, help="Diretório de saída (padrão: data/outputs)")
+    parser.add_argument('--workers', type=int, default=None, help="Processos de trabalho (padrão: nº de CPUs)")
+    parser.add_argument('--recursivo', '-r', action='store_true', help="Busca XMLs em subdiretórios")
+    cbs, ibs = (float(aliquota_padrao(tributo) * 100) for tributo in ('CBS', 'IBS'))
+    parser.add_argument('--cbs', type=float, default=cbs, help=f"Alíquota CBS em %% (padrão vigente: {cbs:g})")
+    parser.add_argument('--ibs', type=float, default=ibs, help=f"Alíquota IBS em %% (padrão vigente: {ibs:g})")
+    parser.add_argument('--iss', type=float, default=None, help="Inclui ISS com o percentual informado")
+    parser.add_argument('--cache', default=None, metavar='DIR',
+                        help="Diretório do cache de notas parseadas (reprocessamentos pulam o parse); "
+                             "também guarda a tabela de CST compilada (padrão: data/cache)")
+    parser.add_argument('--parquet', default=None, metavar='DIR',
+                        help="Acrescenta as notas processadas ao corpus Parquet do diretório")
+    parser.add_argument('--xsd', default=None, metavar='DIR',
+                        help="Valida cada NF-e contra os schemas do leiaute 4.00 (diretório do PL ou .xsd)")
+    parser.add_argument('--excel', action='store_true',
+                        help="Gera também a planilha Excel por item (streaming, com abas de resumo)")
+    parser.add_argument('--trace', default=None, metavar='ARQUIVO',
+                        help="Grava eventos e tempos por etapa (triagem, parse, cálculo...) em JSON lines")
+    args = parser.parse_args(argv)
+
+    arquivos = listar_xmls(args.entradas, args.recursivo)
+    if not arquivos:
+        print("❌ Nenhum arquivo XML encontrado", file=sys.stderr)
+        return 2
+
+    try:
+        calculadora = criar_calculadora(args)
+    except (OSError, TabelaCSTError) as e:
+        print(f"❌ Erro ao carregar tabela CST: {e}", file=sys.stderr)
+        return 2
+
+    os.makedirs(args.saida, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    caminho_itens = os.path.join(args.saida, f"comparativo_itens_{timestamp}.csv")
+    caminho_notas = os.path.join(args.saida, f"comparativo_notas_{timestamp}.csv")
+    caminho_erros = os.path.join(args.saida, f"erros_{timestamp}.csv")
+    caminho_excel = os.path.join(args.saida, f"comparativo_{timestamp}.xlsx")
+
+    print(f"🚀 Processando {len(arquivos)} arquivo(s)...")
+    inicio = time.perf_counter()
+    try:
+        processador = ProcessadorLote(calculadora, max_workers=args.workers, cache_dir=args.cache, xsd=args.xsd)
+    except (OSError, ValueError) as e:
+        print(f"❌ Erro ao carregar schemas XSD: {e}", file=sys.stderr)
+        return 2
+    trace = telemetria.adicionar(telemetria.ArquivoJSONL(args.trace)) if args.trace else None
+    total_atual = total_rti = Decimal('0')
+    sucesso = 0
+    erros = []
+    descartados = 0
+    corpus = planilha = None
+    if args.parquet:
+        from src.armazenamento.corpus_parquet import CorpusParquet
+        corpus = CorpusParquet(args.parquet)
+    pendentes = []
+    if args.excel:
+        from src.exportador.excel_streaming import PlanilhaStreaming
+        planilha = PlanilhaStreaming(caminho_excel)
+
+    with open(caminho_itens, 'w', newline='', encoding='utf-8-sig') as f_itens, \
+         open(caminho_notas, 'w', newline='', encoding='utf-8-sig') as f_notas:
+        csv_itens = csv.writer(f_itens, delimiter=';')
+        csv_notas = csv.writer(f_notas, delimiter=';')
+        csv_itens.writerow(COLUNAS_ITENS)
+        csv_notas.writerow(COLUNAS_NOTAS)
+
+        # Resultados vão direto para o disco, na ordem dos arquivos de entrada
+        # Com --xsd os lotes seguem inteiros para o worker, que valida o documento
+        entradas = expandir_arquivos(arquivos, streaming=not args.xsd)
+        for resultado in processador.processar_ordenado(entradas):
+            if not resultado.sucesso:
+                if resultado.descartado:
+                    tipo = f"descartado:{resultado.tipo_documento}"
+                    descartados += 1
+                elif resultado.erros_xsd:
+                    erros.append((resultado.nome, 'xsd', ' | '.join(resultado.erros_xsd)))
+                    continue
+                else:
+                    tipo = 'parser' if resultado.erro_parser else 'inesperado'
+                erros.append((resultado.nome, tipo, resultado.erro))
+                continue
+
+            with telemetria.contexto(arquivo=resultado.nome), telemetria.span('exportacao', formato='csv') as span:
+                itens, linha_nota = linhas_resultado(resultado)
+                csv_itens.writerows(itens)
+                csv_notas.writerow(linha_nota)
+                span.itens = len(resultado.nota_fiscal.itens)
+            if planilha is not None:
+                planilha.adicionar(resultado.comparativo, resultado.nome)
+            total_atual += resultado.comparativo.tributacao_atual['TOTAL']
+            total_rti += resultado.comparativo.tributacao_nova['TOTAL']
+            sucesso += 1
+            if corpus is not None:
+                pendentes.append(resultado.nota_fiscal)
+                if len(pendentes) >= LOTE_PARQUET:
+                    gravar_parquet(corpus, pendentes)
+                    pendentes = []
+
+    if corpus is not None and pendentes:
+        gravar_parquet(corpus, pendentes)
+    if planilha is not None:
+        planilha.fechar()
+
+    if erros:
+        with open(caminho_erros, 'w', newline='', encoding='utf-8-sig') as f_erros:
+            csv_erros = csv.writer(f_erros, delimiter=';')
+            csv_erros.writerow(['arquivo', 'tipo', 'erro'])
+            csv_erros.writerows(sorted(erros))
+
+    if trace is not None:
+        telemetria.remover(trace)
+        trace.fechar()
+
+    duracao = time.perf_counter() - inicio
+    print(f"✅ {sucesso} nota(s) processada(s), {len(erros) - descartados} erro(s), "
+          f"{descartados} descartado(s) na triagem em {duracao:.1f}s")
+    print(f"   Tributação atual: {total_atual:.2f} | RTI: {total_rti:.2f} | Diferença: {total_rti - total_atual:.2f}")
+    print(f"📄 Itens: {caminho_itens}")
+    print(f"📄 Notas: {caminho_notas}")
+    if planilha is not None:
+        print(f"📗 Excel: {caminho_excel}")
+    if corpus is not None:
+        print(f"🗄️ Corpus Parquet: {args.parquet}")
+    if trace is not None:
+        print(f"⏱️ Trace: {args.trace}")
+    if erros:
+        print(f"⚠️ Erros: {caminho_erros}")
+
+    return 0 if sucesso else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
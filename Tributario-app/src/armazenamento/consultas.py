@@ -0,0 +1,190 @@
+"""
+Consultas agregadas sobre o corpus Parquet (Atual vs RTI por NCM, CFOP, CST, emitente e mês)
+
+As consultas leem apenas os rollups gravados junto com o corpus (somas por
+mês, emitente, NCM, CFOP e CST), com os filtros empurrados para o Arrow: as
+partições de mês/emitente são podadas pelo caminho e os demais filtros usam as
+estatísticas dos row groups. CBS e IBS são recalculados por CST sobre essas
+somas, com as mesmas regras da CalculadoraVetorizada, então trocar as
+alíquotas não exige reler XML nem itens.
+
+Exemplos:
+    consulta = ConsultaCorpus(CorpusParquet('data/corpus'), regras_cst=calculadora.regras_cst)
+    consulta.agregar(['mes', 'capitulo_ncm'])
+    consulta.top_emitentes(10, periodo=('2025-01', '2025-06'))
+"""
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from ..calculo.calculadora_vetorizada import CalculadoraVetorizada
+from ..calculo.tabela_cst import RegraCST
+from ..models import ConfigTributacao
+from .corpus_parquet import DIMENSOES_ROLLUP, MEDIDAS_ROLLUP, PARTICOES, CorpusParquet
+
+
+DIMENSOES = PARTICOES + DIMENSOES_ROLLUP
+MEDIDAS = [
+    'n_itens', 'valor_produto', 'pis_atual', 'cofins_atual', 'ipi_atual', 'icms_atual', 'iss_atual',
+    'total_atual', 'cbs_novo', 'ibs_novo', 'total_rti', 'diferenca',
+]
+MAX_CACHE = 16
+
+
+class ConsultaCorpus:
+    """Agregações ad hoc sobre os rollups de um CorpusParquet"""
+
+    def __init__(self, corpus: CorpusParquet, config_rti: ConfigTributacao = None,
+                 regras_cst: Optional[Mapping[str, RegraCST]] = None):
+        self.corpus = corpus
+        self.config_rti = config_rti or ConfigTributacao()
+        self.regras_cst = regras_cst or {}
+        # Leituras recentes por (dimensões, filtros, arquivos do dataset)
+        self._cache: Dict[Tuple, pd.DataFrame] = {}
+
+    @staticmethod
+    def _filtro(filtros: Mapping[str, Sequence[str]],
+                periodo: Optional[Tuple[Optional[str], Optional[str]]]) -> Optional[ds.Expression]:
+        expressao = None
+        condicoes = []
+        for dimensao, valores in filtros.items():
+            if dimensao not in DIMENSOES:
+                raise ValueError(f"Dimensão desconhecida: {dimensao} (use {', '.join(DIMENSOES)})")
+            if isinstance(valores, str):
+                valores = [valores]
+            condicoes.append(ds.field(dimensao).isin([str(v) for v in valores]))
+        if periodo is not None:
+            inicio, fim = periodo
+            if inicio:
+                condicoes.append(ds.field('mes') >= inicio)
+            if fim:
+                condicoes.append(ds.field('mes') <= fim)
+        for condicao in condicoes:
+            expressao = condicao if expressao is None else expressao & condicao
+        return expressao
+
+    def _ler(self, dimensoes: List[str], filtros: Mapping[str, Sequence[str]],
+             periodo: Optional[Tuple[Optional[str], Optional[str]]]) -> pd.DataFrame:
+        """Rollups filtrados, somados por dimensões + CST (base do recálculo)"""
+        dataset = self.corpus._dataset(self.corpus.caminho_rollups)
+        arquivos = tuple(dataset.files) if dataset is not None else ()
+        chave = (tuple(dimensoes), tuple(sorted((k, tuple(v) if not isinstance(v, str) else (v,))
+                                                for k, v in filtros.items())), periodo, arquivos)
+        if chave in self._cache:
+            return self._cache[chave]
+
+        chaves = list(dict.fromkeys(dimensoes + ['cst']))
+        tabela = self.corpus.ler_tabela('rollups', chaves + MEDIDAS_ROLLUP,
+                                        filtro=self._filtro(filtros, periodo))
+        # Cada arquivo tem seu próprio dicionário: as chaves são agrupadas como texto
+        for dimensao in chaves:
+            posicao = tabela.schema.get_field_index(dimensao)
+            tabela = tabela.set_column(posicao, dimensao, pc.cast(tabela.column(dimensao), pa.string()))
+        agregado = tabela.group_by(chaves, use_threads=False).aggregate(
+            [(medida, 'sum') for medida in MEDIDAS_ROLLUP]
+        )
+        df = agregado.to_pandas()
+        df.columns = [nome[:-len('_sum')] if nome.endswith('_sum') else nome for nome in df.columns]
+        for dimensao in chaves:
+            df[dimensao] = df[dimensao].astype(object)
+
+        if len(self._cache) >= MAX_CACHE:
+            self._cache.pop(next(iter(self._cache)))
+        self._cache[chave] = df
+        return df
+
+    def agregar(self, por: Sequence[str], config_rti: ConfigTributacao = None,
+                ordenar_por: Optional[str] = None, limite: Optional[int] = None,
+                periodo: Optional[Tuple[Optional[str], Optional[str]]] = None,
+                **filtros: Sequence[str]) -> pd.DataFrame:
+        """
+        Totais Atual vs RTI agrupados pelas dimensões pedidas
+
+        Args:
+            por: dimensões de agrupamento (``mes``, ``cnpj_emitente``,
+                ``capitulo_ncm``, ``ncm``, ``cfop``, ``cst``); vazio = total geral
+            config_rti: alíquotas (padrão: as da consulta)
+            ordenar_por: medida para ordenação decrescente (ex.: ``'diferenca'``)
+            limite: número máximo de linhas
+            periodo: intervalo de meses ``('2025-01', '2025-06')``, extremos inclusivos
+            **filtros: valores aceitos por dimensão, ex. ``cfop=['5102']``
+
+        Returns:
+            DataFrame com as medidas em reais (``MEDIDAS``) e ``economia_percentual``
+        """
+        por = list(por)
+        for dimensao in por:
+            if dimensao not in DIMENSOES:
+                raise ValueError(f"Dimensão desconhecida: {dimensao} (use {', '.join(DIMENSOES)})")
+        config = config_rti or self.config_rti
+        base = self._ler(por, filtros, periodo)
+
+        # CBS/IBS por CST, como no motor vetorizado (fatores já zerados se o tributo não é exigido)
+        calculadora = CalculadoraVetorizada(config, self.regras_cst)
+        inverso, fator_cbs, fator_ibs = calculadora.fatores_por_cst(base['cst'].to_numpy())
+        valor = base['valor_produto'].to_numpy(dtype=np.float64)
+
+        atuais = base[['pis', 'cofins', 'ipi', 'icms']].to_numpy(dtype=np.float64)
+        total_atual = atuais.sum(axis=1)
+        iss = total_atual * float(config.iss_percentual) if config.incluir_iss else np.zeros(len(base))
+        cbs = valor * fator_cbs[inverso] * float(config.cbs_aliquota)
+        ibs = valor * fator_ibs[inverso] * float(config.ibs_aliquota)
+
+        calculado = pd.DataFrame({
+            'n_itens': base['n_itens'].to_numpy(),
+            'valor_produto': valor,
+            'pis_atual': atuais[:, 0],
+            'cofins_atual': atuais[:, 1],
+            'ipi_atual': atuais[:, 2],
+            'icms_atual': atuais[:, 3],
+            'iss_atual': iss,
+            'total_atual': total_atual + iss,
+            'cbs_novo': cbs,
+            'ibs_novo': ibs,
+        })
+        calculado['total_rti'] = calculado['cbs_novo'] + calculado['ibs_novo']
+        calculado['diferenca'] = calculado['total_rti'] - calculado['total_atual']
+
+        if por:
+            calculado[por] = base[por]
+            resultado = calculado.groupby(por, sort=True, dropna=False)[MEDIDAS].sum().reset_index()
+        else:
+            resultado = calculado[MEDIDAS].sum().to_frame().T
+
+        # Centavos -> reais
+        monetarias = MEDIDAS[1:]
+        resultado[monetarias] = (resultado[monetarias] / 100).round(2)
+        resultado['n_itens'] = resultado['n_itens'].astype(np.int64)
+        resultado['economia_percentual'] = np.where(
+            resultado['total_atual'] > 0,
+            (resultado['total_atual'] - resultado['total_rti']) / resultado['total_atual'].where(
+                resultado['total_atual'] > 0, 1) * 100,
+            0.0,
+        ).round(2)
+
+        if ordenar_por:
+            resultado = resultado.sort_values(ordenar_por, ascending=False, kind='stable')
+        if limite is not None:
+            resultado = resultado.head(limite)
+        return resultado.reset_index(drop=True)
+
+    def top_emitentes(self, n: int = 10, por: str = 'diferenca', config_rti: ConfigTributacao = None,
+                      **filtros) -> pd.DataFrame:
+        """Emitentes de maior impacto (maior ``por``), com a razão social"""
+        resultado = self.agregar(['cnpj_emitente'], config_rti, ordenar_por=por, limite=n, **filtros)
+        nomes = (self.corpus.ler_notas(['cnpj_emitente', 'razao_social_emitente'],
+                                       emitentes=list(resultado['cnpj_emitente'].dropna()))
+                 .drop_duplicates('cnpj_emitente')
+                 .astype({'cnpj_emitente': object, 'razao_social_emitente': object}))
+        resultado = resultado.merge(nomes, on='cnpj_emitente', how='left')
+        colunas = ['cnpj_emitente', 'razao_social_emitente'] + [c for c in resultado.columns
+                                                                  if c not in ('cnpj_emitente', 'razao_social_emitente')]
+        return resultado[colunas]
+
+    def invalidar(self):
+        """Descarta as leituras em cache (o cache também expira sozinho quando o corpus recebe arquivos novos)"""
+        self._cache.clear()
@@ -0,0 +1,319 @@
+"""
+Armazenamento colunar (Parquet) de notas e itens já parseados
+
+Layout em disco, particionado no estilo Hive por mês de emissão e CNPJ do
+emitente:
+
+    <diretorio>/notas/mes=2025-06/cnpj_emitente=07750628000153/<lote>-0.parquet
+    <diretorio>/itens/mes=2025-06/cnpj_emitente=07750628000153/<lote>-0.parquet
+    <diretorio>/rollups/mes=2025-06/cnpj_emitente=07750628000153/<lote>-0.parquet
+
+Valores monetários são gravados em centavos inteiros (int64), como no motor
+vetorizado; alíquotas e quantidades em decimal exato. Códigos (NCM, CFOP, CST,
+unidade) usam colunas dictionary-encoded. A leitura aplica poda de partições
+e projeção de colunas, e ``carregar_colunas`` entrega os itens direto para a
+CalculadoraVetorizada sem reconstruir objetos.
+
+``rollups`` guarda, para cada lote gravado, as somas dos itens por NCM, CFOP e
+CST dentro da partição. Como CBS/IBS são lineares no valor por CST, essas
+somas bastam para recalcular qualquer alíquota (ver ``consultas``), e os
+rollups de lotes diferentes podem simplesmente ser somados.
+"""
+import os
+import shutil
+import uuid
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from ..calculo.calculadora_vetorizada import ColunasItens, centavos
+from ..models import TRIBUTOS, NotaFiscal
+
+
+PARTICOES = ['mes', 'cnpj_emitente']
+TRIBUTOS_COLUNAS = [tipo.lower() for tipo in TRIBUTOS]
+
+_TEXTO = pa.string()
+_CODIGO = pa.dictionary(pa.int32(), pa.string())
+_CENTAVOS = pa.int64()
+_ALIQUOTA = pa.decimal128(12, 8)
+_QUANTIDADE = pa.decimal128(18, 4)
+_VALOR_UNITARIO = pa.decimal128(22, 10)
+
+SCHEMA_PARTICOES = pa.schema([('mes', pa.string()), ('cnpj_emitente', pa.string())])
+
+SCHEMA_NOTAS = pa.schema(
+    [
+        ('chave_acesso', _TEXTO),
+        ('numero', _TEXTO),
+        ('serie', _CODIGO),
+        ('data_emissao', pa.date32()),
+        ('razao_social_emitente', _CODIGO),
+        ('cnpj_destinatario', _TEXTO),
+        ('razao_social_destinatario', _TEXTO),
+        ('valor_total_produtos', _CENTAVOS),
+        ('valor_total_nota', _CENTAVOS),
+        ('n_itens', pa.int32()),
+    ]
+    + [(tributo, _CENTAVOS) for tributo in TRIBUTOS_COLUNAS]
+    + list(SCHEMA_PARTICOES)
+)
+
+SCHEMA_ITENS = pa.schema(
+    [
+        ('chave_acesso', _TEXTO),
+        ('data_emissao', pa.date32()),
+        ('item', pa.int32()),
+        ('descricao', _TEXTO),
+        ('ncm', _CODIGO),
+        ('cfop', _CODIGO),
+        ('unidade', _CODIGO),
+        ('cst', _CODIGO),
+        ('quantidade', _QUANTIDADE),
+        ('valor_unitario', _VALOR_UNITARIO),
+        ('valor_produto', _CENTAVOS),
+    ]
+    + [coluna for tributo in TRIBUTOS_COLUNAS for coluna in (
+        (f'{tributo}_cst', _CODIGO),
+        (f'{tributo}_base', _CENTAVOS),
+        (f'{tributo}_aliquota', _ALIQUOTA),
+        (f'{tributo}_valor', _CENTAVOS),
+    )]
+    + list(SCHEMA_PARTICOES)
+)
+
+
+DIMENSOES_ROLLUP = ['capitulo_ncm', 'ncm', 'cfop', 'cst']
+MEDIDAS_ROLLUP = ['n_itens', 'valor_produto'] + [tributo for tributo in TRIBUTOS_COLUNAS if tributo != 'iss']
+
+SCHEMA_ROLLUPS = pa.schema(
+    [('capitulo_ncm', _CODIGO), ('ncm', _CODIGO), ('cfop', _CODIGO), ('cst', _CODIGO)]
+    + [(medida, pa.int64()) for medida in MEDIDAS_ROLLUP]
+    + list(SCHEMA_PARTICOES)
+)
+
+
+def _data(texto: str) -> Optional[str]:
+    return texto[:10] if len(texto) >= 10 else None
+
+
+def _decimal(valor: Optional[Decimal], tipo: pa.Decimal128Type) -> Optional[Decimal]:
+    """Ajusta a escala do Decimal à da coluna (valores fora do padrão do XML não quebram a gravação)"""
+    if valor is None:
+        return None
+    return valor.quantize(Decimal(1).scaleb(-tipo.scale))
+
+
+def _notas_para_tabelas(notas: Sequence[NotaFiscal]) -> Tuple[pa.Table, pa.Table]:
+    """Converte as notas em duas tabelas Arrow (notas e itens), coluna a coluna"""
+    col_notas: Dict[str, List[Any]] = {campo.name: [] for campo in SCHEMA_NOTAS}
+    col_itens: Dict[str, List[Any]] = {campo.name: [] for campo in SCHEMA_ITENS}
+
+    for nota in notas:
+        data = _data(nota.data_emissao or '')
+        mes = data[:7] if data else None
+        cnpj = nota.cnpj_emitente or None
+
+        for campo in ('chave_acesso', 'numero', 'serie', 'razao_social_emitente',
+                      'cnpj_destinatario', 'razao_social_destinatario'):
+            col_notas[campo].append(getattr(nota, campo))
+        col_notas['data_emissao'].append(data)
+        col_notas['valor_total_produtos'].append(centavos(nota.valor_total_produtos))
+        col_notas['valor_total_nota'].append(centavos(nota.valor_total_nota))
+        col_notas['n_itens'].append(len(nota.itens))
+        for tributo in TRIBUTOS:
+            col_notas[tributo.lower()].append(centavos(nota.get_total_tributo(tributo)))
+        col_notas['mes'].append(mes)
+        col_notas['cnpj_emitente'].append(cnpj)
+
+        for item in nota.itens:
+            col_itens['chave_acesso'].append(nota.chave_acesso)
+            col_itens['data_emissao'].append(data)
+            col_itens['item'].append(item.numero)
+            col_itens['descricao'].append(item.descricao)
+            col_itens['ncm'].append(item.ncm or None)
+            col_itens['cfop'].append(item.cfop or None)
+            col_itens['unidade'].append(item.unidade or None)
+            col_itens['cst'].append(item.cst)
+            col_itens['quantidade'].append(_decimal(item.quantidade, _QUANTIDADE))
+            col_itens['valor_unitario'].append(_decimal(item.valor_unitario, _VALOR_UNITARIO))
+            col_itens['valor_produto'].append(centavos(item.valor_total or Decimal('0')))
+            for tributo in TRIBUTOS:
+                dados = item.get_tributo(tributo)
+                prefixo = tributo.lower()
+                col_itens[f'{prefixo}_cst'].append((dados.cst or None) if dados else None)
+                col_itens[f'{prefixo}_base'].append(centavos(dados.base_calculo) if dados else None)
+                col_itens[f'{prefixo}_aliquota'].append(_decimal(dados.aliquota, _ALIQUOTA) if dados else None)
+                col_itens[f'{prefixo}_valor'].append(centavos(dados.valor) if dados else None)
+            col_itens['mes'].append(mes)
+            col_itens['cnpj_emitente'].append(cnpj)
+
+    # Datas chegam como texto ISO e são convertidas em lote pelo Arrow
+    for colunas in (col_notas, col_itens):
+        colunas['data_emissao'] = pc.cast(pa.array(colunas['data_emissao'], pa.string()), pa.date32())
+
+    return (pa.Table.from_pydict(col_notas, schema=SCHEMA_NOTAS),
+            pa.Table.from_pydict(col_itens, schema=SCHEMA_ITENS))
+
+
+def _rollup(itens: pa.Table) -> pa.Table:
+    """Soma os itens de uma tabela por partição, NCM, CFOP e CST (centavos)"""
+    texto = {nome: pc.cast(itens.column(nome), pa.string()) for nome in ('ncm', 'cfop', 'cst')}
+    base = pa.table({
+        'mes': itens.column('mes'),
+        'cnpj_emitente': itens.column('cnpj_emitente'),
+        'capitulo_ncm': pc.utf8_slice_codeunits(texto['ncm'], 0, 2),
+        'ncm': texto['ncm'],
+        'cfop': texto['cfop'],
+        'cst': pc.fill_null(texto['cst'], '000'),
+        'valor_produto': itens.column('valor_produto'),
+        **{tributo: pc.fill_null(itens.column(f'{tributo}_valor'), 0) for tributo in MEDIDAS_ROLLUP[2:]},
+    })
+    chaves = PARTICOES + DIMENSOES_ROLLUP
+    agregado = base.group_by(chaves, use_threads=False).aggregate(
+        [('valor_produto', 'count')] + [(medida, 'sum') for medida in MEDIDAS_ROLLUP[1:]]
+    )
+    nomes = {'valor_produto_count': 'n_itens', **{f'{medida}_sum': medida for medida in MEDIDAS_ROLLUP[1:]}}
+    agregado = agregado.rename_columns([nomes.get(nome, nome) for nome in agregado.column_names])
+    return agregado.select(SCHEMA_ROLLUPS.names).cast(SCHEMA_ROLLUPS)
+
+
+class CorpusParquet:
+    """Corpus de notas e itens em Parquet particionado (mês de emissão / CNPJ do emitente)"""
+
+    def __init__(self, diretorio: str):
+        self.diretorio = diretorio
+        self.caminho_notas = os.path.join(diretorio, 'notas')
+        self.caminho_itens = os.path.join(diretorio, 'itens')
+        self.caminho_rollups = os.path.join(diretorio, 'rollups')
+        self._particionamento = ds.partitioning(SCHEMA_PARTICOES, flavor='hive')
+
+    def _escrever(self, tabela: pa.Table, caminho: str, prefixo: str, comportamento: str):
+        ds.write_dataset(
+            tabela, caminho, format='parquet', schema=tabela.schema,
+            partitioning=self._particionamento,
+            basename_template=f'{prefixo}-{{i}}.parquet',
+            existing_data_behavior=comportamento,
+        )
+
+    def gravar(self, notas: Iterable[NotaFiscal], tamanho_lote: int = 20_000,
+               substituir_particoes: bool = False) -> int:
+        """
+        Grava as notas (e seus itens) em lotes; retorna o número de notas gravadas
+
+        Por padrão acrescenta arquivos novos às partições. Com
+        ``substituir_particoes`` as partições tocadas são apagadas antes (útil
+        para reimportar um mês inteiro).
+        """
+        total = 0
+        lote: List[NotaFiscal] = []
+        comportamento = 'delete_matching' if substituir_particoes else 'overwrite_or_ignore'
+
+        def descarregar():
+            nonlocal comportamento
+            tabela_notas, tabela_itens = _notas_para_tabelas(lote)
+            prefixo = uuid.uuid4().hex
+            for tabela, caminho in ((tabela_notas, self.caminho_notas),
+                                    (tabela_itens, self.caminho_itens),
+                                    (_rollup(tabela_itens), self.caminho_rollups)):
+                self._escrever(tabela, caminho, prefixo, comportamento)
+            # Só o primeiro lote substitui; os seguintes acrescentam ao que acabou de ser gravado
+            comportamento = 'overwrite_or_ignore'
+
+        for nota in notas:
+            lote.append(nota)
+            if len(lote) >= tamanho_lote:
+                descarregar()
+                total += len(lote)
+                lote = []
+        if lote:
+            descarregar()
+            total += len(lote)
+        return total
+
+    def reconstruir_rollups(self) -> int:
+        """Refaz os rollups a partir dos itens (corpus antigo ou rollups apagados); retorna nº de linhas"""
+        rollup = _rollup(self.ler_tabela('itens'))
+        if os.path.isdir(self.caminho_rollups):
+            shutil.rmtree(self.caminho_rollups)
+        if rollup.num_rows:
+            self._escrever(rollup, self.caminho_rollups, uuid.uuid4().hex, 'overwrite_or_ignore')
+        return rollup.num_rows
+
+    def _dataset(self, caminho: str) -> Optional[ds.Dataset]:
+        if not os.path.isdir(caminho):
+            return None
+        return ds.dataset(caminho, format='parquet', partitioning=self._particionamento)
+
+    @staticmethod
+    def _filtro(meses: Optional[Sequence[str]], emitentes: Optional[Sequence[str]],
+                filtro: Optional[ds.Expression]) -> Optional[ds.Expression]:
+        """Combina a poda por partição com um filtro Arrow adicional"""
+        expressao = filtro
+        for campo, valores in (('mes', meses), ('cnpj_emitente', emitentes)):
+            if valores is not None:
+                condicao = ds.field(campo).isin(list(valores))
+                expressao = condicao if expressao is None else expressao & condicao
+        return expressao
+
+    def ler_tabela(self, tabela: str, colunas: Optional[Sequence[str]] = None,
+                   meses: Optional[Sequence[str]] = None, emitentes: Optional[Sequence[str]] = None,
+                   filtro: Optional[ds.Expression] = None) -> pa.Table:
+        """Lê ``'notas'``, ``'itens'`` ou ``'rollups'`` como tabela Arrow, só com as colunas e partições pedidas"""
+        schema = {'notas': SCHEMA_NOTAS, 'itens': SCHEMA_ITENS, 'rollups': SCHEMA_ROLLUPS}[tabela]
+        dataset = self._dataset(os.path.join(self.diretorio, tabela))
+        if dataset is None:
+            nomes = list(colunas) if colunas is not None else schema.names
+            return schema.empty_table().select(nomes)
+        return dataset.to_table(columns=list(colunas) if colunas is not None else None,
+                                filter=self._filtro(meses, emitentes, filtro))
+
+    def ler_notas(self, colunas: Optional[Sequence[str]] = None, **filtros) -> pd.DataFrame:
+        """Notas como DataFrame (centavos em int64)"""
+        return self.ler_tabela('notas', colunas, **filtros).to_pandas()
+
+    def ler_itens(self, colunas: Optional[Sequence[str]] = None, **filtros) -> pd.DataFrame:
+        """Itens como DataFrame (centavos em int64)"""
+        return self.ler_tabela('itens', colunas, **filtros).to_pandas()
+
+    def meses(self) -> List[str]:
+        """Meses de emissão presentes no corpus (pelas partições, sem ler dados)"""
+        dataset = self._dataset(self.caminho_notas)
+        if dataset is None:
+            return []
+        return sorted({os.path.basename(os.path.dirname(os.path.dirname(f)))[len('mes='):]
+                       for f in dataset.files})
+
+    def carregar_colunas(self, meses: Optional[Sequence[str]] = None,
+                         emitentes: Optional[Sequence[str]] = None,
+                         filtro: Optional[ds.Expression] = None) -> Tuple[ColunasItens, pd.Index]:
+        """
+        Carrega os itens no formato do motor vetorizado
+
+        Returns:
+            (ColunasItens, chaves de acesso na ordem do índice ``nota``)
+        """
+        colunas = ['chave_acesso', 'cst', 'valor_produto'] + [f'{t}_valor' for t in ('pis', 'cofins', 'ipi', 'icms')]
+        tabela = self.ler_tabela('itens', colunas, meses=meses, emitentes=emitentes, filtro=filtro)
+
+        nota_idx, chaves = pd.factorize(tabela.column('chave_acesso').to_numpy(zero_copy_only=False))
+        cst = pc.fill_null(pc.cast(tabela.column('cst'), pa.string()), '000')
+
+        def centavos_coluna(nome: str) -> np.ndarray:
+            return pc.fill_null(tabela.column(nome), 0).to_numpy(zero_copy_only=False).astype(np.int64)
+
+        return ColunasItens(
+            nota=nota_idx.astype(np.int32),
+            cst=cst.to_numpy(zero_copy_only=False).astype(object),
+            valor=centavos_coluna('valor_produto'),
+            pis=centavos_coluna('pis_valor'),
+            cofins=centavos_coluna('cofins_valor'),
+            ipi=centavos_coluna('ipi_valor'),
+            icms=centavos_coluna('icms_valor'),
+            n_notas=len(chaves),
+        ), pd.Index(chaves, name='chave_acesso')
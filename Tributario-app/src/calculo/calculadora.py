@@ -1,24 +1,26 @@
 import pandas as pd
 
-# Alíquotas simuladas (poderão vir de tabela futuramente)
-ALIQUOTAS = {
-    'PIS': 0.0065,     # 0,65%
-    'COFINS': 0.03,    # 3%
-    'ICMS': 0.18,      # 18% (padrão)
-}
+from ..regras.registro import RegistroRegras, registro_padrao
 
-def calcular_tributos(df: pd.DataFrame) -> pd.DataFrame:
+
+def calcular_tributos(df: pd.DataFrame, registro: RegistroRegras = None) -> pd.DataFrame:
     """
     Recebe um DataFrame com itens da NF e calcula os principais tributos.
+
+    As alíquotas de cada item vêm do registro de regras pelo CST, NCM e data de
+    emissão (colunas ``cst``, ``ncm`` e ``data_emissao``, quando existirem).
     """
     df_calc = df.copy()
+    instantaneo = (registro or registro_padrao()).instantaneo()
+    # Itens sem CST seguem o CST 000 (tributação integral)
+    csts = df_calc['cst'].fillna('000') if 'cst' in df_calc else pd.Series('000', index=df_calc.index)
+    aliquotas = instantaneo.resolver_lote(csts, df_calc.get('ncm'), df_calc.get('data_emissao'))
 
     # Cálculos básicos
-    df_calc['PIS'] = df_calc['valor_total'] * ALIQUOTAS['PIS']
-    df_calc['COFINS'] = df_calc['valor_total'] * ALIQUOTAS['COFINS']
-    df_calc['ICMS'] = df_calc['valor_total'] * ALIQUOTAS['ICMS']
+    for tributo in ('PIS', 'COFINS', 'ICMS'):
+        df_calc[tributo] = df_calc['valor_total'] * aliquotas[tributo].fillna(0)
 
     # Soma final (simples)
     df_calc['Total_Tributos'] = df_calc[['PIS', 'COFINS', 'ICMS']].sum(axis=1)
 
-    return df_calc
\ No newline at end of file
+    return df_calc
@@ -2,10 +2,12 @@
 Calculadora tributária para comparação entre legislação atual e RTI
 """
 from decimal import Decimal
-from typing import Dict, List, Any, Tuple
+from types import MappingProxyType
+from typing import Dict, List, Any, Mapping, Tuple
 import pandas as pd
 
-from ..models import NotaFiscal, ConfigTributacao, CalculoComparativo, TributoItem
+from ..models import TRIBUTOS, NotaFiscal, ConfigTributacao, CalculoComparativo, TributoItem
+from .tabela_cst import PCT_COLUMNS, REGRA_PADRAO, RegraCST, TabelaCSTError, compilar_regras_cst, normalizar_cst
 
 
 class CalculadoraTributaria:
@@ -14,9 +16,18 @@ class CalculadoraTributaria:
     def __init__(self, config_rti: ConfigTributacao = None):
         self.config_rti = config_rti or ConfigTributacao()
         self.cst_data = None
+        self.regras_cst: Mapping[str, RegraCST] = MappingProxyType({})
     
     def carregar_tabela_cst(self, df_cst: pd.DataFrame):
-        """Carrega tabela de CST com configurações da RTI"""
+        """
+        Carrega tabela de CST com configurações da RTI
+        
+        Espera a tabela normalizada por ``ler_tabela_cst`` (reduções em fração)
+        e compila o índice imutável CST -> RegraCST usado no cálculo por item.
+        
+        Raises:
+            TabelaCSTError: se alguma redução estiver fora de 0 a 1 (ex.: 60 em vez de 0.6)
+        """
         self.cst_data = df_cst.copy()
         
         # Padroniza colunas necessárias
@@ -25,13 +36,21 @@ class CalculadoraTributaria:
         for col in required_cols:
             if col not in self.cst_data.columns:
                 self.cst_data[col] = None
-                
-        # Converte percentuais para decimais
-        for col in ['% Red. CBS', '% Red. IBS']:
-            if col in self.cst_data.columns:
-                self.cst_data[col] = (self.cst_data[col]
-                                     .fillna(0)
-                                     .apply(lambda x: Decimal(str(x)) / 100 if x and x != 'nan' else Decimal('0')))
+        
+        # Reduções ausentes valem zero; percentuais (60) não são convertidos em silêncio
+        for col in PCT_COLUMNS:
+            self.cst_data[col] = self.cst_data[col].fillna(0)
+            valores = pd.to_numeric(self.cst_data[col], errors='coerce')
+            invalidos = valores.isna() | (valores < 0) | (valores > 1)
+            if invalidos.any():
+                exemplos = ', '.join(f"{cst}={valor}" for cst, valor in
+                                     self.cst_data.loc[invalidos, ['CST', col]].head(5).itertuples(index=False))
+                raise TabelaCSTError(
+                    f"'{col}' deve estar em fração de 0 a 1 (0.6 = 60%), como devolve ler_tabela_cst; "
+                    f"valores inválidos: {exemplos}"
+                )
+        
+        self.regras_cst = compilar_regras_cst(self.cst_data)
     
     def calcular_tributos_atuais(self, nota_fiscal: NotaFiscal) -> Dict[str, Decimal]:
         """Calcula tributos da legislação atual"""
@@ -44,12 +63,9 @@ class CalculadoraTributaria:
             'TOTAL': Decimal('0')
         }
         
-        # Soma tributos diretos do XML
-        for item in nota_fiscal.itens:
-            for tributo in item.tributos:
-                tipo = tributo.tipo.upper()
-                if tipo in ['PIS', 'COFINS', 'IPI', 'ICMS']:
-                    totais[tipo] += tributo.valor
+        # Tributos diretos do XML (totais da nota já somados no parse)
+        for tipo in ('PIS', 'COFINS', 'IPI', 'ICMS'):
+            totais[tipo] = nota_fiscal.get_total_tributo(tipo)
         
         # Calcula ISS se a flag estiver ativada (5% sobre o total dos outros tributos)
         if self.config_rti.incluir_iss:
@@ -85,48 +101,45 @@ class CalculadoraTributaria:
     
     def calcular_rti_item(self, item: Any) -> Tuple[Decimal, Decimal]:
         """Calcula CBS e IBS para um item específico"""
-        cst = str(item.cst) if hasattr(item, 'cst') else '000'
+        cst = str(getattr(item, 'cst', None) or '000')
         valor_item = Decimal(str(item.valor_total or 0))
         
-        # Busca configuração na tabela CST
-        config_cst = self._buscar_config_cst(cst)
-        
-        # Calcula alíquotas efetivas
-        aliq_cbs = self._calcular_aliquota_efetiva(
-            self.config_rti.aliquota_cbs, 
-            config_cst.get('% Red. CBS', Decimal('0'))
-        )
-        aliq_ibs = self._calcular_aliquota_efetiva(
-            self.config_rti.aliquota_ibs,
-            config_cst.get('% Red. IBS', Decimal('0'))
-        )
+        # Busca a regra no índice compilado (sem pandas no caminho por item)
+        regra = self._buscar_regra_cst(cst)
         
         # Verifica se tributo é exigido
-        if not config_cst.get('Exige Trib', True):
+        if not regra.exige_trib:
             return Decimal('0'), Decimal('0')
         
+        # Calcula alíquotas efetivas
+        aliq_cbs = self._calcular_aliquota_efetiva(self.config_rti.cbs_aliquota, regra.red_cbs)
+        aliq_ibs = self._calcular_aliquota_efetiva(self.config_rti.ibs_aliquota, regra.red_ibs)
+        
         cbs = valor_item * aliq_cbs
         ibs = valor_item * aliq_ibs
         
         return cbs, ibs
     
+    def _buscar_regra_cst(self, cst: str) -> RegraCST:
+        """Busca a regra de um CST no índice (O(1)); CSTs ausentes usam a regra padrão"""
+        regra = self.regras_cst.get(cst)
+        if regra is None:
+            regra = self.regras_cst.get(normalizar_cst(cst), REGRA_PADRAO)
+        return regra
+    
     def _buscar_config_cst(self, cst: str) -> Dict[str, Any]:
         """Busca configuração para um CST específico"""
         if self.cst_data is None:
             return {}
-            
-        cst_row = self.cst_data[self.cst_data['CST'] == cst]
-        
-        if not cst_row.empty:
-            return cst_row.iloc[0].to_dict()
         
+        regra = self._buscar_regra_cst(cst)
         return {
-            'Exige Trib': True,
-            'Monofásica': False,
-            'Red. Alíq': False,
-            'Diferimento': False,
-            '% Red. CBS': Decimal('0'),
-            '% Red. IBS': Decimal('0')
+            'Exige Trib': regra.exige_trib,
+            'Monofásica': regra.monofasica,
+            'Red. Alíq': regra.red_aliq,
+            'Diferimento': regra.diferimento,
+            '% Red. CBS': regra.red_cbs,
+            '% Red. IBS': regra.red_ibs
         }
     
     def _calcular_aliquota_efetiva(self, aliquota_base: Decimal, reducao: Decimal) -> Decimal:
@@ -145,15 +158,39 @@ class CalculadoraTributaria:
         percentual_economia = (economia / total_atual * 100) if total_atual > 0 else Decimal('0')
         
         return CalculoComparativo(
+            nota_fiscal=nota_fiscal,
             tributacao_atual=tributos_atuais,
             tributacao_nova=tributos_rti,
             economia_total=economia,
-            percentual_economia=percentual_economia,
-            nota_fiscal=nota_fiscal,
-            detalhes_atuais=self._gerar_detalhamento_completo(tributos_atuais),
-            detalhes_novos=self._gerar_detalhamento_completo(tributos_rti)
+            economia_percentual=percentual_economia,
+            detalhes_por_item=[self._gerar_detalhe_item(item) for item in nota_fiscal.itens]
         )
     
+    def _gerar_detalhe_item(self, item: Any) -> Dict[str, Any]:
+        """Achata o cálculo detalhado de um item para as tabelas e relatórios"""
+        calculo = self.calcular_item_detalhado(item)
+        atuais = calculo['tributos_atuais']
+        novos = calculo['tributos_novos']
+        
+        return {
+            'item': getattr(item, 'numero', None),
+            'descricao': calculo['item_info']['descricao'],
+            'ncm': calculo['item_info']['ncm'],
+            'valor_produto': calculo['item_info']['valor_total'],
+            'pis_atual': atuais['PIS'],
+            'cofins_atual': atuais['COFINS'],
+            'ipi_atual': atuais['IPI'],
+            'icms_atual': atuais['ICMS'],
+            'iss_atual': atuais['ISS'],
+            'total_atual': atuais['TOTAL'],
+            'cbs_novo': novos['CBS'],
+            'ibs_novo': novos['IBS'],
+            'total_rti': novos['TOTAL'],
+            # Diferença positiva = aumento com a RTI; negativa = economia
+            'diferenca': novos['TOTAL'] - atuais['TOTAL'],
+            'economia_percentual': calculo['impacto']['percentual']
+        }
+    
     def _gerar_detalhamento_completo(self, tributos: Dict[str, Decimal]) -> Dict[str, Any]:
         """Gera detalhamento completo dos tributos calculados"""
         detalhes = {}
@@ -188,7 +225,7 @@ class CalculadoraTributaria:
             'item_info': {
                 'descricao': getattr(item, 'descricao', 'N/A'),
                 'ncm': getattr(item, 'ncm', 'N/A'),
-                'cst': getattr(item, 'cst', 'N/A'),
+                'cst': getattr(item, 'cst', None) or 'N/A',
                 'valor_total': Decimal(str(getattr(item, 'valor_total', 0)))
             },
             'tributos_atuais': {
@@ -207,12 +244,10 @@ class CalculadoraTributaria:
         }
         
         # Calcula tributos atuais do item
-        if hasattr(item, 'tributos'):
-            for tributo in item.tributos:
-                tipo = tributo.tipo.upper()
-                if tipo in ['PIS', 'COFINS', 'IPI', 'ICMS']:
-                    resultado['tributos_atuais'][tipo] = tributo.valor
-                    resultado['tributos_atuais']['TOTAL'] += tributo.valor
+        if hasattr(item, 'valores_tributos'):
+            for tipo, valor in zip(TRIBUTOS[:4], item.valores_tributos()):
+                resultado['tributos_atuais'][tipo] = valor
+                resultado['tributos_atuais']['TOTAL'] += valor
         
         # Adiciona ISS se configurado
         if self.config_rti.incluir_iss:
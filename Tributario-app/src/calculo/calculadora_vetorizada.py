@@ -0,0 +1,280 @@
+"""
+Motor colunar (NumPy) para comparação Atual vs RTI em grandes volumes
+
+Um lote de notas é convertido em arrays por item (valor, índice do CST,
+PIS/COFINS/IPI/ICMS) e CBS/IBS, totais atuais e diferenças são calculados com
+poucas operações vetoriais.
+
+Regras de arredondamento:
+- valores do XML (produto e tributos atuais) são guardados em centavos inteiros
+  (int64), arredondados ROUND_HALF_UP na conversão, e somados sem erro;
+- CBS, IBS e ISS são calculados em float64 (centavos) sem arredondar por item;
+- na reconciliação para Decimal, cada total é quantizado em 0,01 com
+  ROUND_HALF_UP.
+"""
+from dataclasses import dataclass
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from ..models import CalculoComparativo, ConfigTributacao, NotaFiscal
+from ..regras.registro import RegistroRegras
+from .calculadora_rti import CalculadoraTributaria
+from .tabela_cst import REGRA_PADRAO, RegraCST, normalizar_cst
+
+
+CENTAVO = Decimal('0.01')
+ARREDONDAMENTO = ROUND_HALF_UP
+
+
+def centavos(valor: Decimal) -> int:
+    """Converte um valor monetário em centavos inteiros (ROUND_HALF_UP)"""
+    return int((valor * 100).quantize(Decimal('1'), rounding=ARREDONDAMENTO))
+
+
+def para_decimal(centavos_float: float) -> Decimal:
+    """Reconcilia um total em centavos (float) para Decimal em reais"""
+    return (Decimal(repr(float(centavos_float))) / 100).quantize(CENTAVO, rounding=ARREDONDAMENTO)
+
+
+@dataclass
+class ColunasItens:
+    """Itens de um lote de notas em formato colunar"""
+    nota: np.ndarray      # int32: índice da nota no lote
+    cst: np.ndarray       # object: CST normalizado de cada item
+    valor: np.ndarray     # int64: valor do produto em centavos
+    pis: np.ndarray       # int64: centavos
+    cofins: np.ndarray
+    ipi: np.ndarray
+    icms: np.ndarray
+    n_notas: int
+    ncm: Optional[np.ndarray] = None   # object: NCM de cada item (alíquotas por registro de regras)
+    data: Optional[np.ndarray] = None  # object: data de emissão da nota de cada item
+
+    def __len__(self) -> int:
+        return len(self.valor)
+
+    @classmethod
+    def from_notas(cls, notas: Sequence[NotaFiscal]) -> 'ColunasItens':
+        """Monta as colunas percorrendo as notas uma única vez"""
+        total = sum(len(nota.itens) for nota in notas)
+        nota_idx = np.empty(total, dtype=np.int32)
+        valores = np.zeros((5, total), dtype=np.int64)  # valor, PIS, COFINS, IPI, ICMS
+        csts = np.empty(total, dtype=object)
+        ncms = np.empty(total, dtype=object)
+        datas = np.empty(total, dtype=object)
+
+        i = 0
+        for n, nota in enumerate(notas):
+            for item in nota.itens:
+                nota_idx[i] = n
+                csts[i] = str(getattr(item, 'cst', None) or '000')
+                ncms[i] = item.ncm
+                datas[i] = nota.data_emissao
+                valores[0, i] = centavos(Decimal(str(item.valor_total or 0)))
+                # Vetor fixo PIS, COFINS, IPI, ICMS (ISS é calculado)
+                for linha, valor in enumerate(item.valores_tributos()[:4], 1):
+                    if valor:
+                        valores[linha, i] = centavos(valor)
+                i += 1
+
+        return cls(nota_idx, csts, *valores, n_notas=len(notas), ncm=ncms, data=datas)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, n_notas: Optional[int] = None) -> 'ColunasItens':
+        """
+        Monta as colunas a partir de um DataFrame por item com as colunas
+        nota (índice), cst, valor_produto, pis, cofins, ipi, icms (em reais) e,
+        opcionalmente, ncm e data_emissao
+        """
+        def em_centavos(coluna: str) -> np.ndarray:
+            if coluna not in df.columns:
+                return np.zeros(len(df), dtype=np.int64)
+            valores = pd.to_numeric(df[coluna], errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+            return np.floor(valores * 100 + 0.5).astype(np.int64)
+
+        nota_idx = df['nota'].to_numpy(dtype=np.int32)
+        csts = df['cst'].astype(str).to_numpy(dtype=object) if 'cst' in df.columns \
+            else np.full(len(df), '000', dtype=object)
+        return cls(
+            nota_idx, csts, em_centavos('valor_produto'),
+            em_centavos('pis'), em_centavos('cofins'), em_centavos('ipi'), em_centavos('icms'),
+            n_notas=n_notas if n_notas is not None else (int(nota_idx.max()) + 1 if len(df) else 0),
+            ncm=df['ncm'].to_numpy(dtype=object) if 'ncm' in df.columns else None,
+            data=df['data_emissao'].to_numpy(dtype=object) if 'data_emissao' in df.columns else None,
+        )
+
+
+def montar_comparativos(notas: Sequence[NotaFiscal], itens: Optional[pd.DataFrame], por_nota: pd.DataFrame,
+                        incluir_detalhes: bool = False) -> List[CalculoComparativo]:
+    """
+    Converte os resultados colunares (centavos, float64) em CalculoComparativo
+
+    ``itens`` segue a ordem (nota, item) de ``ColunasItens.from_notas`` e
+    ``por_nota`` tem uma linha por nota, com as colunas de ``calcular``.
+    """
+    detalhes_por_nota: List[List[Dict]] = [[] for _ in notas]
+    if incluir_detalhes:
+        # As linhas seguem a mesma ordem (nota, item) usada em from_notas
+        pares = ((n, item) for n, nota in enumerate(notas) for item in nota.itens)
+        for (n, item), linha in zip(pares, itens.itertuples(index=False)):
+            atual = para_decimal(linha.total_atual)
+            rti = para_decimal(linha.total_rti)
+            detalhes_por_nota[n].append({
+                'item': item.numero,
+                'descricao': item.descricao,
+                'ncm': item.ncm,
+                'valor_produto': para_decimal(linha.valor_produto),
+                'pis_atual': para_decimal(linha.pis_atual),
+                'cofins_atual': para_decimal(linha.cofins_atual),
+                'ipi_atual': para_decimal(linha.ipi_atual),
+                'icms_atual': para_decimal(linha.icms_atual),
+                'iss_atual': para_decimal(linha.iss_atual),
+                'total_atual': atual,
+                'cbs_novo': para_decimal(linha.cbs_novo),
+                'ibs_novo': para_decimal(linha.ibs_novo),
+                'total_rti': rti,
+                'diferenca': rti - atual,
+                'economia_percentual': ((atual - rti) / atual * 100) if atual > 0 else Decimal('0')
+            })
+
+    comparativos = []
+    for n, (nota, linha) in enumerate(zip(notas, por_nota.itertuples(index=False))):
+        atual = {
+            'PIS': para_decimal(linha.pis_atual),
+            'COFINS': para_decimal(linha.cofins_atual),
+            'IPI': para_decimal(linha.ipi_atual),
+            'ICMS': para_decimal(linha.icms_atual),
+            'ISS': para_decimal(linha.iss_atual),
+        }
+        atual['TOTAL'] = sum(atual.values(), Decimal('0'))
+        nova = {'CBS': para_decimal(linha.cbs_novo), 'IBS': para_decimal(linha.ibs_novo)}
+        nova['TOTAL'] = nova['CBS'] + nova['IBS']
+
+        economia = atual['TOTAL'] - nova['TOTAL']
+        comparativos.append(CalculoComparativo(
+            nota_fiscal=nota,
+            tributacao_atual=atual,
+            tributacao_nova=nova,
+            economia_total=economia,
+            economia_percentual=(economia / atual['TOTAL'] * 100) if atual['TOTAL'] > 0 else Decimal('0'),
+            detalhes_por_item=detalhes_por_nota[n]
+        ))
+    return comparativos
+
+
+class CalculadoraVetorizada:
+    """Calcula o comparativo Atual vs RTI de um lote inteiro com NumPy"""
+
+    def __init__(self, config_rti: ConfigTributacao = None,
+                 regras_cst: Optional[Mapping[str, RegraCST]] = None,
+                 registro: Optional[RegistroRegras] = None):
+        """
+        Com ``registro``, CBS e IBS de cada item vêm das regras vigentes na data
+        de emissão (por CST e NCM), em vez das alíquotas únicas de ``config_rti``
+        """
+        self.config_rti = config_rti or ConfigTributacao()
+        self.regras_cst = regras_cst or {}
+        self.registro = registro
+
+    @classmethod
+    def from_calculadora(cls, calculadora: CalculadoraTributaria) -> 'CalculadoraVetorizada':
+        """Reaproveita configuração e índice de CST de uma CalculadoraTributaria"""
+        return cls(calculadora.config_rti, calculadora.regras_cst)
+
+    def fatores_por_cst(self, csts: np.ndarray):
+        """
+        Resolve cada CST distinto uma única vez e devolve o índice do CST
+        distinto de cada item e, por CST distinto, os fatores (1 - redução) de
+        CBS e IBS já zerados quando o tributo não é exigido
+        """
+        inverso, unicos = pd.factorize(csts)
+        fator_cbs = np.empty(len(unicos), dtype=np.float64)
+        fator_ibs = np.empty(len(unicos), dtype=np.float64)
+
+        for i, cst in enumerate(unicos):
+            cst = str(cst)
+            regra = self.regras_cst.get(cst) or self.regras_cst.get(normalizar_cst(cst), REGRA_PADRAO)
+            exige = 1.0 if regra.exige_trib else 0.0
+            fator_cbs[i] = exige * (1 - float(regra.red_cbs))
+            fator_ibs[i] = exige * (1 - float(regra.red_ibs))
+
+        return inverso, fator_cbs, fator_ibs
+
+    def _indexar_regras(self, csts: np.ndarray):
+        """Fatores (1 - redução) de CBS e IBS por item"""
+        inverso, fator_cbs, fator_ibs = self.fatores_por_cst(csts)
+        return fator_cbs[inverso], fator_ibs[inverso]
+
+    def _aliquotas_rti(self, colunas: ColunasItens):
+        """Alíquotas CBS e IBS: escalares da configuração ou, com registro, uma por item"""
+        if self.registro is None:
+            return float(self.config_rti.cbs_aliquota), float(self.config_rti.ibs_aliquota)
+        aliquotas = self.registro.instantaneo().resolver_lote(colunas.cst, colunas.ncm, colunas.data)
+        return (aliquotas['CBS'].fillna(0).to_numpy(dtype=np.float64),
+                aliquotas['IBS'].fillna(0).to_numpy(dtype=np.float64))
+
+    def calcular(self, colunas: ColunasItens, fatores: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> pd.DataFrame:
+        """
+        Calcula, por item, tributos atuais, CBS/IBS e diferença (em centavos, float64)
+
+        ``fatores`` (CBS, IBS por item) evita resolver os CSTs de novo quando já
+        são conhecidos.
+        """
+        fator_cbs, fator_ibs = fatores if fatores is not None else self._indexar_regras(colunas.cst)
+        valor = colunas.valor.astype(np.float64)
+
+        total_atual = (colunas.pis + colunas.cofins + colunas.ipi + colunas.icms).astype(np.float64)
+        iss = np.zeros(len(colunas))
+        if self.config_rti.incluir_iss:
+            iss = total_atual * float(self.config_rti.iss_percentual)
+            total_atual = total_atual + iss
+
+        aliquota_cbs, aliquota_ibs = self._aliquotas_rti(colunas)
+        cbs = valor * (aliquota_cbs * fator_cbs)
+        ibs = valor * (aliquota_ibs * fator_ibs)
+        total_rti = cbs + ibs
+
+        return pd.DataFrame({
+            'nota': colunas.nota,
+            'valor_produto': colunas.valor,
+            'pis_atual': colunas.pis,
+            'cofins_atual': colunas.cofins,
+            'ipi_atual': colunas.ipi,
+            'icms_atual': colunas.icms,
+            'iss_atual': iss,
+            'total_atual': total_atual,
+            'cbs_novo': cbs,
+            'ibs_novo': ibs,
+            'total_rti': total_rti,
+            'diferenca': total_rti - total_atual,
+        })
+
+    def totais_por_nota(self, colunas: ColunasItens, itens: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+        """Agrega o cálculo por nota com np.bincount (centavos, float64)"""
+        if itens is None:
+            itens = self.calcular(colunas)
+        nota = colunas.nota
+        return pd.DataFrame({
+            coluna: np.bincount(nota, weights=itens[coluna].to_numpy(dtype=np.float64),
+                                minlength=colunas.n_notas)
+            for coluna in itens.columns if coluna != 'nota'
+        })
+
+    def totais(self, colunas: ColunasItens) -> Dict[str, Decimal]:
+        """Totais gerais do lote, reconciliados para Decimal"""
+        somas = self.calcular(colunas).drop(columns='nota').sum()
+        return {coluna: para_decimal(valor) for coluna, valor in somas.items()}
+
+    def realizar_comparacoes(self, notas: Sequence[NotaFiscal],
+                             incluir_detalhes: bool = False) -> List[CalculoComparativo]:
+        """
+        Equivalente vetorizado de CalculadoraTributaria.realizar_comparacao
+        para várias notas, com totais reconciliados para Decimal
+        """
+        colunas = ColunasItens.from_notas(notas)
+        itens = self.calcular(colunas)
+        por_nota = self.totais_por_nota(colunas, itens)
+        return montar_comparativos(notas, itens, por_nota, incluir_detalhes)
@@ -0,0 +1,114 @@
+"""
+Recálculo incremental do comparativo quando as alíquotas mudam
+
+CBS, IBS e ISS são lineares no valor dos itens: para cada nota, a soma dos
+valores dos itens é guardada por faixa de redução efetiva (pares distintos de
+fatores CBS/IBS da tabela de CST), junto com os tributos atuais. Uma mudança
+de alíquota só multiplica essas somas (matriz notas x faixas), sem percorrer
+itens, XML ou regras de CST novamente.
+
+Os valores seguem as regras de arredondamento de ``calculadora_vetorizada``.
+"""
+from decimal import Decimal
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from ..models import CalculoComparativo, ConfigTributacao, NotaFiscal
+from .calculadora_vetorizada import CalculadoraVetorizada, ColunasItens, montar_comparativos, para_decimal
+from .tabela_cst import RegraCST
+
+
+def _chave_config(config: ConfigTributacao) -> Tuple:
+    return (config.cbs_aliquota, config.ibs_aliquota, config.incluir_iss, config.iss_percentual)
+
+
+class AgregadosRTI:
+    """Agregados por nota, independentes das alíquotas, de um lote já calculado"""
+
+    def __init__(self, notas: Sequence[NotaFiscal], regras_cst: Mapping[str, RegraCST]):
+        self.notas = list(notas)
+        self.regras_cst = regras_cst
+        self.colunas = ColunasItens.from_notas(self.notas)
+        n_notas = self.colunas.n_notas
+
+        # Faixas: pares distintos de fatores (1 - redução) entre os CSTs do lote
+        inverso, fator_cbs, fator_ibs = CalculadoraVetorizada(regras_cst=regras_cst).fatores_por_cst(self.colunas.cst)
+        faixa_por_cst, faixas = pd.factorize(pd.MultiIndex.from_arrays([fator_cbs, fator_ibs]))
+        self.fator_cbs = faixas.get_level_values(0).to_numpy(dtype=np.float64)
+        self.fator_ibs = faixas.get_level_values(1).to_numpy(dtype=np.float64)
+        self.faixa_item = faixa_por_cst[inverso] if len(inverso) else np.zeros(0, dtype=np.intp)
+
+        # Base por nota e faixa (centavos inteiros, soma exata)
+        n_faixas = len(faixas)
+        posicao = self.colunas.nota.astype(np.int64) * n_faixas + self.faixa_item
+        self.base = np.bincount(posicao, weights=self.colunas.valor,
+                                minlength=n_notas * n_faixas).round().astype(np.int64).reshape(n_notas, n_faixas)
+
+        # Tributos atuais por nota (PIS, COFINS, IPI, ICMS), em centavos
+        self.atuais = {
+            coluna: np.bincount(self.colunas.nota, weights=valores, minlength=n_notas).round().astype(np.int64)
+            for coluna, valores in (('pis_atual', self.colunas.pis), ('cofins_atual', self.colunas.cofins),
+                                    ('ipi_atual', self.colunas.ipi), ('icms_atual', self.colunas.icms))
+        }
+        self._soma_atual = sum(self.atuais.values()).astype(np.float64)
+        self._valor_produto = np.bincount(self.colunas.nota, weights=self.colunas.valor, minlength=n_notas)
+
+        # Bases efetivas independem da alíquota: só precisam ser calculadas uma vez
+        self.base_cbs = self.base @ self.fator_cbs
+        self.base_ibs = self.base @ self.fator_ibs
+
+        self._ultimo: Optional[Tuple[Tuple, pd.DataFrame]] = None
+
+    def __len__(self) -> int:
+        return len(self.notas)
+
+    @property
+    def n_faixas(self) -> int:
+        return self.base.shape[1]
+
+    def totais_por_nota(self, config: ConfigTributacao) -> pd.DataFrame:
+        """Totais por nota para as alíquotas informadas (centavos, float64)"""
+        chave = _chave_config(config)
+        if self._ultimo is not None and self._ultimo[0] == chave:
+            return self._ultimo[1]
+
+        total_atual = self._soma_atual
+        iss = np.zeros(len(self))
+        if config.incluir_iss:
+            iss = total_atual * float(config.iss_percentual)
+            total_atual = total_atual + iss
+
+        cbs = self.base_cbs * float(config.cbs_aliquota)
+        ibs = self.base_ibs * float(config.ibs_aliquota)
+        total_rti = cbs + ibs
+
+        por_nota = pd.DataFrame({
+            'valor_produto': self._valor_produto,
+            **self.atuais,
+            'iss_atual': iss,
+            'total_atual': total_atual,
+            'cbs_novo': cbs,
+            'ibs_novo': ibs,
+            'total_rti': total_rti,
+            'diferenca': total_rti - total_atual,
+        })
+        self._ultimo = (chave, por_nota)
+        return por_nota
+
+    def totais(self, config: ConfigTributacao) -> Dict[str, Decimal]:
+        """Totais gerais do lote, reconciliados para Decimal"""
+        somas = self.totais_por_nota(config).sum()
+        return {coluna: para_decimal(valor) for coluna, valor in somas.items()}
+
+    def itens(self, config: ConfigTributacao) -> pd.DataFrame:
+        """Cálculo por item para as alíquotas informadas, sem reindexar os CSTs"""
+        calculadora = CalculadoraVetorizada(config, self.regras_cst)
+        fatores = (self.fator_cbs[self.faixa_item], self.fator_ibs[self.faixa_item])
+        return calculadora.calcular(self.colunas, fatores=fatores)
+
+    def comparativos(self, config: ConfigTributacao, incluir_detalhes: bool = False) -> List[CalculoComparativo]:
+        """Refaz os CalculoComparativo do lote com as novas alíquotas"""
+        itens = self.itens(config) if incluir_detalhes else None
+        return montar_comparativos(self.notas, itens, self.totais_por_nota(config), incluir_detalhes)
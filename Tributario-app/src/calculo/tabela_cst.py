@@ -0,0 +1,255 @@
+"""
+Leitura e normalização da planilha de CST e Classificação Tributária
+
+Compartilhado entre a aplicação Streamlit e o processamento em lote, sem
+dependência de interface.
+
+A leitura do Excel é a parte mais lenta da partida: ``ler_tabela_cst_compilada``
+grava a tabela já normalizada em um arquivo binário compacto (colunas em
+tuplas + pickle + zlib), endereçado pelo SHA-256 da planilha, e nas próximas
+sessões carrega esse arquivo em milissegundos. Entradas de outra versão da
+normalização (``TABELA_CST_VERSAO``) são refeitas.
+"""
+import hashlib
+import io
+import os
+import pickle
+import tempfile
+import zlib
+from decimal import Decimal, InvalidOperation
+from types import MappingProxyType
+from typing import Any, Mapping, NamedTuple, Optional
+
+import pandas as pd
+
+from ..util import telemetria
+
+
+class TabelaCSTError(ValueError):
+    """Planilha de CST fora do formato esperado"""
+    pass
+
+
+BOOL_COLUMNS = ['Exige Trib', 'Monofásica', 'Red. Alíq', 'Diferimento']
+PCT_COLUMNS = ['% Red. CBS', '% Red. IBS']
+BOOL_MAP = {'SIM': True, 'NÃO': False, 'NAO': False, 'TRUE': True, 'FALSE': False}
+
+# Incrementar sempre que a normalização de ler_tabela_cst mudar (invalida as tabelas compiladas)
+TABELA_CST_VERSAO = '2'
+# Raiz do projeto (Tributario-app): o cache não depende do diretório de onde o app é iniciado
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+CACHE_CST_DIR_PADRAO = os.path.join(BASE_DIR, 'data', 'cache')
+MAX_TABELAS_COMPILADAS = 8
+
+
+class RegraCST(NamedTuple):
+    """Regra RTI de um CST, já normalizada (imutável e compacta)"""
+    cst: str
+    exige_trib: bool
+    monofasica: bool
+    red_aliq: bool
+    diferimento: bool
+    red_cbs: Decimal  # fração: 0.6 = 60%
+    red_ibs: Decimal
+
+
+# Regra aplicada a CSTs ausentes da tabela
+REGRA_PADRAO = RegraCST('', True, False, False, False, Decimal('0'), Decimal('0'))
+
+
+def normalizar_cst(valor: Any) -> str:
+    """
+    Normaliza o código CST para três dígitos
+
+    A planilha traz os códigos com formato numérico: '.010' (lido como 0.01)
+    representa o CST 010 e '200' pode chegar como 200.0. Só códigos com zero
+    à esquerda chegam como fração (até 3 casas, abaixo de 0.1); outras frações
+    ('0.5') não são CST e voltam como texto.
+    """
+    texto = str(valor).strip()
+    if texto.isdigit():
+        return texto.zfill(3)
+    try:
+        numero = float(texto)
+    except ValueError:
+        return texto.upper()
+    if numero != numero:  # NaN
+        return ''
+    if 0 <= numero < 1 and '.' in texto:
+        casas = texto.split('.', 1)[1]
+        if numero < 0.1 and casas.isdigit() and len(casas) <= 3:
+            return str(int(round(numero * 1000))).zfill(3)
+        return texto.upper()
+    return str(int(numero)).zfill(3)
+
+
+def _to_decimal(valor: Any) -> Decimal:
+    try:
+        resultado = Decimal(str(valor))
+    except (InvalidOperation, ValueError):
+        return Decimal('0')
+    return resultado if resultado.is_finite() else Decimal('0')
+
+
+def compilar_regras_cst(df_cst: pd.DataFrame) -> Mapping[str, RegraCST]:
+    """
+    Compila a tabela normalizada em um índice imutável CST -> RegraCST
+
+    Em CSTs repetidos vale a primeira linha, como na busca linear anterior.
+    """
+    colunas = ['CST'] + BOOL_COLUMNS + PCT_COLUMNS
+    regras = {}
+    for cst, exige, mono, red, dif, red_cbs, red_ibs in df_cst[colunas].itertuples(index=False, name=None):
+        chave = normalizar_cst(cst)
+        if not chave or chave in regras:
+            continue
+        regras[chave] = RegraCST(
+            cst=chave,
+            exige_trib=bool(exige),
+            monofasica=bool(mono),
+            red_aliq=bool(red),
+            diferimento=bool(dif),
+            red_cbs=_to_decimal(red_cbs),
+            red_ibs=_to_decimal(red_ibs),
+        )
+    return MappingProxyType(regras)
+
+
+def ler_tabela_cst(origem: Any) -> pd.DataFrame:
+    """
+    Lê a planilha de CST (caminho ou arquivo enviado) e normaliza as colunas
+
+    Returns:
+        DataFrame com CST como texto, flags booleanas e reduções em fração (0.6 = 60%)
+
+    Raises:
+        TabelaCSTError: se o cabeçalho ou colunas obrigatórias não forem encontrados
+    """
+    # Lê o arquivo Excel uma única vez; o cabeçalho é localizado no próprio DataFrame
+    df_raw = pd.read_excel(origem, header=None, dtype=object)
+
+    # Encontra a linha do cabeçalho (onde está "CST")
+    tem_cst = df_raw.astype(str).apply(lambda col: col.str.contains('CST', regex=False)).any(axis=1)
+    if not tem_cst.any():
+        raise TabelaCSTError("Não foi possível encontrar o cabeçalho 'CST' na planilha")
+    header_row = int(tem_cst.to_numpy().argmax())
+
+    # Promove a linha encontrada a cabeçalho e descarta as colunas sem nome
+    cabecalho = df_raw.iloc[header_row]
+    nomeadas = cabecalho.notna().to_numpy()
+    df_cst = df_raw.iloc[header_row + 1:, nomeadas].reset_index(drop=True)
+    df_cst.columns = pd.Index([str(nome) for nome in cabecalho[nomeadas]])
+    df_cst = df_cst.dropna(how='all').infer_objects()
+
+    # Limpa nomes das colunas (algumas versões da planilha chamam o CST de 'Código')
+    df_cst.columns = df_cst.columns.str.strip()
+    if 'CST' not in df_cst.columns and 'Código' in df_cst.columns:
+        df_cst = df_cst.rename(columns={'Código': 'CST'})
+
+    # Verifica colunas essenciais
+    required_cols = ['CST']
+    missing_cols = [col for col in required_cols if col not in df_cst.columns]
+
+    if missing_cols:
+        raise TabelaCSTError(f"Colunas obrigatórias não encontradas: {missing_cols}")
+
+    # Processa dados
+    df_cst = df_cst.dropna(subset=['CST'])
+
+    # Padroniza coluna CST
+    df_cst['CST'] = df_cst['CST'].map(normalizar_cst)
+
+    # Converte flags booleanos
+    for col in BOOL_COLUMNS:
+        if col in df_cst.columns:
+            df_cst[col] = df_cst[col].astype(str).str.strip().str.upper().map(BOOL_MAP).fillna(False)
+        else:
+            df_cst[col] = False
+
+    # Processa porcentagens de redução ('60%', '60,5' ou 60 -> fração); vazios valem zero
+    for col in PCT_COLUMNS:
+        if col in df_cst.columns:
+            texto = df_cst[col].astype(str).str.replace('%', '', regex=False).str.replace(',', '.', regex=False)
+            df_cst[col] = pd.to_numeric(texto, errors='coerce').fillna(0) / 100
+        else:
+            df_cst[col] = 0.0
+
+    return df_cst
+
+
+def _ler_bytes(origem: Any) -> bytes:
+    if isinstance(origem, (str, os.PathLike)):
+        with open(origem, 'rb') as arquivo:
+            return arquivo.read()
+    if hasattr(origem, 'getvalue'):
+        return origem.getvalue()
+    posicao = origem.tell()
+    conteudo = origem.read()
+    origem.seek(posicao)
+    return conteudo
+
+
+def serializar_tabela(df_cst: pd.DataFrame) -> bytes:
+    """Tabela normalizada em colunas de valores Python (independe da versão do pandas)"""
+    colunas = tuple((str(nome), str(df_cst[nome].dtype), tuple(df_cst[nome].tolist())) for nome in df_cst.columns)
+    return zlib.compress(pickle.dumps((TABELA_CST_VERSAO, colunas), protocol=pickle.HIGHEST_PROTOCOL), 1)
+
+
+def desserializar_tabela(blob: bytes) -> Optional[pd.DataFrame]:
+    """DataFrame gravado por serializar_tabela (None se for de outra versão)"""
+    versao, colunas = pickle.loads(zlib.decompress(blob))
+    if versao != TABELA_CST_VERSAO:
+        return None
+    return pd.DataFrame({nome: pd.Series(valores, dtype=dtype) for nome, dtype, valores in colunas})
+
+
+def _podar(diretorio: str, manter: str):
+    """Mantém só as tabelas compiladas mais recentes"""
+    compiladas = sorted((os.path.join(diretorio, nome) for nome in os.listdir(diretorio)
+                         if nome.startswith('tabela_cst_') and nome.endswith('.bin')),
+                        key=os.path.getmtime, reverse=True)
+    for caminho in compiladas[MAX_TABELAS_COMPILADAS:]:
+        if caminho != manter:
+            try:
+                os.remove(caminho)
+            except OSError:
+                pass
+
+
+def ler_tabela_cst_compilada(origem: Any, cache_dir: Optional[str] = CACHE_CST_DIR_PADRAO,
+                             digest: Optional[str] = None) -> pd.DataFrame:
+    """
+    Como ``ler_tabela_cst``, mas reaproveita a tabela compilada da mesma planilha
+
+    A chave é o SHA-256 do conteúdo (``digest`` evita recalcular quando já é
+    conhecido). Falhas ao gravar o cache não impedem a leitura; com
+    ``cache_dir=None`` a planilha é sempre lida.
+    """
+    conteudo = _ler_bytes(origem)
+    if cache_dir is None:
+        return ler_tabela_cst(io.BytesIO(conteudo))
+
+    digest = digest or hashlib.sha256(conteudo).hexdigest()
+    caminho = os.path.join(cache_dir, f"tabela_cst_{digest}.bin")
+    try:
+        with open(caminho, 'rb') as arquivo:
+            df_cst = desserializar_tabela(arquivo.read())
+    except (OSError, pickle.UnpicklingError, zlib.error, EOFError, ValueError, TypeError):
+        df_cst = None
+    if df_cst is not None:
+        telemetria.evento('tabela_cst_compilada', acerto=True, registros=len(df_cst))
+        return df_cst
+
+    df_cst = ler_tabela_cst(io.BytesIO(conteudo))
+    telemetria.evento('tabela_cst_compilada', acerto=False, registros=len(df_cst))
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Grava em arquivo temporário e renomeia: leitores concorrentes nunca veem um arquivo parcial
+        descritor, temporario = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(descritor, 'wb') as arquivo:
+            arquivo.write(serializar_tabela(df_cst))
+        os.replace(temporario, caminho)
+        _podar(cache_dir, caminho)
+    except OSError as e:
+        telemetria.evento('tabela_cst_compilada_erro', nivel='warning', erro=str(e))
+    return df_cst
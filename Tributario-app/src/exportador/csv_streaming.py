@@ -0,0 +1,157 @@
+"""
+Exportação CSV em blocos, direto dos resultados do cálculo
+
+As linhas são geradas sob demanda (``linhas.linhas_itens``) e gravadas em
+blocos de ``TAMANHO_BLOCO``: cada bloco vira um DataFrame pequeno, recebe a
+formatação brasileira de forma vetorizada (coluna a coluna, sem ``apply`` por
+célula) e é anexado ao arquivo. O destino padrão é um arquivo temporário
+"spooled" (memória até ``MAX_MEMORIA``, disco acima disso), devolvido
+posicionado no início para o download.
+
+Exemplo:
+    arquivo = csv_comparativos(comparativos)
+    st.download_button('CSV', arquivo, file_name='relatorio.csv')
+"""
+import io
+import tempfile
+from decimal import ROUND_HALF_UP, Decimal
+from typing import IO, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from ..models import CalculoComparativo
+from ..util import telemetria
+from .linhas import COLUNAS_ITENS, COLUNAS_MONETARIAS, COLUNAS_PERCENTUAIS, blocos, linhas_itens
+
+
+TAMANHO_BLOCO = 50_000
+MAX_MEMORIA = 32 * 1024 * 1024
+
+Formatador = Callable[[pd.Series], pd.Series]
+
+_ESPACO, _PONTO, _VIRGULA, _ZERO = (ord(c) for c in ' .,0')
+
+
+def _quantizar_decimais(valores: pd.Series, casas: int) -> pd.Series:
+    """Decimais da coluna já arredondados ROUND_HALF_UP (o float de 1.005 é 1.00499...)"""
+    if valores.dtype != object:
+        return valores
+    passo = Decimal(1).scaleb(-casas)
+    return valores.map(lambda v: v.quantize(passo, ROUND_HALF_UP)
+                       if isinstance(v, Decimal) and v.is_finite() else v)
+
+
+def formatar_numero_br(valores: pd.Series, casas: int = 2, simbolo: Optional[str] = None) -> pd.Series:
+    """
+    Formata uma coluna numérica no padrão brasileiro (``1.234,56``), vetorizado
+
+    Os caracteres são montados em uma matriz de bytes (um dígito/separador por
+    coluna) e os zeros à esquerda removidos com ``numpy.char``, sem formatar
+    célula a célula. Aceita Decimal, float ou texto numérico; vazios e
+    inválidos viram ''. Decimais são arredondados ROUND_HALF_UP antes de
+    virar float (``Decimal('1.005')`` -> ``1,01``); float e texto arredondam
+    meio para cima sobre o valor binário (``1.005`` -> ``1,00``, como ``fmt``).
+    Com ``simbolo`` o resultado sai como ``R$ 1.234,56`` (mesmo texto de
+    ``fmt`` do app.py).
+    """
+    escala = 10 ** casas
+    numeros = pd.to_numeric(_quantizar_decimais(valores, casas), errors='coerce').to_numpy(dtype=np.float64)
+    nulos = np.isnan(numeros)
+    absolutos = np.floor(np.abs(np.where(nulos, 0, numeros)) * escala + 0.5).astype(np.int64)
+    inteiros, fracoes = np.divmod(absolutos, escala)
+
+    # Uma coluna de bytes por posição: dígitos (espaço à esquerda do primeiro) e separadores de milhar
+    digitos = len(str(int(inteiros.max()))) if len(inteiros) else 1
+    colunas = []
+    for potencia in range(digitos - 1, -1, -1):
+        fator = 10 ** potencia
+        significativo = inteiros >= fator
+        digito = (inteiros // fator) % 10 + _ZERO
+        colunas.append(np.where(significativo | (potencia == 0), digito, _ESPACO))
+        if potencia % 3 == 0 and potencia:
+            colunas.append(np.where(significativo, _PONTO, _ESPACO))
+    if casas:
+        colunas.append(np.full(len(inteiros), _VIRGULA))
+        for potencia in range(casas - 1, -1, -1):
+            colunas.append((fracoes // 10 ** potencia) % 10 + _ZERO)
+    matriz = np.ascontiguousarray(np.stack(colunas, axis=1).astype(np.uint8))
+
+    texto = np.char.lstrip(matriz.view(f'S{matriz.shape[1]}').ravel())
+    negativos = (numeros < 0) & (absolutos > 0)
+    texto = np.char.add(np.where(negativos, b'-', b''), texto).astype(str)
+    if simbolo:
+        # Espaço não separável entre símbolo e valor, como em ``fmt``
+        texto = np.char.add(simbolo + '\xa0', texto)
+    texto = np.where(nulos, '', texto)
+    return pd.Series(texto.astype(object), index=valores.index)
+
+
+def formatar_moeda_br(valores: pd.Series) -> pd.Series:
+    return formatar_numero_br(valores, simbolo='R$')
+
+
+# Formatação padrão do relatório por item: números com vírgula decimal (abre direto no Excel pt-BR)
+FORMATOS_ITENS: Dict[str, Formatador] = {coluna: formatar_numero_br
+                                         for coluna in COLUNAS_MONETARIAS + COLUNAS_PERCENTUAIS}
+
+
+def arquivo_temporario(max_memoria: int = MAX_MEMORIA) -> IO[bytes]:
+    """Arquivo binário em memória até ``max_memoria`` bytes e em disco acima disso"""
+    return tempfile.SpooledTemporaryFile(max_size=max_memoria, mode='w+b')
+
+
+def escrever_csv(quadros: Iterable[pd.DataFrame], destino: IO[bytes], colunas: List[str],
+                 formatos: Optional[Dict[str, Formatador]] = None, sep: str = ';') -> int:
+    """Grava DataFrames (blocos) como um único CSV UTF-8 com BOM; retorna o número de linhas"""
+    formatos = formatos or {}
+    texto = io.TextIOWrapper(destino, encoding='utf-8-sig', newline='')
+    linhas = 0
+    try:
+        texto.write(sep.join(colunas) + '\n')
+        for quadro in quadros:
+            with telemetria.span('exportacao', formato='csv') as span:
+                quadro = quadro[colunas].copy()
+                for coluna, formatar in formatos.items():
+                    if coluna in quadro:
+                        quadro[coluna] = formatar(quadro[coluna])
+                quadro.to_csv(texto, sep=sep, index=False, header=False, lineterminator='\n')
+                span.itens = len(quadro)
+            linhas += len(quadro)
+        texto.flush()
+    finally:
+        # O destino continua aberto para quem chamou (download, upload, cópia)
+        texto.detach()
+    return linhas
+
+
+def csv_linhas(linhas: Iterable[list], colunas: List[str] = COLUNAS_ITENS,
+               selecao: Optional[List[str]] = None, formatos: Optional[Dict[str, Formatador]] = None,
+               destino: Optional[IO[bytes]] = None, tamanho_bloco: int = TAMANHO_BLOCO) -> IO[bytes]:
+    """
+    CSV a partir de linhas geradas sob demanda (listas na ordem de ``colunas``)
+
+    Só um bloco de ``tamanho_bloco`` linhas fica em memória por vez. Retorna o
+    destino (padrão: arquivo temporário spooled) posicionado no início.
+    """
+    destino = destino if destino is not None else arquivo_temporario()
+    quadros = (pd.DataFrame(bloco, columns=colunas) for bloco in blocos(linhas, tamanho_bloco))
+    escrever_csv(quadros, destino, selecao or colunas, FORMATOS_ITENS if formatos is None else formatos)
+    destino.seek(0)
+    return destino
+
+
+def csv_comparativos(comparativos: Iterable[CalculoComparativo], selecao: Optional[List[str]] = None,
+                     destino: Optional[IO[bytes]] = None, tamanho_bloco: int = TAMANHO_BLOCO) -> IO[bytes]:
+    """Relatório CSV por item direto dos comparativos, com formatação brasileira"""
+    return csv_linhas(linhas_itens(comparativos), COLUNAS_ITENS, selecao, None, destino, tamanho_bloco)
+
+
+def csv_dataframe(df: pd.DataFrame, formatos: Optional[Dict[str, Formatador]] = None,
+                  destino: Optional[IO[bytes]] = None, tamanho_bloco: int = TAMANHO_BLOCO) -> IO[bytes]:
+    """CSV de um DataFrame já montado, formatado e gravado em fatias de ``tamanho_bloco`` linhas"""
+    destino = destino if destino is not None else arquivo_temporario()
+    fatias = (df.iloc[inicio:inicio + tamanho_bloco] for inicio in range(0, len(df), tamanho_bloco))
+    escrever_csv(fatias, destino, list(df.columns), formatos)
+    destino.seek(0)
+    return destino
@@ -0,0 +1,185 @@
+"""
+Exportação Excel em streaming (openpyxl write-only) para relatórios grandes
+
+As linhas de item são gravadas à medida que os resultados chegam: o workbook
+write-only serializa cada linha direto em arquivo temporário, então a memória
+não cresce com o tamanho do relatório. Ao atingir o limite de linhas do Excel
+a exportação continua em uma nova aba (``Itens``, ``Itens (2)``...).
+
+Os formatos numéricos são resolvidos uma vez por coluna: cada coluna
+monetária/percentual tem uma célula já formatada que é reaproveitada em todas
+as linhas (o write-only serializa a linha no ``append``).
+
+As abas de resumo (por mês, NCM e emitente) vêm de agregados acumulados durante
+a gravação; o custo em memória depende só do número de grupos.
+
+Exemplo:
+    with PlanilhaStreaming('data/outputs/relatorio.xlsx') as planilha:
+        for resultado in processador.processar_iter(arquivos):
+            planilha.adicionar(resultado.comparativo, resultado.nome)
+"""
+from collections import defaultdict
+from decimal import Decimal
+from typing import IO, Dict, Iterable, List, Optional, Tuple, Union
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+
+from ..models import CalculoComparativo
+from ..util import telemetria
+from .linhas import COLUNAS_ITENS, COLUNAS_MONETARIAS, COLUNAS_PERCENTUAIS, linhas_comparativo
+
+
+LIMITE_LINHAS_EXCEL = 1_048_576
+FORMATO_MOEDA = '#,##0.00'
+FORMATO_PERCENTUAL = '0.00'
+
+# Medidas acumuladas por grupo nos resumos
+MEDIDAS_RESUMO = ['valor_produto', 'total_atual', 'total_rti', 'diferenca']
+RESUMOS = {
+    'Resumo por mês': 'mes',
+    'Resumo por NCM': 'ncm',
+    'Resumo por emitente': 'emitente',
+}
+
+_POSICOES_RESUMO = [COLUNAS_ITENS.index(medida) for medida in MEDIDAS_RESUMO]
+_POSICAO_NCM = COLUNAS_ITENS.index('ncm')
+_POSICAO_EMITENTE = COLUNAS_ITENS.index('emitente')
+
+
+class PlanilhaStreaming:
+    """Workbook write-only alimentado nota a nota, com quebra de aba e resumos"""
+
+    def __init__(self, destino: Union[str, IO[bytes]], limite_linhas: int = LIMITE_LINHAS_EXCEL,
+                 resumos: bool = True):
+        self.destino = destino
+        self.limite_linhas = limite_linhas
+        self.linhas = 0
+        self._workbook = Workbook(write_only=True)
+        self._negrito = Font(bold=True)
+
+        # Abas de resumo criadas primeiro (ficam à frente), preenchidas no fechamento
+        self._abas_resumo = {titulo: self._workbook.create_sheet(titulo) for titulo in RESUMOS} if resumos else {}
+        self._agregados: Dict[str, Dict[str, List]] = {dimensao: defaultdict(lambda: [0] + [Decimal('0')] * 4)
+                                                       for dimensao in RESUMOS.values()} if resumos else {}
+
+        self._abas_itens: List = []
+        self._aba = None
+        self._linhas_aba = 0
+        self._celulas: Optional[List[Optional[WriteOnlyCell]]] = None
+
+    # Formatos por coluna: uma célula formatada por coluna, reaproveitada a cada linha
+    def _celulas_formatadas(self, aba) -> List[Optional[WriteOnlyCell]]:
+        celulas: List[Optional[WriteOnlyCell]] = []
+        for coluna in COLUNAS_ITENS:
+            formato = (FORMATO_MOEDA if coluna in COLUNAS_MONETARIAS
+                       else FORMATO_PERCENTUAL if coluna in COLUNAS_PERCENTUAIS else None)
+            if formato is None:
+                celulas.append(None)
+                continue
+            celula = WriteOnlyCell(aba)
+            celula.number_format = formato
+            celulas.append(celula)
+        return celulas
+
+    def _cabecalho(self, aba, colunas: Iterable[str]):
+        linha = []
+        for coluna in colunas:
+            celula = WriteOnlyCell(aba, value=coluna)
+            celula.font = self._negrito
+            linha.append(celula)
+        aba.append(linha)
+
+    def _nova_aba(self):
+        numero = len(self._abas_itens) + 1
+        self._aba = self._workbook.create_sheet('Itens' if numero == 1 else f'Itens ({numero})')
+        self._aba.freeze_panes = 'A2'
+        self._abas_itens.append(self._aba)
+        self._cabecalho(self._aba, COLUNAS_ITENS)
+        self._celulas = self._celulas_formatadas(self._aba)
+        self._linhas_aba = 1
+
+    def _gravar(self, linha: list):
+        if self._aba is None or self._linhas_aba >= self.limite_linhas:
+            self._nova_aba()
+        for posicao, celula in enumerate(self._celulas):
+            if celula is not None and linha[posicao] is not None:
+                celula.value = linha[posicao]
+                linha[posicao] = celula
+        self._aba.append(linha)
+        self._linhas_aba += 1
+        self.linhas += 1
+
+    def _acumular(self, linha: list, mes: str):
+        chaves = {'mes': mes, 'ncm': linha[_POSICAO_NCM] or '', 'emitente': linha[_POSICAO_EMITENTE] or ''}
+        for dimensao, chave in chaves.items():
+            acumulado = self._agregados[dimensao][chave]
+            acumulado[0] += 1
+            for i, posicao in enumerate(_POSICOES_RESUMO, 1):
+                valor = linha[posicao]
+                if valor is not None:
+                    acumulado[i] += valor
+
+    def adicionar(self, comparativo: CalculoComparativo, arquivo: Optional[str] = None):
+        """Grava os itens de uma nota (e acumula os resumos)"""
+        mes = (comparativo.nota_fiscal.data_emissao or '')[:7]
+        for linha in linhas_comparativo(comparativo, arquivo):
+            if self._agregados:
+                self._acumular(linha, mes)
+            self._gravar(linha)
+
+    def _gravar_resumos(self):
+        for titulo, dimensao in RESUMOS.items():
+            aba = self._abas_resumo[titulo]
+            self._cabecalho(aba, [dimensao, 'n_itens'] + MEDIDAS_RESUMO + ['economia_percentual'])
+            formatadas = []
+            for _ in MEDIDAS_RESUMO:
+                celula = WriteOnlyCell(aba)
+                celula.number_format = FORMATO_MOEDA
+                formatadas.append(celula)
+            percentual = WriteOnlyCell(aba)
+            percentual.number_format = FORMATO_PERCENTUAL
+
+            for chave, (n_itens, *medidas) in sorted(self._agregados[dimensao].items()):
+                linha = [chave, n_itens]
+                for celula, valor in zip(formatadas, medidas):
+                    celula.value = valor
+                    linha.append(celula)
+                total_atual, total_rti = medidas[1], medidas[2]
+                percentual.value = ((total_atual - total_rti) / total_atual * 100).quantize(Decimal('0.01')) \
+                    if total_atual > 0 else Decimal('0')
+                linha.append(percentual)
+                aba.append(linha)
+
+    def fechar(self) -> Union[str, IO[bytes]]:
+        """Grava os resumos e salva o workbook no destino"""
+        with telemetria.span('exportacao', formato='xlsx') as span:
+            if self._aba is None:
+                self._nova_aba()
+            if self._abas_resumo:
+                self._gravar_resumos()
+            self._workbook.save(self.destino)
+            span.itens = self.linhas
+        return self.destino
+
+    def __enter__(self) -> 'PlanilhaStreaming':
+        return self
+
+    def __exit__(self, tipo_exc, exc, tb):
+        if tipo_exc is None:
+            self.fechar()
+        return False
+
+
+def gerar_excel_streaming(comparativos: Iterable[Union[CalculoComparativo, Tuple[CalculoComparativo, str]]],
+                          destino: Union[str, IO[bytes]], limite_linhas: int = LIMITE_LINHAS_EXCEL,
+                          resumos: bool = True) -> Union[str, IO[bytes]]:
+    """Exporta comparativos (ou pares (comparativo, arquivo)) consumidos sob demanda"""
+    planilha = PlanilhaStreaming(destino, limite_linhas, resumos)
+    for comparativo in comparativos:
+        if isinstance(comparativo, tuple):
+            planilha.adicionar(*comparativo)
+        else:
+            planilha.adicionar(comparativo)
+    return planilha.fechar()
@@ -0,0 +1,51 @@
+"""
+Linhas de item dos relatórios, geradas direto dos resultados do cálculo
+
+Compartilhado pelos exportadores em streaming (Excel e CSV): cada item vira
+uma lista na ordem de ``COLUNAS_ITENS``, sem copiar dicionários nem montar um
+DataFrame com o relatório inteiro.
+"""
+from typing import Iterable, Iterator, List, Optional
+
+from ..models import CalculoComparativo
+
+
+COLUNAS_NOTA = ['arquivo', 'nota_numero', 'nota_serie', 'nota_data', 'emitente']
+COLUNAS_DETALHE = [
+    'item', 'descricao', 'ncm', 'valor_produto',
+    'pis_atual', 'cofins_atual', 'ipi_atual', 'icms_atual', 'iss_atual', 'total_atual',
+    'cbs_novo', 'ibs_novo', 'total_rti', 'diferenca', 'economia_percentual',
+]
+COLUNAS_ITENS = COLUNAS_NOTA + COLUNAS_DETALHE
+
+COLUNAS_MONETARIAS = [
+    'valor_produto', 'pis_atual', 'cofins_atual', 'ipi_atual', 'icms_atual', 'iss_atual',
+    'total_atual', 'cbs_novo', 'ibs_novo', 'total_rti', 'diferenca',
+]
+COLUNAS_PERCENTUAIS = ['economia_percentual']
+
+
+def linhas_comparativo(comparativo: CalculoComparativo, arquivo: Optional[str] = None) -> Iterator[list]:
+    """Uma linha por item da nota, na ordem de ``COLUNAS_ITENS``"""
+    nota = comparativo.nota_fiscal
+    cabecalho = [arquivo or '', nota.numero, nota.serie, nota.data_emissao, nota.razao_social_emitente]
+    for detalhe in comparativo.detalhes_por_item:
+        yield cabecalho + [detalhe.get(coluna) for coluna in COLUNAS_DETALHE]
+
+
+def linhas_itens(comparativos: Iterable[CalculoComparativo]) -> Iterator[list]:
+    """Linhas de todos os itens, nota a nota (o iterável é consumido sob demanda)"""
+    for comparativo in comparativos:
+        yield from linhas_comparativo(comparativo)
+
+
+def blocos(linhas: Iterable[list], tamanho: int) -> Iterator[List[list]]:
+    """Agrupa as linhas em listas de até ``tamanho`` (processamento por bloco)"""
+    bloco: List[list] = []
+    for linha in linhas:
+        bloco.append(linha)
+        if len(bloco) >= tamanho:
+            yield bloco
+            bloco = []
+    if bloco:
+        yield bloco
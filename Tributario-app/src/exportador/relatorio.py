@@ -1,6 +1,12 @@
 import pandas as pd
 from datetime import datetime
 import os
+from typing import Iterable
+
+from ..models import CalculoComparativo
+from ..util import telemetria
+from .excel_streaming import gerar_excel_streaming
+
 
 def gerar_excel(df: pd.DataFrame, pasta_saida: str = "data/outputs") -> str:
     """
@@ -14,6 +20,20 @@ def gerar_excel(df: pd.DataFrame, pasta_saida: str = "data/outputs") -> str:
     nome_arquivo = f"relatorio_tributos_{timestamp}.xlsx"
     caminho_completo = os.path.join(pasta_saida, nome_arquivo)
 
-    df.to_excel(caminho_completo, index=False)
+    with telemetria.span('exportacao', formato='xlsx') as span:
+        df.to_excel(caminho_completo, index=False)
+        span.itens = len(df)
+
+    return caminho_completo
+
 
-    return caminho_completo
\ No newline at end of file
+def gerar_excel_comparativos(comparativos: Iterable[CalculoComparativo], pasta_saida: str = "data/outputs") -> str:
+    """
+    Gera o relatório Excel por item direto dos resultados do cálculo, em streaming
+    (memória constante, abas divididas no limite de linhas e abas de resumo).
+    Retorna o caminho do arquivo salvo.
+    """
+    os.makedirs(pasta_saida, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    caminho_completo = os.path.join(pasta_saida, f"relatorio_tributos_{timestamp}.xlsx")
+    return gerar_excel_streaming(comparativos, caminho_completo)
@@ -1,75 +1,196 @@
 """
 Modelos de dados para o sistema tributário
 """
-from dataclasses import dataclass
-from typing import Optional, List, Dict, Any
+from dataclasses import dataclass, field
+from typing import Optional, Iterable, List, Dict, Any, Tuple
 from decimal import Decimal
 import pandas as pd
 
+from ..regras.registro import aliquota_padrao
 
-@dataclass
-class TributoItem:
+
+# Tributos com posição fixa no vetor de cada item
+TRIBUTOS = ('PIS', 'COFINS', 'IPI', 'ICMS', 'ISS')
+INDICE_TRIBUTO = {tipo: i for i, tipo in enumerate(TRIBUTOS)}
+ZERO = Decimal('0')
+
+
+class _ModeloCompacto:
+    """
+    Base dos modelos com __slots__ (sem __dict__ por instância)
+
+    Mantém a interface das dataclasses: repr e igualdade pelos campos de
+    ``_campos``, que também é a ordem dos argumentos do construtor.
+    """
+    __slots__ = ()
+    _campos: Tuple[str, ...] = ()
+
+    def __repr__(self) -> str:
+        campos = ', '.join(f"{campo}={getattr(self, campo)!r}" for campo in self._campos)
+        return f"{type(self).__name__}({campos})"
+
+    def __eq__(self, other) -> bool:
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, campo) == getattr(other, campo) for campo in self._campos)
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return type(self), tuple(getattr(self, campo) for campo in self._campos)
+
+
+class TributoItem(_ModeloCompacto):
     """Representa um tributo específico de um item da NF-e"""
-    tipo: str  # PIS, COFINS, IPI, ICMS, etc.
-    cst: str
-    base_calculo: Decimal
-    aliquota: Decimal
-    valor: Decimal
+    __slots__ = ('tipo', 'cst', 'base_calculo', 'aliquota', 'valor')
+    _campos = __slots__
 
+    def __init__(self, tipo: str, cst: str, base_calculo: Decimal, aliquota: Decimal, valor: Decimal):
+        self.tipo = tipo  # PIS, COFINS, IPI, ICMS, etc.
+        self.cst = cst
+        self.base_calculo = base_calculo
+        self.aliquota = aliquota
+        self.valor = valor
+
+
+class ItemNF(_ModeloCompacto):
+    """
+    Representa um item da Nota Fiscal
+
+    Os tributos ficam em um vetor fixo na ordem de ``TRIBUTOS`` (acesso
+    direto por ``item.pis``, ``item.icms``...). Tipos fora do vetor, ou um
+    segundo grupo do mesmo tipo, vão para ``outros_tributos``.
+    """
+    __slots__ = ('numero', 'descricao', 'ncm', 'cfop', 'unidade', 'quantidade', 'valor_unitario',
+                 'valor_total', 'cst', '_vetor', 'outros_tributos')
+    _campos = ('numero', 'descricao', 'ncm', 'cfop', 'unidade', 'quantidade', 'valor_unitario',
+               'valor_total', 'tributos', 'cst')
+
+    def __init__(self, numero: int, descricao: str, ncm: str, cfop: str, unidade: str,
+                 quantidade: Decimal, valor_unitario: Decimal, valor_total: Decimal,
+                 tributos: Iterable[TributoItem] = (), cst: Optional[str] = None):
+        self.numero = numero
+        self.descricao = descricao
+        self.ncm = ncm
+        self.cfop = cfop
+        self.unidade = unidade
+        self.quantidade = quantidade
+        self.valor_unitario = valor_unitario
+        self.valor_total = valor_total
+        self.cst = cst  # CST da RTI, quando informado
+
+        vetor: List[Optional[TributoItem]] = [None] * len(TRIBUTOS)
+        outros = []
+        for tributo in tributos:
+            indice = INDICE_TRIBUTO.get(tributo.tipo.upper())
+            if indice is not None and vetor[indice] is None:
+                vetor[indice] = tributo
+            else:
+                outros.append(tributo)
+        self._vetor = tuple(vetor)
+        self.outros_tributos = tuple(outros)
+
+    @property
+    def tributos(self) -> List[TributoItem]:
+        """Tributos presentes, na ordem do vetor (compatível com a lista anterior)"""
+        tributos = [tributo for tributo in self._vetor if tributo is not None]
+        tributos.extend(self.outros_tributos)
+        return tributos
+
+    @property
+    def pis(self) -> Optional[TributoItem]:
+        return self._vetor[0]
+
+    @property
+    def cofins(self) -> Optional[TributoItem]:
+        return self._vetor[1]
+
+    @property
+    def ipi(self) -> Optional[TributoItem]:
+        return self._vetor[2]
+
+    @property
+    def icms(self) -> Optional[TributoItem]:
+        return self._vetor[3]
+
+    @property
+    def iss(self) -> Optional[TributoItem]:
+        return self._vetor[4]
 
-@dataclass
-class ItemNF:
-    """Representa um item da Nota Fiscal"""
-    numero: int
-    descricao: str
-    ncm: str
-    cfop: str
-    unidade: str
-    quantidade: Decimal
-    valor_unitario: Decimal
-    valor_total: Decimal
-    tributos: List[TributoItem]
-    
     def get_tributo(self, tipo: str) -> Optional[TributoItem]:
         """Busca um tributo específico do item"""
-        for tributo in self.tributos:
-            if tributo.tipo.upper() == tipo.upper():
-                return tributo
-        return None
+        indice = INDICE_TRIBUTO.get(tipo.upper())
+        if indice is not None:
+            return self._vetor[indice]
+        tipo = tipo.upper()
+        return next((t for t in self.outros_tributos if t.tipo.upper() == tipo), None)
 
+    def valores_tributos(self) -> Tuple[Decimal, ...]:
+        """Valor de cada tributo de ``TRIBUTOS`` (zero quando ausente), somando grupos repetidos"""
+        valores = [tributo.valor if tributo is not None else ZERO for tributo in self._vetor]
+        for tributo in self.outros_tributos:
+            indice = INDICE_TRIBUTO.get(tributo.tipo.upper())
+            if indice is not None:
+                valores[indice] += tributo.valor
+        return tuple(valores)
 
-@dataclass
-class NotaFiscal:
-    """Representa uma Nota Fiscal completa"""
-    numero: str
-    serie: str
-    data_emissao: str
-    chave_acesso: str
-    cnpj_emitente: str
-    razao_social_emitente: str
-    cnpj_destinatario: str
-    razao_social_destinatario: str
-    valor_total_produtos: Decimal
-    valor_total_nota: Decimal
-    itens: List[ItemNF]
-    
-    def get_total_tributo(self, tipo: str) -> Decimal:
-        """Calcula o total de um tipo de tributo na nota"""
-        total = Decimal('0')
+
+class NotaFiscal(_ModeloCompacto):
+    """
+    Representa uma Nota Fiscal completa
+
+    Os totais por tributo são somados uma única vez, na criação (parse);
+    ``recalcular_totais`` atualiza após alterações na lista de itens.
+    """
+    __slots__ = ('numero', 'serie', 'data_emissao', 'chave_acesso', 'cnpj_emitente',
+                 'razao_social_emitente', 'cnpj_destinatario', 'razao_social_destinatario',
+                 'valor_total_produtos', 'valor_total_nota', 'itens', '_totais')
+    _campos = __slots__[:-1]
+
+    def __init__(self, numero: str, serie: str, data_emissao: str, chave_acesso: str,
+                 cnpj_emitente: str, razao_social_emitente: str, cnpj_destinatario: str,
+                 razao_social_destinatario: str, valor_total_produtos: Decimal,
+                 valor_total_nota: Decimal, itens: List[ItemNF]):
+        self.numero = numero
+        self.serie = serie
+        self.data_emissao = data_emissao
+        self.chave_acesso = chave_acesso
+        self.cnpj_emitente = cnpj_emitente
+        self.razao_social_emitente = razao_social_emitente
+        self.cnpj_destinatario = cnpj_destinatario
+        self.razao_social_destinatario = razao_social_destinatario
+        self.valor_total_produtos = valor_total_produtos
+        self.valor_total_nota = valor_total_nota
+        self.itens = itens
+        self.recalcular_totais()
+
+    def recalcular_totais(self):
+        """Soma os tributos dos itens por posição do vetor"""
+        totais = [ZERO] * len(TRIBUTOS)
         for item in self.itens:
-            tributo = item.get_tributo(tipo)
-            if tributo:
-                total += tributo.valor
-        return total
+            for indice, valor in enumerate(item.valores_tributos()):
+                if valor:
+                    totais[indice] += valor
+        self._totais = tuple(totais)
+
+    @property
+    def totais_tributos(self) -> Dict[str, Decimal]:
+        """Totais da nota por tributo (PIS, COFINS, IPI, ICMS, ISS)"""
+        return dict(zip(TRIBUTOS, self._totais))
+
+    def get_total_tributo(self, tipo: str) -> Decimal:
+        """Total de um tipo de tributo na nota (calculado no parse)"""
+        indice = INDICE_TRIBUTO.get(tipo.upper())
+        return self._totais[indice] if indice is not None else ZERO
 
 
 @dataclass
 class ConfigTributacao:
-    """Configuração da nova tributação (RTI)"""
-    cbs_aliquota: Decimal = Decimal('0.009')  # 0.9%
-    ibs_aliquota: Decimal = Decimal('0.26')   # 26%
+    """Configuração da nova tributação (RTI); padrões vigentes hoje no registro de regras"""
+    cbs_aliquota: Decimal = field(default_factory=lambda: aliquota_padrao('CBS'))  # 0.9%
+    ibs_aliquota: Decimal = field(default_factory=lambda: aliquota_padrao('IBS'))  # 26%
     incluir_iss: bool = False  # Flag para incluir ISS no cálculo
-    iss_percentual: Decimal = Decimal('0.05')  # 5% sobre o total já somado
+    iss_percentual: Decimal = field(default_factory=lambda: aliquota_padrao('ISS'))  # 5% sobre o total já somado
     cst_reducoes: Optional[Dict[str, Dict[str, Decimal]]] = None
     
     def __post_init__(self):
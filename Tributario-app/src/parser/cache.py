@@ -0,0 +1,194 @@
+"""
+Cache persistente de notas já parseadas (endereçado por conteúdo)
+
+Cada NotaFiscal é gravada em um SQLite local, em formato binário compacto
+(tuplas + pickle + zlib), indexada pelo hash SHA-256 do XML e pela chave de
+acesso de 44 dígitos. O tamanho total é limitado com despejo LRU, e entradas
+produzidas por outra versão do parser são descartadas na abertura.
+"""
+import hashlib
+import os
+import pickle
+import sqlite3
+import time
+import zlib
+from decimal import Decimal
+from typing import List, Optional
+
+from ..models import NotaFiscal, ItemNF, TributoItem
+from .nf_parser import NFParser, PARSER_VERSION
+from .triagem import Triagem
+
+
+# Raiz do projeto (Tributario-app): o cache não depende do diretório de onde o app é iniciado
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+CACHE_DIR_PADRAO = os.path.join(BASE_DIR, 'data', 'cache')
+MAX_BYTES_PADRAO = 512 * 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS notas (
+    hash TEXT PRIMARY KEY,
+    chave TEXT,
+    versao TEXT NOT NULL,
+    tamanho INTEGER NOT NULL,
+    acesso REAL NOT NULL,
+    dados BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_notas_chave ON notas (chave);
+CREATE INDEX IF NOT EXISTS idx_notas_acesso ON notas (acesso);
+"""
+
+
+def hash_conteudo(conteudo: bytes) -> str:
+    """Hash do conteúdo bruto do XML (chave primária do cache)"""
+    return hashlib.sha256(conteudo).hexdigest()
+
+
+def serializar_nota(nota: NotaFiscal) -> bytes:
+    """Converte a nota em tuplas de str (Decimal como texto) e comprime"""
+    itens = tuple(
+        (item.numero, item.descricao, item.ncm, item.cfop, item.unidade,
+         str(item.quantidade), str(item.valor_unitario), str(item.valor_total),
+         tuple((t.tipo, t.cst, str(t.base_calculo), str(t.aliquota), str(t.valor)) for t in item.tributos))
+        for item in nota.itens
+    )
+    dados = (
+        nota.numero, nota.serie, nota.data_emissao, nota.chave_acesso,
+        nota.cnpj_emitente, nota.razao_social_emitente,
+        nota.cnpj_destinatario, nota.razao_social_destinatario,
+        str(nota.valor_total_produtos), str(nota.valor_total_nota), itens
+    )
+    return zlib.compress(pickle.dumps(dados, protocol=pickle.HIGHEST_PROTOCOL), 1)
+
+
+def desserializar_nota(blob: bytes) -> NotaFiscal:
+    """Reconstrói a NotaFiscal gravada por serializar_nota"""
+    (numero, serie, data_emissao, chave, cnpj_emit, nome_emit, cnpj_dest, nome_dest,
+     total_produtos, total_nota, itens) = pickle.loads(zlib.decompress(blob))
+
+    return NotaFiscal(
+        numero=numero,
+        serie=serie,
+        data_emissao=data_emissao,
+        chave_acesso=chave,
+        cnpj_emitente=cnpj_emit,
+        razao_social_emitente=nome_emit,
+        cnpj_destinatario=cnpj_dest,
+        razao_social_destinatario=nome_dest,
+        valor_total_produtos=Decimal(total_produtos),
+        valor_total_nota=Decimal(total_nota),
+        itens=[
+            ItemNF(
+                numero=n, descricao=descricao, ncm=ncm, cfop=cfop, unidade=unidade,
+                quantidade=Decimal(qtd), valor_unitario=Decimal(unit), valor_total=Decimal(total),
+                tributos=[TributoItem(tipo, cst, Decimal(bc), Decimal(aliq), Decimal(valor))
+                          for tipo, cst, bc, aliq, valor in tributos]
+            )
+            for n, descricao, ncm, cfop, unidade, qtd, unit, total, tributos in itens
+        ]
+    )
+
+
+class CacheNotas:
+    """Cache em disco de NotaFiscal com despejo LRU e invalidação por versão do parser"""
+
+    # Atualizações de último acesso são gravadas em lote
+    FLUSH_ACESSOS = 256
+
+    def __init__(self, diretorio: str = CACHE_DIR_PADRAO, max_bytes: int = MAX_BYTES_PADRAO,
+                 versao: str = PARSER_VERSION):
+        os.makedirs(diretorio, exist_ok=True)
+        self.caminho = os.path.join(diretorio, 'notas.sqlite')
+        self.max_bytes = max_bytes
+        self.versao = versao
+        self._acessos: List[tuple] = []
+
+        # Vários workers podem abrir o mesmo cache: WAL + timeout de escrita
+        self._conn = sqlite3.connect(self.caminho, timeout=30, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_SCHEMA)
+        self._conn.execute('DELETE FROM notas WHERE versao != ?', (self.versao,))
+        self._total = self.tamanho_total()
+
+    def get(self, conteudo_hash: str) -> Optional[NotaFiscal]:
+        """Busca pelo hash do conteúdo"""
+        row = self._conn.execute('SELECT dados FROM notas WHERE hash = ?', (conteudo_hash,)).fetchone()
+        return self._hit(conteudo_hash, row)
+
+    def get_por_chave(self, chave_acesso: str) -> Optional[NotaFiscal]:
+        """Busca pela chave de acesso de 44 dígitos (versão mais recente)"""
+        row = self._conn.execute(
+            'SELECT dados, hash FROM notas WHERE chave = ? ORDER BY acesso DESC LIMIT 1', (chave_acesso,)
+        ).fetchone()
+        return self._hit(row[1], row) if row else None
+
+    def _hit(self, conteudo_hash: str, row) -> Optional[NotaFiscal]:
+        if row is None:
+            return None
+        self._acessos.append((time.time(), conteudo_hash))
+        if len(self._acessos) >= self.FLUSH_ACESSOS:
+            self.flush()
+        return desserializar_nota(row[0])
+
+    def put(self, conteudo_hash: str, nota: NotaFiscal):
+        """Grava a nota e despeja as menos usadas se o limite for ultrapassado"""
+        blob = serializar_nota(nota)
+        self._conn.execute(
+            'INSERT OR REPLACE INTO notas (hash, chave, versao, tamanho, acesso, dados) VALUES (?, ?, ?, ?, ?, ?)',
+            (conteudo_hash, nota.chave_acesso or None, self.versao, len(blob), time.time(), blob)
+        )
+        self._total += len(blob)
+        if self._total > self.max_bytes:
+            self._despejar()
+
+    def parse(self, conteudo: bytes, parser: Optional[NFParser] = None,
+              triagem: Optional[Triagem] = None) -> NotaFiscal:
+        """Retorna a nota do cache ou faz o parse e grava o resultado (``triagem`` já feita, se houver)"""
+        conteudo_hash = hash_conteudo(conteudo)
+        nota = self.get(conteudo_hash)
+        if nota is None:
+            nota = (parser or NFParser()).parse_nota_fiscal(conteudo, triagem)
+            self.put(conteudo_hash, nota)
+        return nota
+
+    def tamanho_total(self) -> int:
+        return self._conn.execute('SELECT COALESCE(SUM(tamanho), 0) FROM notas').fetchone()[0]
+
+    def _despejar(self):
+        """Remove entradas LRU até ficar abaixo de 90% do limite"""
+        # Outros processos também gravam: o total em memória é só uma estimativa
+        total = self.tamanho_total()
+        if total <= self.max_bytes:
+            self._total = total
+            return
+        self.flush()
+        alvo = int(self.max_bytes * 0.9)
+        for conteudo_hash, tamanho in self._conn.execute(
+                'SELECT hash, tamanho FROM notas ORDER BY acesso').fetchall():
+            if total <= alvo:
+                break
+            self._conn.execute('DELETE FROM notas WHERE hash = ?', (conteudo_hash,))
+            total -= tamanho
+        self._total = total
+
+    def flush(self):
+        """Grava os últimos acessos pendentes (ordem LRU)"""
+        if self._acessos:
+            self._conn.executemany('UPDATE notas SET acesso = ? WHERE hash = ?', self._acessos)
+            self._acessos = []
+
+    def limpar(self):
+        self._conn.execute('DELETE FROM notas')
+        self._acessos = []
+        self._total = 0
+
+    def close(self):
+        self.flush()
+        self._conn.close()
+
+    def __enter__(self) -> 'CacheNotas':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
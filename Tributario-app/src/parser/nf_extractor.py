@@ -0,0 +1,292 @@
+"""
+Motor de extração em passagem única para NF-e e NFC-e
+
+O documento é percorrido uma única vez a partir de ``infNFe``. Os namespaces
+são normalizados por tag (com cache), e os campos de interesse de cada grupo
+são mapeados por tabelas pré-compiladas, sem buscas ``.//tag`` repetidas.
+"""
+import sys
+import xml.etree.ElementTree as ET
+from decimal import Decimal
+from typing import IO, Callable, Dict, List, Optional, Tuple, Union
+
+from ..models import NotaFiscal, ItemNF, TributoItem
+from ..util.numeros import formato_nfe
+
+
+NFE_NAMESPACE = 'http://www.portalfiscal.inf.br/nfe'
+
+# Cache de tags já normalizadas: '{uri}tag' -> 'tag'
+_LOCAL_NAMES: Dict[str, str] = {}
+
+
+def local_name(tag: str) -> str:
+    """Remove o namespace de uma tag ('{uri}tag' -> 'tag')"""
+    try:
+        return _LOCAL_NAMES[tag]
+    except KeyError:
+        local = tag.rpartition('}')[2] if isinstance(tag, str) else ''
+        _LOCAL_NAMES[tag] = local
+        return local
+
+
+# Documento XML em texto, bytes/buffer (ex.: memoryview do upload) ou arquivo aberto em modo binário
+XMLConteudo = Union[str, bytes, bytearray, memoryview, IO[bytes]]
+
+
+def parse_xml(conteudo: XMLConteudo) -> ET.Element:
+    """
+    Monta a árvore do documento
+
+    Bytes e buffers vão direto para o expat, sem decode/re-encode nem cópia: o
+    encoding declarado no XML (ex.: ISO-8859-1) é respeitado.
+    """
+    if isinstance(conteudo, str):
+        return ET.fromstring(conteudo)
+    if hasattr(conteudo, 'read'):
+        return ET.parse(conteudo).getroot()
+    parser = ET.XMLParser()
+    parser.feed(conteudo)
+    return parser.close()
+
+
+def find_inf_nfe(root: ET.Element) -> Optional[ET.Element]:
+    """Localiza o elemento infNFe (raiz nfeProc, NFe ou o próprio infNFe)"""
+    for elem in root.iter():
+        if local_name(elem.tag) == 'infNFe':
+            return elem
+    return None
+
+
+def leaf_texts(elem: ET.Element) -> Dict[str, str]:
+    """Mapeia tag local -> texto das folhas de um grupo (primeira ocorrência vence)"""
+    campos: Dict[str, str] = {}
+    for child in elem.iter():
+        if len(child):
+            continue
+        tag = local_name(child.tag)
+        if tag not in campos:
+            text = child.text
+            campos[tag] = text.strip() if text else ''
+    return campos
+
+
+class NFExtractor:
+    """Preenche NotaFiscal/ItemNF/TributoItem em uma única travessia da árvore"""
+
+    # Campos de identificação: grupo -> {tag: chave}
+    IDE_FIELDS = {'nNF': 'numero', 'serie': 'serie', 'dhEmi': 'dhEmi', 'dEmi': 'dEmi'}
+    EMIT_FIELDS = {'CNPJ': 'cnpj_emitente', 'xNome': 'razao_social_emitente'}
+    DEST_FIELDS = {'CNPJ': 'CNPJ', 'CPF': 'CPF', 'xNome': 'razao_social_destinatario'}
+    TOTAL_FIELDS = {'vProd': 'valor_total_produtos', 'vNF': 'valor_total_nota'}
+
+    # Campos do produto: tag -> (atributo do ItemNF, é decimal)
+    PROD_FIELDS = {
+        'xProd': ('descricao', False),
+        'NCM': ('ncm', False),
+        'CFOP': ('cfop', False),
+        'uCom': ('unidade', False),
+        'qCom': ('quantidade', True),
+        'vUnCom': ('valor_unitario', True),
+        'vProd': ('valor_total', True),
+    }
+
+    # Grupos de tributos: tag do grupo -> (tipo, tags de CST, tag do valor, tag da alíquota)
+    TRIBUTO_FIELDS: Dict[str, Tuple[str, Tuple[str, ...], str, str]] = {
+        'PIS': ('PIS', ('CST',), 'vPIS', 'pPIS'),
+        'COFINS': ('COFINS', ('CST',), 'vCOFINS', 'pCOFINS'),
+        'IPI': ('IPI', ('CST',), 'vIPI', 'pIPI'),
+        'ICMS': ('ICMS', ('CST', 'CSOSN'), 'vICMS', 'pICMS'),
+    }
+    TRIBUTO_ORDER = ('PIS', 'COFINS', 'IPI', 'ICMS')
+
+    # Campos de texto com poucos valores distintos: compartilham a mesma str
+    CODE_FIELDS = frozenset(('ncm', 'cfop', 'unidade'))
+
+    # Limite dos caches de Decimal por texto (valores repetidos compartilham o objeto)
+    MAX_INTERNADOS = 1 << 16
+
+    def __init__(self, to_decimal: Callable[..., Decimal]):
+        self._fallback_decimal = to_decimal
+        self._decimais: Dict[str, Decimal] = {}
+        self._aliquotas: Dict[str, Decimal] = {}
+
+    def to_decimal(self, text: Optional[str], default: Decimal = Decimal('0')) -> Decimal:
+        """Converte texto numérico do XML; campos fora do padrão vão para o conversor tolerante"""
+        if not text:
+            return default
+        try:
+            return self._decimais[text]
+        except KeyError:
+            pass
+        # Caminho estrito do leiaute (-?d+(.d+)?); o resto vai para o conversor tolerante
+        if not formato_nfe(text):
+            return self._fallback_decimal(text, default)
+        valor = Decimal(text)
+        # Decimal é imutável: o mesmo texto (vProd = vBC, alíquotas) reaproveita o objeto
+        if len(self._decimais) >= self.MAX_INTERNADOS:
+            self._decimais.clear()
+        self._decimais[text] = valor
+        return valor
+
+    def to_aliquota(self, text: Optional[str]) -> Decimal:
+        """Converte a alíquota percentual do XML em fração (18.00 -> 0.18)"""
+        if not text:
+            return Decimal('0')
+        try:
+            return self._aliquotas[text]
+        except KeyError:
+            pass
+        aliquota = self.to_decimal(text)
+        aliquota = aliquota / 100 if aliquota > 0 else Decimal('0')
+        if len(self._aliquotas) >= self.MAX_INTERNADOS:
+            self._aliquotas.clear()
+        self._aliquotas[text] = aliquota
+        return aliquota
+
+    def extract_basic_info(self, inf_nfe: ET.Element) -> Dict[str, str]:
+        """Extrai identificação, emitente e destinatário dos filhos diretos de infNFe"""
+        info: Dict[str, str] = {'chave_acesso': inf_nfe.get('Id', '').replace('NFe', '')}
+
+        for group in inf_nfe:
+            tag = local_name(group.tag)
+            if tag == 'ide':
+                campos = self._collect(group, self.IDE_FIELDS)
+                info['numero'] = campos.get('numero', '')
+                info['serie'] = campos.get('serie', '')
+                data_emissao = campos.get('dhEmi') or campos.get('dEmi') or ''
+                info['data_emissao'] = data_emissao[:10]
+            elif tag == 'emit':
+                campos = self._collect(group, self.EMIT_FIELDS)
+                info['cnpj_emitente'] = campos.get('cnpj_emitente', '')
+                info['razao_social_emitente'] = campos.get('razao_social_emitente', '')
+            elif tag == 'dest':
+                campos = self._collect(group, self.DEST_FIELDS)
+                info['cnpj_destinatario'] = campos.get('CNPJ') or campos.get('CPF') or ''
+                info['razao_social_destinatario'] = campos.get('razao_social_destinatario', '')
+
+        return info
+
+    def extract_totais(self, total: ET.Element) -> Dict[str, Decimal]:
+        """Extrai os totais do grupo ICMSTot"""
+        totais = {'valor_total_produtos': Decimal('0'), 'valor_total_nota': Decimal('0')}
+        for group in total:
+            if local_name(group.tag) == 'ICMSTot':
+                campos = self._collect(group, self.TOTAL_FIELDS)
+                for chave, texto in campos.items():
+                    totais[chave] = self.to_decimal(texto)
+                break
+        return totais
+
+    def extract_tributos(self, imposto: ET.Element) -> List[TributoItem]:
+        """Extrai os tributos de um grupo imposto, na ordem PIS, COFINS, IPI, ICMS"""
+        encontrados: Dict[str, List[TributoItem]] = {}
+
+        for group in imposto:
+            spec = self.TRIBUTO_FIELDS.get(local_name(group.tag))
+            if spec is None:
+                continue
+            tipo, cst_tags, valor_tag, aliquota_tag = spec
+
+            if tipo == 'ICMS':
+                # ICMS possui um único subgrupo (ICMS00, ICMS10, ICMSSN102...)
+                subgrupo = next((c for c in group if local_name(c.tag).startswith('ICMS')), None)
+                if subgrupo is None:
+                    continue
+                campos = leaf_texts(subgrupo)
+            else:
+                campos = leaf_texts(group)
+
+            cst = next((campos[t] for t in cst_tags if campos.get(t)), '')
+            valor = self.to_decimal(campos.get(valor_tag))
+            if valor > 0 or cst:
+                encontrados.setdefault(tipo, []).append(TributoItem(
+                    tipo=tipo,
+                    cst=sys.intern(cst),
+                    base_calculo=self.to_decimal(campos.get('vBC')),
+                    aliquota=self.to_aliquota(campos.get(aliquota_tag)),
+                    valor=valor
+                ))
+
+        tributos: List[TributoItem] = []
+        for tipo in self.TRIBUTO_ORDER:
+            tributos.extend(encontrados.get(tipo, ()))
+        return tributos
+
+    def extract_item(self, det: ET.Element, numero: int) -> Optional[ItemNF]:
+        """Extrai um item (det); retorna None se não houver grupo prod"""
+        prod = None
+        imposto = None
+        for group in det:
+            tag = local_name(group.tag)
+            if tag == 'prod':
+                prod = group
+            elif tag == 'imposto':
+                imposto = group
+        if prod is None:
+            return None
+
+        dados = {
+            'descricao': '', 'ncm': '', 'cfop': '', 'unidade': '',
+            'quantidade': Decimal('1'),
+            'valor_unitario': Decimal('0'),
+            'valor_total': Decimal('0'),
+        }
+        fields = self.PROD_FIELDS
+        for child in prod:
+            spec = fields.get(local_name(child.tag))
+            if spec is None:
+                continue
+            attr, is_decimal = spec
+            text = child.text.strip() if child.text else ''
+            if is_decimal:
+                dados[attr] = self.to_decimal(text, dados[attr])
+            else:
+                dados[attr] = sys.intern(text) if attr in self.CODE_FIELDS else text
+
+        return ItemNF(
+            numero=numero,
+            tributos=self.extract_tributos(imposto) if imposto is not None else [],
+            **dados
+        )
+
+    def extract_nota(self, inf_nfe: ET.Element) -> NotaFiscal:
+        """Extrai a nota completa em uma única passagem pelos filhos de infNFe"""
+        info = self.extract_basic_info(inf_nfe)
+        totais = {'valor_total_produtos': Decimal('0'), 'valor_total_nota': Decimal('0')}
+        itens: List[ItemNF] = []
+
+        numero = 0
+        for group in inf_nfe:
+            tag = local_name(group.tag)
+            if tag == 'det':
+                numero += 1
+                item = self.extract_item(group, numero)
+                if item is not None:
+                    itens.append(item)
+            elif tag == 'total':
+                totais = self.extract_totais(group)
+
+        return NotaFiscal(
+            numero=info.get('numero', ''),
+            serie=info.get('serie', ''),
+            data_emissao=info.get('data_emissao', ''),
+            chave_acesso=info.get('chave_acesso', ''),
+            cnpj_emitente=info.get('cnpj_emitente', ''),
+            razao_social_emitente=info.get('razao_social_emitente', ''),
+            cnpj_destinatario=info.get('cnpj_destinatario', ''),
+            razao_social_destinatario=info.get('razao_social_destinatario', ''),
+            valor_total_produtos=totais['valor_total_produtos'],
+            valor_total_nota=totais['valor_total_nota'],
+            itens=itens
+        )
+
+    @staticmethod
+    def _collect(group: ET.Element, fields: Dict[str, str]) -> Dict[str, str]:
+        """Coleta os campos mapeados dos filhos diretos de um grupo"""
+        campos: Dict[str, str] = {}
+        for child in group:
+            chave = fields.get(local_name(child.tag))
+            if chave is not None and chave not in campos and child.text:
+                campos[chave] = child.text.strip()
+        return campos
@@ -0,0 +1,203 @@
+"""
+Parser em streaming (iterparse) para NF-e muito grandes e arquivos de lote
+
+Os itens (<det>) são extraídos assim que o elemento é fechado e em seguida
+removidos da árvore, de modo que o pico de memória não depende do tamanho do
+documento. Arquivos de lote (enviNFe, vários nfeProc concatenados) produzem
+uma nota por infNFe.
+"""
+import io
+import os
+import re
+import xml.etree.ElementTree as ET
+from decimal import Decimal
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple, Union
+
+from ..models import NotaFiscal, ItemNF
+from .nf_extractor import local_name
+from .nf_parser import NFParser, NFParserError
+
+
+# Como no NFParser, ``str`` é o próprio XML; caminhos de arquivo chegam como Path (os.PathLike)
+XMLSource = Union[str, bytes, memoryview, os.PathLike, BinaryIO]
+
+_XML_DECL = re.compile(rb'<\?xml[^>]*\?>')
+_ENCODING = re.compile(rb'encoding\s*=\s*["\']([A-Za-z0-9._-]+)["\']')
+_BOM = b'\xef\xbb\xbf'
+
+# Elementos já consumidos que podem ser descartados assim que fecham
+_DESCARTAVEIS = {'det', 'NFe', 'nfeProc', 'protNFe', 'Signature', 'infNFeSupl'}
+
+
+class LoteXMLReader(io.RawIOBase):
+    """
+    Envolve um fluxo com um ou mais documentos XML concatenados em um único
+    documento (<lote>...</lote>), removendo as declarações intermediárias.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, raw: BinaryIO, chunk_size: int = CHUNK_SIZE):
+        self._raw = raw
+        self._chunk_size = chunk_size
+        self._pending = b''
+        self._carry = b''
+        self._started = False
+        self._finished = False
+
+    def readable(self) -> bool:
+        return True
+
+    def _header(self) -> bytes:
+        first = self._raw.read(self._chunk_size)
+        if first.startswith(_BOM):
+            first = first[len(_BOM):]
+        decl = _XML_DECL.match(first.lstrip())
+        encoding = b'UTF-8'
+        if decl:
+            found = _ENCODING.search(decl.group(0))
+            if found:
+                encoding = found.group(1)
+        self._carry = first
+        return b'<?xml version="1.0" encoding="' + encoding + b'"?><lote>'
+
+    def _next_chunk(self) -> bytes:
+        chunk = self._raw.read(self._chunk_size)
+        data = self._carry + chunk
+        self._carry = b''
+
+        if chunk:
+            # Segura uma declaração possivelmente incompleta para o próximo bloco
+            start = data.rfind(b'<?')
+            if start != -1 and data.find(b'?>', start) == -1:
+                data, self._carry = data[:start], data[start:]
+            elif data.endswith(b'<'):
+                data, self._carry = data[:-1], b'<'
+
+        data = _XML_DECL.sub(b'', data.replace(_BOM, b''))
+        if not chunk:
+            self._finished = True
+            data += b'</lote>'
+        return data
+
+    def readinto(self, buffer) -> int:
+        if not self._started:
+            self._started = True
+            self._pending = self._header()
+
+        while not self._pending and not self._finished:
+            self._pending = self._next_chunk()
+
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+class NFStreamParser:
+    """Parser incremental de NF-e/NFC-e baseado em iterparse"""
+
+    def __init__(self, parser: Optional[NFParser] = None):
+        self.parser = parser or NFParser()
+        self._extractor = self.parser._extractor
+        # Identificação da nota à qual pertence o último item produzido
+        self.nota_atual: Dict[str, str] = {}
+
+    def _open(self, source: XMLSource) -> Tuple[BinaryIO, bool]:
+        """Abre a origem como fluxo binário; retorna (fluxo, deve_fechar)"""
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return io.BytesIO(source), True
+        if isinstance(source, str):
+            # Texto já decodificado: a declaração de encoding original não vale mais para os bytes UTF-8
+            return io.BytesIO(_XML_DECL.sub(b'', source.encode('utf-8'))), True
+        if isinstance(source, os.PathLike):
+            return open(source, 'rb'), True
+        return source, False
+
+    def _eventos(self, source: XMLSource) -> Iterator[Tuple[str, Dict[str, str], Any]]:
+        """
+        Gera ('item', info, ItemNF) para cada <det> e ('nota', info, totais)
+        ao fechar cada infNFe.
+        """
+        raw, close = self._open(source)
+        stream = io.BufferedReader(LoteXMLReader(raw))
+
+        stack: List[ET.Element] = []
+        inf_nfe: Optional[ET.Element] = None
+        info: Optional[Dict[str, str]] = None
+        totais: Dict[str, Decimal] = {}
+        numero = 0
+        notas = 0
+
+        try:
+            for event, elem in ET.iterparse(stream, events=('start', 'end')):
+                if event == 'start':
+                    stack.append(elem)
+                    if local_name(elem.tag) == 'infNFe':
+                        inf_nfe, info, totais, numero = elem, None, {}, 0
+                    continue
+
+                stack.pop()
+                tag = local_name(elem.tag)
+
+                if inf_nfe is not None:
+                    if tag == 'det':
+                        if info is None:
+                            info = self._extractor.extract_basic_info(inf_nfe)
+                        numero += 1
+                        item = self._extractor.extract_item(elem, numero)
+                        if item is not None:
+                            yield 'item', info, item
+                    elif tag == 'total':
+                        totais = self._extractor.extract_totais(elem)
+                    elif tag == 'infNFe':
+                        if info is None:
+                            info = self._extractor.extract_basic_info(inf_nfe)
+                        notas += 1
+                        yield 'nota', info, totais
+                        inf_nfe = None
+                        elem.clear()
+
+                if tag in _DESCARTAVEIS and stack:
+                    stack[-1].remove(elem)
+        except ET.ParseError as e:
+            raise NFParserError(f"XML inválido: {e}")
+        finally:
+            if close:
+                raw.close()
+
+        if notas == 0:
+            raise NFParserError("Estrutura infNFe não encontrada no XML")
+
+    def iter_itens(self, source: XMLSource) -> Iterator[ItemNF]:
+        """
+        Produz os itens um <det> por vez. A identificação da nota corrente
+        fica disponível em ``nota_atual`` (numero, chave_acesso, emitente...).
+        """
+        for tipo, info, payload in self._eventos(source):
+            if tipo == 'item':
+                self.nota_atual = info
+                yield payload
+
+    def iter_notas(self, source: XMLSource) -> Iterator[NotaFiscal]:
+        """Produz uma NotaFiscal por infNFe (útil para arquivos de lote)"""
+        itens: List[ItemNF] = []
+        for tipo, info, payload in self._eventos(source):
+            if tipo == 'item':
+                itens.append(payload)
+                continue
+
+            yield NotaFiscal(
+                numero=info.get('numero', ''),
+                serie=info.get('serie', ''),
+                data_emissao=info.get('data_emissao', ''),
+                chave_acesso=info.get('chave_acesso', ''),
+                cnpj_emitente=info.get('cnpj_emitente', ''),
+                razao_social_emitente=info.get('razao_social_emitente', ''),
+                cnpj_destinatario=info.get('cnpj_destinatario', ''),
+                razao_social_destinatario=info.get('razao_social_destinatario', ''),
+                valor_total_produtos=payload.get('valor_total_produtos', Decimal('0')),
+                valor_total_nota=payload.get('valor_total_nota', Decimal('0')),
+                itens=itens
+            )
+            itens = []
@@ -0,0 +1,133 @@
+"""
+Triagem barata de documentos antes do parse completo
+
+Só um prefixo limitado do documento (``PREFIXO_TRIAGEM`` bytes) é examinado:
+o elemento raiz, a chave de acesso (Id do infNFe) ou a tag ``mod`` e, em
+eventos, o ``tpEvento``. Raiz desconhecida com ``nfeProc``/``NFe``/``infNFe``
+dentro do prefixo (nota embrulhada por um ERP) também é aceita. Isso basta para separar NF-e (modelo 55) e NFC-e
+(modelo 65) de eventos, cancelamentos, inutilizações, CT-e e arquivos que nem
+são XML, sem montar a árvore: em caixas de e-mail misturadas, o que não é nota
+é descartado antes de pagar o custo do parse.
+"""
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+from .nf_extractor import XMLConteudo
+
+
+PREFIXO_TRIAGEM = 4096
+
+# Tipos de documento
+NFE = 'nfe'
+NFCE = 'nfce'
+EVENTO = 'evento'
+CANCELAMENTO = 'cancelamento'
+INUTILIZACAO = 'inutilizacao'
+CTE = 'cte'
+DESCONHECIDO = 'desconhecido'
+INVALIDO = 'invalido'
+
+DESCRICOES = {
+    NFE: 'NF-e',
+    NFCE: 'NFC-e',
+    EVENTO: 'evento de NF-e',
+    CANCELAMENTO: 'cancelamento de NF-e',
+    INUTILIZACAO: 'inutilização de numeração',
+    CTE: 'CT-e',
+    DESCONHECIDO: 'XML que não é NF-e',
+    INVALIDO: 'arquivo que não é XML',
+}
+
+# Elemento raiz -> tipo
+RAIZES = {
+    'nfeProc': NFE, 'NFe': NFE, 'infNFe': NFE, 'enviNFe': NFE,
+    'procEventoNFe': EVENTO, 'evento': EVENTO, 'envEvento': EVENTO, 'retEnvEvento': EVENTO, 'retEvento': EVENTO,
+    'procCancNFe': CANCELAMENTO, 'cancNFe': CANCELAMENTO, 'retCancNFe': CANCELAMENTO,
+    'procInutNFe': INUTILIZACAO, 'inutNFe': INUTILIZACAO, 'retInutNFe': INUTILIZACAO,
+    'cteProc': CTE, 'CTe': CTE, 'procEventoCTe': CTE, 'cteOSProc': CTE, 'CTeOS': CTE,
+}
+TPEVENTO_CANCELAMENTO = (b'110111', b'110112')  # cancelamento e cancelamento por substituição
+
+_RAIZ = re.compile(rb'<(?![?!])(?:[\w.\-]+:)?([\w.\-]+)')
+# NF-e dentro de outra raiz (ex.: <retornoERP><documento><nfeProc>): como o .//nfeProc do parse
+_NFE_ANINHADA = re.compile(rb'<(?:[\w.\-]+:)?(?:nfeProc|NFe|infNFe)[\s/>]')
+_CHAVE = re.compile(rb'Id\s*=\s*["\']NFe(\d{44})["\']')
+_MODELO = re.compile(rb'<(?:[\w.\-]+:)?mod>\s*(\d{2})\s*<')
+_TPEVENTO = re.compile(rb'<(?:[\w.\-]+:)?tpEvento>\s*(\d{6})\s*<')
+_BOMS_UTF16 = (b'\xff\xfe', b'\xfe\xff')
+
+
+@dataclass(frozen=True)
+class Triagem:
+    """Classificação de um documento pelo prefixo"""
+    tipo: str
+    raiz: Optional[str] = None
+    modelo: Optional[str] = None  # '55' (NF-e) ou '65' (NFC-e), quando identificado
+
+    @property
+    def aceito(self) -> bool:
+        """NF-e e NFC-e seguem para o parse; o resto é descartado"""
+        return self.tipo in (NFE, NFCE)
+
+    @property
+    def descricao(self) -> str:
+        return DESCRICOES[self.tipo]
+
+    @property
+    def motivo(self) -> Optional[str]:
+        """Mensagem de descarte (None se aceito)"""
+        if self.aceito:
+            return None
+        raiz = f" (raiz <{self.raiz}>)" if self.raiz and self.tipo == DESCONHECIDO else ''
+        return f"Documento não é NF-e/NFC-e: {self.descricao}{raiz}"
+
+
+def _prefixo(conteudo: XMLConteudo, limite: int) -> bytes:
+    """Primeiros ``limite`` bytes do documento, sem consumir arquivos abertos"""
+    if isinstance(conteudo, str):
+        return conteudo[:limite].encode('utf-8', 'replace')
+    if hasattr(conteudo, 'read'):
+        posicao = conteudo.tell()
+        prefixo = conteudo.read(limite)
+        conteudo.seek(posicao)
+        return prefixo if isinstance(prefixo, bytes) else prefixo.encode('utf-8', 'replace')
+    return bytes(conteudo[:limite])
+
+
+def triar(conteudo: XMLConteudo, limite: int = PREFIXO_TRIAGEM) -> Triagem:
+    """Classifica o documento olhando só o prefixo (texto, bytes, memoryview ou arquivo binário)"""
+    if hasattr(conteudo, 'read') and not conteudo.seekable():
+        # Stream sem retorno: espiar consumiria o documento, a validação fica com o parse
+        return Triagem(NFE)
+    prefixo = _prefixo(conteudo, limite)
+    if prefixo.startswith(_BOMS_UTF16):
+        prefixo = prefixo.decode('utf-16', 'replace').encode('utf-8', 'replace')
+    prefixo = prefixo.lstrip(b'\xef\xbb\xbf \t\r\n')
+    if not prefixo.startswith(b'<'):
+        return Triagem(INVALIDO)
+
+    raiz = _RAIZ.search(prefixo)
+    if raiz is None:
+        return Triagem(INVALIDO)
+    nome = raiz.group(1).decode('ascii', 'replace')
+    tipo = RAIZES.get(nome, DESCONHECIDO)
+    if tipo == DESCONHECIDO and _NFE_ANINHADA.search(prefixo, raiz.end()):
+        tipo = NFE
+
+    if tipo == NFE:
+        # Modelo pela chave de acesso (posições 21-22) ou pela tag mod
+        chave = _CHAVE.search(prefixo)
+        modelo = chave.group(1)[20:22] if chave else None
+        if modelo is None:
+            mod = _MODELO.search(prefixo)
+            modelo = mod.group(1) if mod else None
+        modelo = modelo.decode('ascii') if modelo else None
+        return Triagem(NFCE if modelo == '65' else NFE, nome, modelo)
+
+    if tipo == EVENTO:
+        evento = _TPEVENTO.search(prefixo)
+        if evento and evento.group(1) in TPEVENTO_CANCELAMENTO:
+            tipo = CANCELAMENTO
+
+    return Triagem(tipo, nome)
@@ -0,0 +1,103 @@
+"""
+Validação opcional das NF-e contra os schemas XSD oficiais (leiaute 4.00)
+
+O schema é compilado uma única vez por processo (``carregar_esquema`` guarda
+os compilados por caminho). O ProcessadorLote compila no processo principal
+antes de subir o pool, então os workers criados por fork herdam os schemas já
+prontos; com spawn, cada worker compila uma vez no initializer.
+
+A validação usa a mesma árvore do parse: com um validador, o NFParser monta o
+documento com o lxml e o extrator trabalha sobre essa árvore, sem segundo
+parse.
+
+Os schemas não acompanham o projeto: baixe o pacote de liberação (PL_009) no
+Portal da NF-e e descompacte em ``data/schemas`` (ou informe outro caminho).
+"""
+import os
+from typing import Dict, List, Optional
+
+from lxml import etree
+
+from .nf_extractor import XMLConteudo, local_name
+
+
+XSD_DIR_PADRAO = os.path.join('data', 'schemas')
+
+# Elemento raiz -> schema do pacote de liberação
+ESQUEMAS_POR_RAIZ = {
+    'nfeProc': 'procNFe_v4.00.xsd',
+    'NFe': 'nfe_v4.00.xsd',
+}
+MAX_ERROS = 10
+
+# Schemas compilados neste processo, por caminho absoluto
+_ESQUEMAS: Dict[str, etree.XMLSchema] = {}
+
+# Sem entidades externas nem rede; comentários não entram na árvore do extrator
+_OPCOES_PARSER = dict(resolve_entities=False, no_network=True, remove_comments=True, remove_pis=True)
+_PARSERS: Dict[Optional[str], etree.XMLParser] = {}
+
+
+def carregar_esquema(caminho: str) -> etree.XMLSchema:
+    """Schema compilado (uma vez por processo; includes resolvidos a partir do diretório do arquivo)"""
+    caminho = os.path.abspath(caminho)
+    try:
+        return _ESQUEMAS[caminho]
+    except KeyError:
+        pass
+    try:
+        esquema = etree.XMLSchema(etree.parse(caminho))
+    except (OSError, etree.XMLSchemaParseError, etree.XMLSyntaxError) as e:
+        raise ValueError(f"Schema XSD inválido ou inacessível ({caminho}): {e}") from e
+    _ESQUEMAS[caminho] = esquema
+    return esquema
+
+
+def _parser(encoding: Optional[str] = None) -> etree.XMLParser:
+    try:
+        return _PARSERS[encoding]
+    except KeyError:
+        parser = _PARSERS[encoding] = etree.XMLParser(encoding=encoding, **_OPCOES_PARSER)
+        return parser
+
+
+def parse_lxml(conteudo: XMLConteudo) -> etree._Element:
+    """Monta a árvore lxml do documento (texto, bytes/buffer ou arquivo binário)"""
+    if isinstance(conteudo, str):
+        # O texto já está decodificado: a declaração de encoding é ignorada
+        return etree.fromstring(conteudo.encode('utf-8'), _parser('utf-8'))
+    if hasattr(conteudo, 'read'):
+        return etree.parse(conteudo, _parser()).getroot()
+    return etree.fromstring(bytes(conteudo), _parser())
+
+
+class ValidadorXSD:
+    """Valida árvores de NF-e contra os schemas de um diretório (ou um único .xsd)"""
+
+    def __init__(self, origem: str = XSD_DIR_PADRAO):
+        self.origem = origem
+        if os.path.isdir(origem):
+            caminhos = {raiz: os.path.join(origem, arquivo) for raiz, arquivo in ESQUEMAS_POR_RAIZ.items()
+                        if os.path.isfile(os.path.join(origem, arquivo))}
+            if not caminhos:
+                raise FileNotFoundError(
+                    f"Nenhum schema da NF-e em {origem} (esperado: {', '.join(ESQUEMAS_POR_RAIZ.values())})"
+                )
+        elif os.path.isfile(origem):
+            caminhos = {None: origem}
+        else:
+            raise FileNotFoundError(f"Schema XSD não encontrado: {origem}")
+        self._esquemas = {raiz: carregar_esquema(caminho) for raiz, caminho in caminhos.items()}
+
+    def __reduce__(self):
+        # Schemas compilados não são picklable: o outro processo recompila (uma vez) pelo caminho
+        return (ValidadorXSD, (self.origem,))
+
+    def validar(self, raiz: etree._Element) -> List[str]:
+        """Erros de schema da árvore (lista vazia se conforme), limitados a ``MAX_ERROS``"""
+        esquema = self._esquemas.get(local_name(raiz.tag), self._esquemas.get(None))
+        if esquema is None:
+            return [f"Sem schema para a raiz <{local_name(raiz.tag)}>"]
+        if esquema.validate(raiz):
+            return []
+        return [f"linha {erro.line}: {erro.message}" for erro in list(esquema.error_log)[:MAX_ERROS]]
@@ -1,18 +1,30 @@
-
+import os
 import xml.etree.ElementTree as ET
+from typing import Dict, List, Optional, Union
+
 import pandas as pd
 
+from .nf_extractor import XMLConteudo, find_inf_nfe, local_name, parse_xml
+
 
-def ler_xml_universal(caminho_arquivo: str) -> pd.DataFrame:
+def _raiz(fonte: Union[str, os.PathLike, XMLConteudo]) -> ET.Element:
+    """Caminho (str/PathLike) é lido do disco; bytes, memoryview e arquivos abertos são parseados em memória"""
+    if isinstance(fonte, (str, os.PathLike)):
+        return ET.parse(fonte).getroot()
+    return parse_xml(fonte)
+
+
+def ler_xml_universal(caminho_arquivo: Union[str, os.PathLike, XMLConteudo]) -> pd.DataFrame:
     """
     Lê qualquer XML (tratando namespaces) e devolve um DataFrame com:
       - path: caminho hierárquico até o elemento (tag1/tag2/...)
       - tag: nome da tag (sem namespace)
       - attributes: dict de atributos
       - text: conteúdo de texto (ou None)
+
+    Aceita o caminho do arquivo ou o conteúdo em bytes/memoryview.
     """
-    tree = ET.parse(caminho_arquivo)
-    root = tree.getroot()
+    root = _raiz(caminho_arquivo)
     registros = []
 
     def clean_tag(tag: str) -> str:
@@ -32,4 +44,80 @@ def ler_xml_universal(caminho_arquivo: str) -> pd.DataFrame:
             percorrer(filho, novo_path)
 
     percorrer(root)
-    return pd.DataFrame(registros)
\ No newline at end of file
+    return pd.DataFrame(registros)
+
+
+# Campos lidos de cada det: tag do prod -> coluna
+CAMPOS_PROD = {'xProd': 'produto', 'NCM': 'ncm', 'vProd': 'valor_produto'}
+# Grupo de imposto -> (coluna, tag do valor)
+VALORES_TRIBUTO = {'PIS': ('valor_pis', 'vPIS'), 'COFINS': ('valor_cofins', 'vCOFINS'), 'IPI': ('valor_ipi', 'vIPI')}
+COLUNAS_ITENS = ['produto', 'ncm', 'cst', 'valor_produto', 'valor_pis', 'valor_cofins', 'valor_ipi']
+COLUNAS_NUMERICAS = ['valor_produto', 'valor_pis', 'valor_cofins', 'valor_ipi']
+
+
+def _texto(elem: Optional[ET.Element]) -> Optional[str]:
+    if elem is None or elem.text is None:
+        return None
+    return elem.text.strip() or None
+
+
+def _cst_icms(imposto: ET.Element) -> Optional[str]:
+    """CST (ou CSOSN) do subgrupo de ICMS do item"""
+    for grupo in imposto:
+        if local_name(grupo.tag) != 'ICMS':
+            continue
+        for subgrupo in grupo:
+            for campo in subgrupo:
+                if local_name(campo.tag) in ('CST', 'CSOSN'):
+                    return _texto(campo)
+    return None
+
+
+def extrair_itens_xml(fonte: Union[str, os.PathLike, XMLConteudo]) -> pd.DataFrame:
+    """
+    Extrai só os campos usados no relatório, um registro por item (det)
+
+    ``fonte`` é o caminho ou o próprio conteúdo (bytes/memoryview, sem
+    arquivo temporário). O documento é montado pelo parser em C e só os filhos ``det`` de
+    ``infNFe`` são visitados em Python. Retorna um DataFrame indexado por ``item`` (nItem) com
+    ``COLUNAS_ITENS``; valores em float e NaN quando o grupo do tributo não
+    existe no XML.
+    """
+    itens: List[int] = []
+    colunas: Dict[str, List[Optional[str]]] = {coluna: [] for coluna in COLUNAS_ITENS}
+
+    inf_nfe = find_inf_nfe(_raiz(fonte))
+    for elem in (inf_nfe if inf_nfe is not None else ()):
+        if local_name(elem.tag) != 'det':
+            continue
+
+        valores: Dict[str, Optional[str]] = dict.fromkeys(COLUNAS_ITENS)
+        for grupo in elem:
+            tag = local_name(grupo.tag)
+            if tag == 'prod':
+                for campo in grupo:
+                    coluna = CAMPOS_PROD.get(local_name(campo.tag))
+                    if coluna is not None:
+                        valores[coluna] = _texto(campo)
+            elif tag == 'imposto':
+                valores['cst'] = _cst_icms(grupo)
+                for tributo in grupo:
+                    spec = VALORES_TRIBUTO.get(local_name(tributo.tag))
+                    if spec is None:
+                        continue
+                    coluna, tag_valor = spec
+                    valor = next((c for c in tributo.iter() if local_name(c.tag) == tag_valor), None)
+                    # Grupo presente sem valor (ex.: PISNT) conta como zero
+                    valores[coluna] = _texto(valor) or '0'
+
+        itens.append(int(elem.get('nItem') or len(itens) + 1))
+        for coluna in COLUNAS_ITENS:
+            colunas[coluna].append(valores[coluna])
+
+    df = pd.DataFrame(colunas, index=pd.Index(itens, name='item', dtype='int64'), columns=COLUNAS_ITENS)
+    for coluna in COLUNAS_NUMERICAS:
+        df[coluna] = pd.to_numeric(df[coluna], errors='coerce').astype('float64')
+    df['valor_produto'] = df['valor_produto'].fillna(0.0)
+    for coluna in ('produto', 'ncm', 'cst'):
+        df[coluna] = df[coluna].astype(object)
+    return df
@@ -0,0 +1,218 @@
+"""
+Leitura de lotes compactados de NF-e (ZIP, tar, tar.gz e .xml.gz) sem extrair para o disco
+
+Os membros XML são entregues como pares (nome, conteúdo) prontos para o
+ProcessadorLote, que os consome sob demanda (poucos blocos em voo), então só
+uma janela pequena do lote fica descompactada em memória por vez:
+
+- ZIP em disco: cada membro vira um ``MembroZip`` e é descompactado pelo
+  próprio worker (descompressão em paralelo, sem passar bytes pelo IPC);
+- ZIP em memória (upload): membros descompactados um a um, conforme consumidos;
+- tar / tar.gz: lidos em modo streaming, membro a membro;
+- .gz: um único XML.
+
+Cada membro tem tamanho máximo (``MAX_MEMBRO``); membros maiores (ou
+corrompidos) viram um resultado de erro, sem interromper o restante do lote.
+"""
+import gzip
+import io
+import tarfile
+import zipfile
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterator, Optional, Tuple, Union
+
+
+MAX_MEMBRO = 64 * 1024 * 1024
+EXTENSOES_COMPACTADAS = ('.zip', '.tar', '.tgz', '.tar.gz', '.gz')
+
+_ZIPS_ABERTOS = 4
+
+
+class ArquivoCompactadoError(Exception):
+    """Membro inválido, grande demais ou arquivo compactado corrompido"""
+    pass
+
+
+def tipo_arquivo(cabecalho: bytes) -> str:
+    """Identifica pelo conteúdo: ``'zip'``, ``'tar'``, ``'gzip'``, ``'tar.gz'`` ou ``'xml'``"""
+    if cabecalho[:4] in (b'PK\x03\x04', b'PK\x05\x06'):
+        return 'zip'
+    if cabecalho[:2] == b'\x1f\x8b':
+        try:
+            # Descompacta só o começo (entrada truncada é aceita pelo decompressobj)
+            inicio = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(cabecalho, 512)
+        except zlib.error:
+            inicio = b''
+        return 'tar.gz' if inicio[257:262] == b'ustar' else 'gzip'
+    if cabecalho[257:262] == b'ustar':
+        return 'tar'
+    return 'xml'
+
+
+def e_compactado(nome: str) -> bool:
+    return nome.lower().endswith(EXTENSOES_COMPACTADAS)
+
+
+def _ler_limitado(arquivo, nome: str, limite: int) -> bytes:
+    dados = arquivo.read(limite + 1)
+    if len(dados) > limite:
+        raise ArquivoCompactadoError(f"{nome}: membro maior que {limite // (1024 * 1024)} MB")
+    return dados
+
+
+def _e_xml(nome: str) -> bool:
+    return nome.lower().endswith('.xml') and not nome.rsplit('/', 1)[-1].startswith('.')
+
+
+# ZipFiles abertos por processo (cada worker reaproveita o diretório central já lido)
+_zips: 'OrderedDict[str, zipfile.ZipFile]' = OrderedDict()
+
+
+def _abrir_zip(caminho: str) -> zipfile.ZipFile:
+    arquivo = _zips.pop(caminho, None) or zipfile.ZipFile(caminho)
+    _zips[caminho] = arquivo
+    while len(_zips) > _ZIPS_ABERTOS:
+        _zips.popitem(last=False)[1].close()
+    return arquivo
+
+
+class MembroZip:
+    """Membro de um ZIP em disco, descompactado só quando o worker o lê"""
+    __slots__ = ('caminho', 'membro', 'limite')
+
+    def __init__(self, caminho: str, membro: str, limite: int = MAX_MEMBRO):
+        self.caminho = caminho
+        self.membro = membro
+        self.limite = limite
+
+    def ler(self) -> bytes:
+        try:
+            with _abrir_zip(self.caminho).open(self.membro) as arquivo:
+                return _ler_limitado(arquivo, self.membro, self.limite)
+        except (zipfile.BadZipFile, OSError, EOFError) as e:
+            raise ArquivoCompactadoError(f"{self.membro}: {e}") from e
+
+    def __reduce__(self):
+        return (MembroZip, (self.caminho, self.membro, self.limite))
+
+
+class MembroInvalido:
+    """Membro que não pôde ser lido; o erro aparece no resultado do arquivo"""
+    __slots__ = ('erro',)
+
+    def __init__(self, erro: str):
+        self.erro = erro
+
+    def ler(self) -> bytes:
+        raise ArquivoCompactadoError(self.erro)
+
+    def __reduce__(self):
+        return (MembroInvalido, (self.erro,))
+
+
+Origem = Union[bytes, Path]
+Membro = Tuple[str, Union[bytes, Path, MembroZip, MembroInvalido]]
+
+
+def _iter_zip(origem: Origem, nome: str, limite: int) -> Iterator[Membro]:
+    if isinstance(origem, Path):
+        with zipfile.ZipFile(origem) as arquivo:
+            infos = [info for info in arquivo.infolist() if not info.is_dir() and _e_xml(info.filename)]
+        for info in infos:
+            yield f"{nome}/{info.filename}", MembroZip(str(origem), info.filename, limite)
+        return
+
+    with zipfile.ZipFile(io.BytesIO(origem)) as arquivo:
+        for info in arquivo.infolist():
+            if info.is_dir() or not _e_xml(info.filename):
+                continue
+            membro = f"{nome}/{info.filename}"
+            try:
+                with arquivo.open(info) as dados:
+                    yield membro, _ler_limitado(dados, info.filename, limite)
+            except (ArquivoCompactadoError, zipfile.BadZipFile, OSError, EOFError) as e:
+                yield membro, MembroInvalido(str(e))
+
+
+def _iter_tar(origem: Origem, nome: str, limite: int) -> Iterator[Membro]:
+    fonte = origem.open('rb') if isinstance(origem, Path) else io.BytesIO(origem)
+    with fonte, tarfile.open(fileobj=fonte, mode='r|*') as arquivo:
+        for info in arquivo:
+            if not info.isfile() or not _e_xml(info.name):
+                continue
+            membro = f"{nome}/{info.name}"
+            if info.size > limite:
+                yield membro, MembroInvalido(f"{info.name}: membro maior que {limite // (1024 * 1024)} MB")
+                continue
+            yield membro, arquivo.extractfile(info).read()
+
+
+def _iter_gzip(origem: Origem, nome: str, limite: int) -> Iterator[Membro]:
+    fonte = origem.open('rb') if isinstance(origem, Path) else io.BytesIO(origem)
+    membro = nome[:-3] if nome.lower().endswith('.gz') else nome
+    try:
+        with fonte, gzip.GzipFile(fileobj=fonte) as arquivo:
+            yield membro, _ler_limitado(arquivo, membro, limite)
+    except (ArquivoCompactadoError, OSError, EOFError) as e:
+        yield membro, MembroInvalido(str(e))
+
+
+_LEITORES = {'zip': _iter_zip, 'tar': _iter_tar, 'tar.gz': _iter_tar, 'gzip': _iter_gzip}
+
+
+def iter_xmls(origem: Origem, nome: Optional[str] = None, limite: int = MAX_MEMBRO) -> Iterator[Membro]:
+    """
+    Expande um arquivo (XML simples ou compactado) em pares (nome, conteúdo)
+
+    ``origem`` pode ser o caminho (lido sob demanda) ou os bytes já em memória.
+    Arquivos que não são compactados são repassados como estão.
+    """
+    nome = nome or (origem.name if isinstance(origem, Path) else 'arquivo')
+    if isinstance(origem, Path):
+        with origem.open('rb') as arquivo:
+            cabecalho = arquivo.read(1024)
+    else:
+        cabecalho = bytes(origem[:1024])
+
+    leitor = _LEITORES.get(tipo_arquivo(cabecalho))
+    if leitor is None:
+        yield nome, origem
+        return
+    try:
+        yield from leitor(origem, nome, limite)
+    except (tarfile.TarError, zipfile.BadZipFile, OSError, EOFError) as e:
+        yield nome, MembroInvalido(f"Arquivo compactado inválido: {e}")
+
+
+def contar_xmls(origem: Origem) -> Optional[int]:
+    """
+    Número de XMLs do arquivo, lendo só o diretório (ZIP) ou os cabeçalhos (tar)
+
+    Retorna None para tar.gz: os cabeçalhos ficam dentro do fluxo comprimido e
+    contar exigiria descompactar o arquivo inteiro, que ``iter_xmls`` descompacta
+    de novo. Nesse caso quem mostra progresso deve ir ajustando o total.
+    """
+    if isinstance(origem, Path):
+        with origem.open('rb') as arquivo:
+            cabecalho = arquivo.read(1024)
+        fonte = lambda: origem.open('rb')  # noqa: E731
+    else:
+        cabecalho = bytes(origem[:1024])
+        fonte = lambda: io.BytesIO(origem)  # noqa: E731
+
+    tipo = tipo_arquivo(cabecalho)
+    try:
+        if tipo == 'zip':
+            with fonte() as dados, zipfile.ZipFile(dados) as arquivo:
+                return sum(1 for info in arquivo.infolist() if not info.is_dir() and _e_xml(info.filename))
+        if tipo == 'tar':
+            # Modo com seek: pula os dados de cada membro
+            with fonte() as dados, tarfile.open(fileobj=dados, mode='r:') as arquivo:
+                return sum(1 for info in arquivo if info.isfile() and _e_xml(info.name))
+        if tipo == 'tar.gz':
+            return None
+    except (tarfile.TarError, zipfile.BadZipFile, OSError, EOFError):
+        pass
+    return 1
@@ -0,0 +1,261 @@
+"""
+Pipeline de processamento em lote: parse + cálculo distribuídos em processos
+
+Cada arquivo é lido, parseado (direto dos bytes) e comparado em um processo de um
+ProcessPoolExecutor. Membros de ZIP em disco (``arquivos.MembroZip``) também
+são descompactados no worker. Os resultados são objetos simples (picklable) e são
+devolvidos na mesma ordem de entrada, mesmo que os workers terminem fora de
+ordem.
+"""
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from itertools import chain, islice
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from ..calculo.calculadora_rti import CalculadoraTributaria
+from ..models import CalculoComparativo, NotaFiscal
+from ..parser.cache import CacheNotas
+from ..parser.nf_parser import NFParser, NFParserError, NFSchemaError
+from ..parser.triagem import NFCE, NFE, triar
+from ..parser.validacao_xsd import ValidadorXSD
+from ..util import telemetria
+from .arquivos import ArquivoCompactadoError, MembroInvalido, MembroZip
+
+
+# Conteúdo do XML em memória (bytes ou memoryview, sem decodificar), caminho,
+# membro compactado lido pelo próprio worker ou nota já extraída em streaming
+# de um arquivo de lote (só falta o cálculo)
+Conteudo = Union[bytes, memoryview, Path, MembroZip, MembroInvalido, NotaFiscal]
+
+
+@dataclass
+class ResultadoArquivo:
+    """Resultado do processamento de um arquivo XML"""
+    indice: int
+    nome: str
+    nota_fiscal: Optional[NotaFiscal] = None
+    comparativo: Optional[CalculoComparativo] = None
+    erro: Optional[str] = None
+    erro_parser: bool = False  # True para NFParserError, False para erro inesperado
+    tipo_documento: Optional[str] = None  # classificação da triagem (nfe, nfce, evento, cte...)
+    descartado: bool = False  # True se a triagem recusou o documento (não é NF-e/NFC-e)
+    erros_xsd: Optional[List[str]] = None  # mensagens do schema, se a validação XSD recusou o documento
+
+    @property
+    def sucesso(self) -> bool:
+        return self.erro is None
+
+
+# Estado por processo worker, criado uma única vez no initializer
+_PARSER: Optional[NFParser] = None
+_CALCULADORA: Optional[CalculadoraTributaria] = None
+_CACHE: Optional[CacheNotas] = None
+_COLETOR: Optional[telemetria.ColetorMemoria] = None
+
+
+def _inicializar_worker(calculadora: Optional[CalculadoraTributaria], cache_dir: Optional[str] = None,
+                        xsd: Optional[str] = None, rastrear: bool = False):
+    """Initializer do pool: cada worker recebe sua cópia do parser e da calculadora"""
+    global _PARSER, _CALCULADORA, _CACHE, _COLETOR
+    # Destinos herdados por fork não são usados no worker: os eventos seguem com os resultados
+    _COLETOR = telemetria.ColetorMemoria() if rastrear else None
+    telemetria.configurar(*([_COLETOR] if rastrear else []))
+    # Com fork o schema já vem compilado do processo principal; com spawn compila aqui, uma vez
+    _PARSER = NFParser(ValidadorXSD(xsd) if xsd else None)
+    _CALCULADORA = calculadora
+    _CACHE = CacheNotas(cache_dir) if cache_dir else None
+
+
+def _comparar(calculadora: Optional[CalculadoraTributaria], nota_fiscal: NotaFiscal) -> Optional[CalculoComparativo]:
+    if not calculadora:
+        return None
+    with telemetria.span('calculo') as span:
+        span.itens = len(nota_fiscal.itens)
+        return calculadora.realizar_comparacao(nota_fiscal)
+
+
+def processar_conteudo(indice: int, nome: str, conteudo: Conteudo,
+                       parser: Optional[NFParser] = None,
+                       calculadora: Optional[CalculadoraTributaria] = None,
+                       cache: Optional[CacheNotas] = None) -> ResultadoArquivo:
+    """Processa um único arquivo: triagem, parse direto dos bytes e cálculo do comparativo"""
+    parser = parser or _PARSER or NFParser()
+    calculadora = calculadora if calculadora is not None else _CALCULADORA
+    cache = cache if cache is not None else _CACHE
+
+    # Eventos e spans do arquivo levam o nome dele (sem custo com a instrumentação desligada)
+    with telemetria.contexto(arquivo=nome):
+        try:
+            if isinstance(conteudo, NotaFiscal):
+                modelo = NFCE if conteudo.chave_acesso[20:22] == '65' else NFE
+                return ResultadoArquivo(indice, nome, conteudo, _comparar(calculadora, conteudo),
+                                        tipo_documento=modelo)
+            if isinstance(conteudo, Path):
+                conteudo = conteudo.read_bytes()
+            elif isinstance(conteudo, (MembroZip, MembroInvalido)):
+                conteudo = conteudo.ler()
+            # Triagem pelo prefixo: o que não é NF-e/NFC-e sai antes do hash e do parse
+            with telemetria.span('triagem'):
+                triagem = triar(conteudo)
+            if not triagem.aceito:
+                return ResultadoArquivo(indice, nome, erro=triagem.motivo, erro_parser=True,
+                                        tipo_documento=triagem.tipo, descartado=True)
+            if cache is not None and parser.validador_xsd is None:
+                # XML já visto: a nota vem do cache, sem parse
+                nota_fiscal = cache.parse(conteudo, parser, triagem)
+            else:
+                nota_fiscal = parser.parse_nota_fiscal(conteudo, triagem)
+            return ResultadoArquivo(indice, nome, nota_fiscal, _comparar(calculadora, nota_fiscal),
+                                    tipo_documento=triagem.tipo)
+        except NFSchemaError as e:
+            return ResultadoArquivo(indice, nome, erro=str(e), erro_parser=True,
+                                    tipo_documento=triagem.tipo, erros_xsd=e.erros)
+        except (NFParserError, ArquivoCompactadoError) as e:
+            return ResultadoArquivo(indice, nome, erro=str(e), erro_parser=True)
+        except Exception as e:
+            return ResultadoArquivo(indice, nome, erro=str(e))
+
+
+def _processar_bloco(bloco: Sequence[Tuple[int, str, Conteudo]]) -> Tuple[List[ResultadoArquivo], List[dict]]:
+    """Tarefa do worker: processa um bloco de arquivos (reduz o overhead de IPC)"""
+    resultados = [processar_conteudo(indice, nome, conteudo) for indice, nome, conteudo in bloco]
+    if _CACHE is not None:
+        _CACHE.flush()
+    # Eventos da instrumentação voltam com o bloco e são emitidos nos destinos do processo principal
+    eventos = _COLETOR.drenar() if _COLETOR is not None else []
+    return resultados, eventos
+
+
+class ProcessadorLote:
+    """Distribui parse e cálculo de vários XMLs entre processos"""
+
+    # Abaixo deste número de arquivos o custo de subir o pool não compensa
+    MIN_ARQUIVOS_PARALELO = 8
+
+    def __init__(self, calculadora: Optional[CalculadoraTributaria] = None,
+                 max_workers: Optional[int] = None, tamanho_bloco: int = 16,
+                 cache_dir: Optional[str] = None, xsd: Optional[str] = None):
+        self.calculadora = calculadora
+        self.cache_dir = cache_dir
+        # Validação XSD opcional (diretório dos schemas ou .xsd); compilado já aqui, antes do pool
+        self.xsd = xsd
+        self.validador_xsd = ValidadorXSD(xsd) if xsd else None
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.tamanho_bloco = max(1, tamanho_bloco)
+
+    def _processar_local(self, tarefas: Iterable[Tuple[int, str, Conteudo]]) -> Iterator[ResultadoArquivo]:
+        """Processa no próprio processo (lotes pequenos ou um único worker)"""
+        parser = NFParser(self.validador_xsd)
+        cache = CacheNotas(self.cache_dir) if self.cache_dir else None
+        try:
+            for indice, nome, conteudo in tarefas:
+                yield processar_conteudo(indice, nome, conteudo, parser, self.calculadora, cache)
+        finally:
+            if cache is not None:
+                cache.close()
+
+    def processar_iter(self, arquivos: Iterable[Tuple[str, Conteudo]],
+                       ordenado: bool = False) -> Iterator[ResultadoArquivo]:
+        """
+        Processa pares (nome, conteúdo) e produz os resultados à medida que
+        ficam prontos (fora de ordem; use ``ResultadoArquivo.indice``).
+
+        A entrada é consumida sob demanda: no máximo ``2 * max_workers`` blocos
+        ficam em voo, então a memória não cresce com o tamanho do lote. Com
+        ``ordenado``, os resultados saem na ordem de entrada e os blocos prontos
+        que esperam a vez contam na mesma janela: um bloco lento no início
+        pausa o envio em vez de acumular resultados.
+        """
+        tarefas = ((i, nome, conteudo) for i, (nome, conteudo) in enumerate(arquivos))
+
+        if self.max_workers <= 1:
+            yield from self._processar_local(tarefas)
+            return
+
+        # Lotes pequenos não compensam o custo de subir o pool
+        inicio = list(islice(tarefas, self.MIN_ARQUIVOS_PARALELO))
+        if len(inicio) < self.MIN_ARQUIVOS_PARALELO:
+            yield from self._processar_local(inicio)
+            return
+
+        # memoryview não é picklable: só vira bytes ao cruzar para o worker
+        tarefas = ((i, nome, bytes(conteudo) if isinstance(conteudo, memoryview) else conteudo)
+                   for i, nome, conteudo in chain(inicio, tarefas))
+        blocos = iter(lambda: list(islice(tarefas, self.tamanho_bloco)), [])
+
+        with ProcessPoolExecutor(max_workers=self.max_workers,
+                                 initializer=_inicializar_worker,
+                                 initargs=(self.calculadora, self.cache_dir, self.xsd,
+                                           telemetria.ativo())) as executor:
+            janela = 2 * self.max_workers
+            em_voo = {}  # future -> (número do bloco, bloco)
+            adiantados: Dict[int, List[ResultadoArquivo]] = {}  # ordenado: blocos prontos antes da vez
+            enviados = proximo = 0
+
+            def enviar() -> bool:
+                nonlocal enviados
+                bloco = next(blocos, None)
+                if bloco:
+                    em_voo[executor.submit(_processar_bloco, bloco)] = (enviados, bloco)
+                    enviados += 1
+                return bool(bloco)
+
+            while len(em_voo) < janela and enviar():
+                pass
+
+            while em_voo:
+                prontos, _ = wait(em_voo, return_when=FIRST_COMPLETED)
+                for future in prontos:
+                    numero, bloco = em_voo.pop(future)
+                    try:
+                        bloco_resultados, eventos = future.result()
+                        for evento in eventos:
+                            telemetria.emitir(evento)
+                    except Exception as e:
+                        # Worker perdido (ex.: falta de memória): reporta cada arquivo do bloco
+                        bloco_resultados = [ResultadoArquivo(indice, nome, erro=str(e))
+                                            for indice, nome, _ in bloco]
+                    if not ordenado:
+                        yield from bloco_resultados
+                        continue
+                    adiantados[numero] = bloco_resultados
+                    while proximo in adiantados:
+                        yield from adiantados.pop(proximo)
+                        proximo += 1
+
+                while len(em_voo) + len(adiantados) < janela and enviar():
+                    pass
+
+    def processar_ordenado(self, arquivos: Iterable[Tuple[str, Conteudo]]) -> Iterator[ResultadoArquivo]:
+        """
+        Como ``processar_iter``, mas na ordem de entrada, com memória limitada
+        pela mesma janela de blocos (``processar_iter(..., ordenado=True)``)
+        """
+        return self.processar_iter(arquivos, ordenado=True)
+
+    def processar(self, arquivos: Iterable[Tuple[str, Conteudo]],
+                  on_resultado: Optional[Callable[[ResultadoArquivo, int, int], None]] = None,
+                  total: Optional[int] = None) -> List[ResultadoArquivo]:
+        """
+        Processa pares (nome, conteúdo) e retorna os resultados na ordem de entrada.
+
+        ``on_resultado(resultado, concluidos, total)`` é chamado no processo
+        principal à medida que os workers terminam. Informando ``total``, a
+        entrada é consumida sob demanda (ex.: membros de um ZIP) em vez de
+        ser materializada numa lista.
+        """
+        if total is None:
+            arquivos = list(arquivos)
+            total = len(arquivos)
+        resultados: List[Optional[ResultadoArquivo]] = [None] * total
+
+        for concluidos, resultado in enumerate(self.processar_iter(arquivos), 1):
+            if resultado.indice >= len(resultados):
+                resultados.extend([None] * (resultado.indice + 1 - len(resultados)))
+            resultados[resultado.indice] = resultado
+            if on_resultado:
+                on_resultado(resultado, concluidos, max(total, concluidos))
+
+        return [resultado for resultado in resultados if resultado is not None]
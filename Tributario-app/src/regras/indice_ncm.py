@@ -0,0 +1,123 @@
+"""
+Índice de alíquotas por NCM com busca pelo prefixo mais longo
+
+As regras podem ser definidas em qualquer nível da hierarquia da TIPI:
+capítulo (``02``), posição (``0206``), subposição (``0206.30``/``020630``),
+item/subitem (7 dígitos) ou código completo (``02063000``). Cada NCM é
+resolvido para a regra mais específica que é prefixo dele; sem nenhuma, o
+resultado é vazio (NaN no lote).
+
+Os prefixos ficam em um dicionário por nível (uma trie achatada: cada chave
+é o caminho de um nó), então a busca faz no máximo 8 consultas, do código
+completo ao capítulo. ``resolver_coluna`` resolve uma coluna inteira de itens
+de uma vez: cada NCM distinto é resolvido uma única vez e memorizado entre
+chamadas.
+
+Exemplo:
+    indice = IndiceNCM.de_json('ncm_rates.json')
+    aliquotas = indice.resolver_coluna(df_itens['ncm'])   # PIS, COFINS, IPI, ...
+"""
+import json
+import re
+from typing import Any, Dict, List, Mapping, Optional
+
+import numpy as np
+import pandas as pd
+
+
+TAMANHO_NCM = 8
+COLUNAS_ALIQUOTA = ['PIS', 'COFINS', 'IPI']
+MAX_MEMO = 100_000
+
+_NAO_DIGITO = re.compile(r'\D')
+
+
+def normalizar_prefixo(chave: Any) -> str:
+    """Chave de regra só com dígitos ('0206.30' -> '020630'), no máximo 8"""
+    return _NAO_DIGITO.sub('', str(chave))[:TAMANHO_NCM]
+
+
+def normalizar_ncm(valor: Any) -> str:
+    """NCM de item com 8 dígitos (zeros à esquerda perdidos na leitura são repostos)"""
+    if valor is None or valor != valor:  # None/NaN
+        return ''
+    digitos = _NAO_DIGITO.sub('', str(valor).split('.')[0] if isinstance(valor, float) else str(valor))
+    return digitos.zfill(TAMANHO_NCM)[:TAMANHO_NCM] if digitos else ''
+
+
+class IndiceNCM:
+    """Regras por prefixo de NCM, compiladas para busca do prefixo mais longo"""
+
+    def __init__(self, regras: Mapping[str, Mapping[str, Any]]):
+        prefixos: List[str] = []
+        linhas: List[Dict[str, Any]] = []
+        self._posicoes: Dict[str, int] = {}
+        for chave, regra in regras.items():
+            prefixo = normalizar_prefixo(chave)
+            # Chave repetida após normalizar ('0206.30' e '020630'): vale a primeira
+            if not prefixo or prefixo in self._posicoes:
+                continue
+            self._posicoes[prefixo] = len(linhas)
+            prefixos.append(prefixo)
+            linhas.append(dict(regra))
+
+        self._niveis = sorted({len(p) for p in prefixos}, reverse=True)
+        tabela = pd.DataFrame(linhas).reset_index(drop=True)
+        for coluna in COLUNAS_ALIQUOTA:
+            tabela[coluna] = pd.to_numeric(tabela[coluna], errors='coerce').fillna(0) \
+                if coluna in tabela.columns else 0.0
+        tabela['ncm_regra'] = prefixos
+        tabela['nivel'] = [len(p) for p in prefixos]
+        # Última linha vazia: destino das posições -1 (NCM sem regra) no ``take`` do lote
+        self.regras = pd.concat([tabela, pd.DataFrame([{}], columns=tabela.columns)], ignore_index=True)
+        self._memo: Dict[str, int] = {}
+
+    @classmethod
+    def de_json(cls, caminho: str) -> 'IndiceNCM':
+        """Regras no formato do ``ncm_rates.json`` ({prefixo: {PIS, COFINS, IPI, ...}})"""
+        with open(caminho, encoding='utf-8') as arquivo:
+            return cls(json.load(arquivo))
+
+    def __len__(self) -> int:
+        return len(self._posicoes)
+
+    def __contains__(self, prefixo: str) -> bool:
+        return normalizar_prefixo(prefixo) in self._posicoes
+
+    def posicao(self, ncm: Any) -> int:
+        """Linha da regra mais específica em ``regras`` (-1 se nenhuma)"""
+        codigo = ncm if isinstance(ncm, str) and len(ncm) == TAMANHO_NCM and ncm.isdigit() else normalizar_ncm(ncm)
+        posicao = self._memo.get(codigo)
+        if posicao is not None:
+            return posicao
+
+        posicao = -1
+        for nivel in self._niveis:
+            encontrada = self._posicoes.get(codigo[:nivel])
+            if encontrada is not None:
+                posicao = encontrada
+                break
+        if len(self._memo) >= MAX_MEMO:
+            self._memo.clear()
+        self._memo[codigo] = posicao
+        return posicao
+
+    def resolver(self, ncm: Any) -> Optional[Dict[str, Any]]:
+        """Regra mais específica do NCM (com ``ncm_regra`` e ``nivel``) ou None"""
+        posicao = self.posicao(ncm)
+        return None if posicao < 0 else self.regras.iloc[posicao].to_dict()
+
+    def resolver_coluna(self, ncms: pd.Series) -> pd.DataFrame:
+        """
+        Regras de uma coluna inteira de NCMs, alinhadas ao índice da coluna
+
+        Os códigos são fatorados: cada NCM distinto passa uma vez pela busca e a
+        expansão para todas as linhas é um ``take``. NCMs sem regra ficam NaN.
+        """
+        codigos, unicos = pd.factorize(ncms, use_na_sentinel=True)
+        posicoes_unicas = np.fromiter((self.posicao(ncm) for ncm in unicos), dtype=np.int64, count=len(unicos))
+        # Sentinela do factorize (-1, valor nulo) e NCM sem regra apontam para a linha vazia
+        posicoes = np.where(codigos >= 0, posicoes_unicas[codigos] if len(unicos) else -1, -1)
+        resultado = self.regras.take(np.where(posicoes >= 0, posicoes, len(self.regras) - 1))
+        resultado.index = ncms.index
+        return resultado
@@ -0,0 +1,301 @@
+"""
+Registro único de alíquotas com vigência (CST, NCM, data de emissão)
+
+Substitui as tabelas soltas que existiam no código (``obter_regra_por_cst``,
+``ALIQUOTAS`` da calculadora simples, ``DEFAULT_RATES`` do app.py e os
+padrões de ``ConfigTributacao``). Cada regra define alíquotas para alguns
+tributos, restrita (opcionalmente) a um CST, a um prefixo de NCM e a um
+período ``[inicio, fim)``.
+
+Resolução, por tributo: vale a regra mais específica que o define, na ordem
+prefixo de NCM mais longo > CST exato > qualquer CST; entre regras do mesmo
+nível, a última registrada. Assim uma regra base define tudo, regras por CST
+sobrescrevem o ICMS e regras por NCM sobrescrevem PIS/COFINS/IPI.
+
+Instantâneos: ``RegistroRegras.instantaneo()`` compila as regras uma vez por
+versão (hash do conteúdo) e por processo. O resultado é imutável e pode ser
+compartilhado entre threads e sessões. Em outro processo ele é reconstruído a
+partir das regras (``__reduce__``), também uma vez por versão. As datas
+viram segmentos de um índice de intervalos (``searchsorted`` sobre as
+fronteiras de vigência), e cada segmento tem um índice por (CST, prefixo de
+NCM).
+
+Exemplo:
+    instantaneo = registro_padrao().instantaneo()
+    instantaneo.resolver('000', '02063000', '2025-03-10')       # {'PIS': Decimal(...), ...}
+    instantaneo.resolver_lote(df['cst'], df['ncm'], df['data'])  # uma coluna por tributo
+"""
+import hashlib
+import json
+import threading
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from types import MappingProxyType
+from typing import Any, Dict, Iterable, List, Mapping, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from ..calculo.tabela_cst import normalizar_cst
+from .indice_ncm import normalizar_ncm, normalizar_prefixo
+
+
+TRIBUTOS_REGISTRO = ('PIS', 'COFINS', 'IPI', 'ICMS', 'ISS', 'CBS', 'IBS')
+MAX_MEMO = 100_000
+
+
+class RegraVigente(NamedTuple):
+    """Alíquotas (fração: 0.18 = 18%) de alguns tributos, com escopo e vigência"""
+    aliquotas: Tuple[Tuple[str, Decimal], ...]
+    cst: str = ''                 # '' = qualquer CST
+    ncm: str = ''                 # prefixo (capítulo a código completo); '' = qualquer NCM
+    inicio: Optional[date] = None  # inclusive; None = sem início
+    fim: Optional[date] = None     # exclusivo; None = sem fim
+    origem: str = ''
+
+
+def _para_aliquota(valor: Any) -> Decimal:
+    """Alíquota em Decimal; textos não numéricos (ex.: 'isento') valem zero"""
+    try:
+        resultado = Decimal(str(valor).strip().replace(',', '.'))
+    except (InvalidOperation, ValueError):
+        return Decimal('0')
+    return resultado if resultado.is_finite() else Decimal('0')
+
+
+def _para_data(valor: Any) -> Optional[date]:
+    if valor is None or valor != valor or valor == '':  # None, NaN/NaT ou vazio
+        return None
+    if isinstance(valor, date):
+        return valor
+    return date.fromisoformat(str(valor)[:10])
+
+
+def regra(aliquotas: Mapping[str, Any], cst: Any = '', ncm: Any = '', inicio: Any = None,
+          fim: Any = None, origem: str = '') -> RegraVigente:
+    """Monta uma RegraVigente normalizada (CST com 3 dígitos, NCM só dígitos, datas ISO)"""
+    desconhecidos = set(tributo.upper() for tributo in aliquotas) - set(TRIBUTOS_REGISTRO)
+    if desconhecidos:
+        raise ValueError(f"Tributos desconhecidos: {sorted(desconhecidos)} (use {', '.join(TRIBUTOS_REGISTRO)})")
+    inicio, fim = _para_data(inicio), _para_data(fim)
+    if inicio and fim and fim <= inicio:
+        raise ValueError(f"Vigência vazia: {inicio} a {fim}")
+    return RegraVigente(
+        aliquotas=tuple(sorted((tributo.upper(), _para_aliquota(valor)) for tributo, valor in aliquotas.items())),
+        cst=normalizar_cst(cst) if cst not in (None, '', '*') else '',
+        ncm=normalizar_prefixo(ncm) if ncm not in (None, '*') else '',
+        inicio=inicio,
+        fim=fim,
+        origem=origem,
+    )
+
+
+# Alíquotas que estavam espalhadas pelo código, agora em um só lugar (sem data: valem sempre).
+# A regra base (qualquer CST) traz o ICMS do CST 000: CSTs sem regra própria seguem a tributação integral.
+REGRAS_PADRAO: Tuple[RegraVigente, ...] = (
+    regra({'PIS': '0.0065', 'COFINS': '0.03', 'IPI': '0', 'ICMS': '0.18', 'ISS': '0.05', 'CBS': '0.009',
+           'IBS': '0.26'}, origem='padrão'),
+    regra({'ICMS': '0.12'}, cst='010', origem='padrão'),
+    regra({'ICMS': '0.07'}, cst='020', origem='padrão'),
+    regra({'PIS': '0', 'COFINS': '0', 'ICMS': '0'}, cst='060', origem='padrão'),
+)
+
+
+class RegistroRegras:
+    """Conjunto ordenado de regras com vigência; imutável (``com`` devolve um novo registro)"""
+
+    def __init__(self, regras: Iterable[RegraVigente] = REGRAS_PADRAO):
+        self.regras: Tuple[RegraVigente, ...] = tuple(regras)
+        conteudo = repr([(r.aliquotas, r.cst, r.ncm, r.inicio, r.fim) for r in self.regras])
+        self.versao = hashlib.sha256(conteudo.encode('utf-8')).hexdigest()[:16]
+
+    def com(self, *regras: RegraVigente) -> 'RegistroRegras':
+        """Novo registro com ``regras`` acrescentadas (prevalecem sobre as do mesmo nível)"""
+        return RegistroRegras(self.regras + regras)
+
+    @staticmethod
+    def regras_de_dicts(dados: Iterable[Mapping[str, Any]], origem: str = '') -> List[RegraVigente]:
+        """Regras no formato ``{"cst", "ncm", "inicio", "fim", "PIS": 0.0165, ...}``"""
+        regras = []
+        for item in dados:
+            escopo = {chave: item.get(chave) for chave in ('cst', 'ncm', 'inicio', 'fim')}
+            aliquotas = {chave: valor for chave, valor in item.items() if chave.upper() in TRIBUTOS_REGISTRO}
+            regras.append(regra(aliquotas, origem=item.get('origem', origem), **escopo))
+        return regras
+
+    @staticmethod
+    def regras_por_chave(dados: Mapping[str, Mapping[str, Any]], campo: str, origem: str = '') -> List[RegraVigente]:
+        """
+        Regras de um mapa chave -> alíquotas (``aliquotas.json`` por CST,
+        ``ncm_rates.json`` por NCM); campos que não são tributos são ignorados
+        """
+        return [regra({t: v for t, v in valores.items() if t.upper() in TRIBUTOS_REGISTRO},
+                      origem=origem, **{campo: chave})
+                for chave, valores in dados.items()]
+
+    @classmethod
+    def de_json(cls, caminho: str, base: Iterable[RegraVigente] = REGRAS_PADRAO) -> 'RegistroRegras':
+        """Registro padrão acrescido das regras de um JSON (lista de regras com vigência)"""
+        with open(caminho, encoding='utf-8') as arquivo:
+            return cls(tuple(base) + tuple(cls.regras_de_dicts(json.load(arquivo), origem=caminho)))
+
+    def instantaneo(self) -> 'InstantaneoRegras':
+        """Instantâneo compilado desta versão (compartilhado no processo)"""
+        return _instantaneo(self.versao, self.regras)
+
+    def __len__(self) -> int:
+        return len(self.regras)
+
+
+_INSTANTANEOS: Dict[str, 'InstantaneoRegras'] = {}
+_LOCK = threading.Lock()
+
+
+def _instantaneo(versao: str, regras: Tuple[RegraVigente, ...]) -> 'InstantaneoRegras':
+    instantaneo = _INSTANTANEOS.get(versao)
+    if instantaneo is None:
+        with _LOCK:
+            instantaneo = _INSTANTANEOS.get(versao)
+            if instantaneo is None:
+                instantaneo = _INSTANTANEOS[versao] = InstantaneoRegras(versao, regras)
+    return instantaneo
+
+
+Chave = Tuple[str, str]  # (CST ou '', prefixo de NCM ou '')
+
+
+class InstantaneoRegras:
+    """Regras compiladas de uma versão do registro: índice de intervalos + índice por (CST, NCM)"""
+
+    def __init__(self, versao: str, regras: Sequence[RegraVigente]):
+        self.versao = versao
+        self.regras = tuple(regras)
+
+        # Fronteiras de vigência: o segmento s cobre [limites[s-1], limites[s])
+        fronteiras = sorted({d for r in self.regras for d in (r.inicio, r.fim) if d is not None})
+        self.limites = np.array(fronteiras, dtype='datetime64[D]')
+        self.limites.flags.writeable = False
+
+        segmentos = []
+        for s in range(len(fronteiras) + 1):
+            inicio = fronteiras[s - 1] if s > 0 else None
+            fim = fronteiras[s] if s < len(fronteiras) else None
+            indice: Dict[Chave, Dict[str, Decimal]] = {}
+            for r in self.regras:
+                # Toda fronteira de regra é fronteira de segmento: a regra cobre o segmento inteiro ou nada dele
+                if (r.inicio is None or (inicio is not None and r.inicio <= inicio)) and \
+                        (r.fim is None or (fim is not None and fim <= r.fim)):
+                    indice.setdefault((r.cst, r.ncm), {}).update(r.aliquotas)
+            niveis = tuple(sorted({len(ncm) for _, ncm in indice}, reverse=True))
+            segmentos.append((MappingProxyType({chave: MappingProxyType(aliquotas) for chave, aliquotas in indice.items()}),
+                              niveis))
+        self.segmentos = tuple(segmentos)
+        self._memo: Dict[Tuple[int, str, str], Tuple[Optional[Decimal], ...]] = {}
+
+    def __reduce__(self):
+        # Em outro processo o instantâneo é recompilado (uma vez) a partir das regras
+        return _instantaneo, (self.versao, self.regras)
+
+    def segmento(self, data: Any = None) -> int:
+        """Segmento de vigência de uma data (None = hoje)"""
+        dia = np.datetime64(_para_data(data) or date.today(), 'D')
+        return int(np.searchsorted(self.limites, dia, side='right'))
+
+    def _resolver_chave(self, segmento: int, cst: str, ncm: str) -> Tuple[Optional[Decimal], ...]:
+        chave = (segmento, cst, ncm)
+        resolvido = self._memo.get(chave)
+        if resolvido is not None:
+            return resolvido
+
+        indice, niveis = self.segmentos[segmento]
+        valores: Dict[str, Decimal] = {}
+        for nivel in niveis:
+            prefixo = ncm[:nivel]
+            if nivel and len(prefixo) < nivel:
+                continue
+            for escopo in ((cst, prefixo), ('', prefixo)) if cst else (('', prefixo),):
+                aliquotas = indice.get(escopo)
+                if aliquotas:
+                    for tributo, valor in aliquotas.items():
+                        valores.setdefault(tributo, valor)
+            if len(valores) == len(TRIBUTOS_REGISTRO):
+                break
+
+        resolvido = tuple(valores.get(tributo) for tributo in TRIBUTOS_REGISTRO)
+        if len(self._memo) >= MAX_MEMO:
+            self._memo.clear()
+        self._memo[chave] = resolvido
+        return resolvido
+
+    def resolver(self, cst: Any = '', ncm: Any = '', data: Any = None) -> Dict[str, Decimal]:
+        """Alíquotas vigentes para um item (só os tributos definidos por alguma regra)"""
+        cst = normalizar_cst(cst) if cst not in (None, '') else ''
+        resolvido = self._resolver_chave(self.segmento(data), cst, normalizar_ncm(ncm))
+        return {tributo: valor for tributo, valor in zip(TRIBUTOS_REGISTRO, resolvido) if valor is not None}
+
+    def segmentos_lote(self, datas: Optional[Sequence], tamanho: int, data_padrao: Any = None) -> np.ndarray:
+        """Segmento de vigência de cada data (texto ISO, date ou datetime64); vazias usam ``data_padrao``"""
+        padrao = np.datetime64(_para_data(data_padrao) or date.today(), 'D')
+        if datas is None:
+            return np.full(tamanho, np.searchsorted(self.limites, padrao, side='right'), dtype=np.int64)
+        serie = pd.Series(datas) if not isinstance(datas, pd.Series) else datas
+        if not pd.api.types.is_datetime64_any_dtype(serie):
+            # Só a parte da data (AAAA-MM-DD) de valores como '2025-03-10T14:22:00-03:00'
+            serie = pd.to_datetime(serie.astype(str).str[:10], format='%Y-%m-%d', errors='coerce')
+        elif getattr(serie.dt, 'tz', None) is not None:
+            serie = serie.dt.tz_localize(None)
+        dias = serie.to_numpy(dtype='datetime64[D]')
+        dias = np.where(np.isnat(dias), padrao, dias)
+        return np.searchsorted(self.limites, dias, side='right').astype(np.int64)
+
+    def resolver_lote(self, csts: Optional[Sequence] = None, ncms: Optional[Sequence] = None,
+                      datas: Optional[Sequence] = None, data_padrao: Any = None) -> pd.DataFrame:
+        """
+        Alíquotas por item de um lote inteiro (uma coluna float por tributo; NaN = não definido)
+
+        As chaves (segmento de vigência, CST, NCM) são fatoradas e combinadas em
+        um inteiro; cada combinação distinta é resolvida uma vez e expandida
+        para todas as linhas com um ``take``.
+        """
+        referencia = next((c for c in (csts, ncms, datas) if c is not None), None)
+        if referencia is None:
+            raise ValueError("Informe ao menos uma coluna (CST, NCM ou data)")
+        tamanho = len(referencia)
+        indice = referencia.index if isinstance(referencia, pd.Series) else pd.RangeIndex(tamanho)
+
+        def fatorar(valores, normalizar):
+            if valores is None:
+                return np.zeros(tamanho, dtype=np.int64), np.array([''], dtype=object)
+            codigos, unicos = pd.factorize(pd.Series(valores).fillna('').astype(str), use_na_sentinel=True)
+            return codigos.astype(np.int64), np.array([normalizar(u) for u in unicos], dtype=object)
+
+        cst_codigos, cst_unicos = fatorar(csts, lambda c: normalizar_cst(c) if c else '')
+        ncm_codigos, ncm_unicos = fatorar(ncms, normalizar_ncm)
+        segmentos = self.segmentos_lote(datas, tamanho, data_padrao)
+
+        n_cst, n_ncm = max(len(cst_unicos), 1), max(len(ncm_unicos), 1)
+        chaves = (segmentos * n_cst + cst_codigos) * n_ncm + ncm_codigos
+        unicas, inverso = np.unique(chaves, return_inverse=True)
+
+        matriz = np.empty((len(unicas), len(TRIBUTOS_REGISTRO)), dtype=np.float64)
+        for linha, chave in enumerate(unicas.tolist()):
+            segmento, resto = divmod(chave, n_cst * n_ncm)
+            cst, ncm = divmod(resto, n_ncm)
+            resolvido = self._resolver_chave(segmento, cst_unicos[cst] if len(cst_unicos) else '',
+                                             ncm_unicos[ncm] if len(ncm_unicos) else '')
+            matriz[linha] = [np.nan if valor is None else float(valor) for valor in resolvido]
+
+        return pd.DataFrame(matriz[inverso.reshape(-1)], columns=list(TRIBUTOS_REGISTRO), index=indice)
+
+
+_REGISTRO_PADRAO = RegistroRegras()
+
+
+def registro_padrao() -> RegistroRegras:
+    """Registro com as alíquotas padrão da aplicação"""
+    return _REGISTRO_PADRAO
+
+
+def aliquota_padrao(tributo: str, cst: Any = '', data: Any = None) -> Decimal:
+    """Alíquota vigente do registro padrão (zero se nenhuma regra define o tributo)"""
+    return _REGISTRO_PADRAO.instantaneo().resolver(cst, data=data).get(tributo.upper(), Decimal('0'))
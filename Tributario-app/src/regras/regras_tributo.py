@@ -1,14 +1,12 @@
-def obter_regra_por_cst(cst: str) -> dict:
+from .registro import registro_padrao
+
+
+def obter_regra_por_cst(cst: str, data=None) -> dict:
     """
     Retorna as regras tributárias aplicáveis com base no CST informado.
-    Pode ser expandido com tabelas externas (como a CST que você tem).
+    As alíquotas vêm do registro de regras com vigência (``registro.py``);
+    ``data`` escolhe a vigência (padrão: hoje).
     """
-    regras = {
-        '000': {'PIS': 0.0065, 'COFINS': 0.03, 'ICMS': 0.18},
-        '010': {'PIS': 0.0065, 'COFINS': 0.03, 'ICMS': 0.12},
-        '020': {'PIS': 0.0065, 'COFINS': 0.03, 'ICMS': 0.07},
-        '060': {'PIS': 0.0, 'COFINS': 0.0, 'ICMS': 0.0},  # Alíquota zero
-        # ... incluir mais CSTs conforme necessário
-    }
-
-    return regras.get(cst, {'PIS': 0.0065, 'COFINS': 0.03, 'ICMS': 0.18})  # padrão
\ No newline at end of file
+    # CST sem regra própria segue a regra base do registro (ICMS do CST 000)
+    regra = registro_padrao().instantaneo().resolver(cst, data=data)
+    return {tributo: float(regra[tributo]) for tributo in ('PIS', 'COFINS', 'ICMS')}
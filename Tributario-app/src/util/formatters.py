@@ -5,6 +5,9 @@ from decimal import Decimal
 from typing import Union, Optional
 import re
 
+from ..parser.triagem import INVALIDO, triar
+from .numeros import para_decimal_seguro
+
 
 def format_currency(value: Union[Decimal, float, str], symbol: str = 'R$') -> str:
     """
@@ -121,8 +124,10 @@ def validate_xml_nfe(xml_content: str) -> tuple[bool, Optional[str]]:
     """
     Valida se o conteúdo XML é uma NF-e válida
     
+    Usa a triagem do parser: só o prefixo do documento é examinado.
+    
     Args:
-        xml_content: Conteúdo do XML
+        xml_content: Conteúdo do XML (texto ou bytes)
     
     Returns:
         Tupla (é_válido, mensagem_erro)
@@ -130,22 +135,11 @@ def validate_xml_nfe(xml_content: str) -> tuple[bool, Optional[str]]:
     if not xml_content or not xml_content.strip():
         return False, "Arquivo XML vazio"
     
-    # Verifica se é XML válido
-    if not xml_content.strip().startswith('<?xml') and not xml_content.strip().startswith('<'):
+    triagem = triar(xml_content)
+    if triagem.tipo == INVALIDO:
         return False, "Arquivo não parece ser um XML válido"
-    
-    # Verifica se contém elementos de NF-e
-    nfe_patterns = [
-        r'<infNFe',
-        r'<NFe',
-        r'<nfeProc',
-        r'portalfiscal\.inf\.br/nfe'
-    ]
-    
-    has_nfe_pattern = any(re.search(pattern, xml_content, re.IGNORECASE) for pattern in nfe_patterns)
-    
-    if not has_nfe_pattern:
-        return False, "Arquivo não parece ser uma NF-e válida"
+    if not triagem.aceito:
+        return False, f"Arquivo não parece ser uma NF-e válida ({triagem.descricao})"
     
     return True, None
 
@@ -154,6 +148,9 @@ def safe_decimal_conversion(value: any, default: Decimal = Decimal('0')) -> Deci
     """
     Converte valor para Decimal de forma segura
     
+    Texto no formato da NF-e é convertido direto; formatos brasileiros
+    (1.234,56) e americanos (1,234.56) passam pela limpeza heurística.
+    
     Args:
         value: Valor a ser convertido
         default: Valor padrão se conversão falhar
@@ -161,42 +158,7 @@ def safe_decimal_conversion(value: any, default: Decimal = Decimal('0')) -> Deci
     Returns:
         Valor convertido para Decimal
     """
-    if value is None:
-        return default
-    
-    try:
-        if isinstance(value, Decimal):
-            return value
-        
-        if isinstance(value, str):
-            # Remove caracteres não numéricos exceto ponto, vírgula e sinal
-            cleaned = re.sub(r'[^\d.,-]', '', value.strip())
-            
-            if not cleaned:
-                return default
-            
-            # Trata diferentes formatos decimais
-            if ',' in cleaned and '.' in cleaned:
-                # Formato brasileiro: 1.234,56
-                if cleaned.rindex(',') > cleaned.rindex('.'):
-                    cleaned = cleaned.replace('.', '').replace(',', '.')
-                # Formato americano: 1,234.56
-                else:
-                    cleaned = cleaned.replace(',', '')
-            elif ',' in cleaned:
-                # Só vírgula - pode ser decimal brasileiro
-                if cleaned.count(',') == 1 and len(cleaned.split(',')[1]) <= 2:
-                    cleaned = cleaned.replace(',', '.')
-                # Múltiplas vírgulas - separador de milhares
-                else:
-                    cleaned = cleaned.replace(',', '')
-            
-            return Decimal(cleaned)
-        
-        return Decimal(str(value))
-        
-    except (ValueError, TypeError, Exception):
-        return default
+    return para_decimal_seguro(value, default)
 
 
 def get_economy_message(economia_total: Decimal, economia_percentual: Decimal) -> str:
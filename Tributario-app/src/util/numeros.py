@@ -0,0 +1,110 @@
+"""
+Decodificação de campos numéricos da NF-e
+
+Os campos numéricos do leiaute são texto simples ``-?\\d+(\\.\\d+)?``
+(ponto decimal, sem milhares). O caminho rápido reconhece esse formato com
+um único ``fullmatch`` e monta o valor de uma vez; a limpeza heurística de
+formatos brasileiros (``1.234,56``, ``R$ 10,5``) fica só como fallback para
+campos fora do padrão e entradas digitadas.
+
+Também decodifica direto para inteiros escalados (centavos, quantidades com
+4 casas) sem passar por Decimal, com arredondamento ROUND_HALF_UP.
+"""
+import re
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from typing import Any, Optional
+
+
+ZERO = Decimal('0')
+_UM = Decimal('1')
+
+# Formato do leiaute da NF-e (TDec_1302, TDec_1104v...): match ou None
+formato_nfe = re.compile(r'-?\d+(?:\.\d+)?').fullmatch
+_NAO_NUMERICO = re.compile(r'[^\d.,\-]').sub
+
+
+def decimal_br(texto: str, padrao: Optional[Decimal] = ZERO) -> Optional[Decimal]:
+    """
+    Converte texto numérico em formato livre (brasileiro ou americano)
+
+    O último separador presente é o decimal quando há ponto e vírgula
+    (``1.234,56`` e ``1,234.56``); vírgula única é decimal (``10,5``);
+    separadores repetidos são de milhares (``1.234.567``).
+    """
+    limpo = _NAO_NUMERICO('', texto)
+    if not limpo:
+        return padrao
+    virgulas = limpo.count(',')
+    pontos = limpo.count('.')
+    if virgulas and pontos:
+        if limpo.rindex(',') > limpo.rindex('.'):
+            limpo = limpo.replace('.', '').replace(',', '.')
+        else:
+            limpo = limpo.replace(',', '')
+    elif virgulas:
+        limpo = limpo.replace(',', '.') if virgulas == 1 else limpo.replace(',', '')
+    elif pontos > 1:
+        limpo = limpo.replace('.', '')
+    try:
+        valor = Decimal(limpo)
+    except InvalidOperation:
+        return padrao
+    return valor if valor.is_finite() else padrao
+
+
+def decimal_nfe(texto: Optional[str], padrao: Optional[Decimal] = ZERO) -> Optional[Decimal]:
+    """Campo numérico da NF-e em Decimal: caminho estrito primeiro, heurística só se preciso"""
+    if not texto:
+        return padrao
+    if formato_nfe(texto):
+        return Decimal(texto)
+    return decimal_br(texto, padrao)
+
+
+def para_decimal_seguro(valor: Any, padrao: Optional[Decimal] = ZERO) -> Optional[Decimal]:
+    """Qualquer valor (texto, número, Decimal) em Decimal finito, ou ``padrao``"""
+    if valor is None:
+        return padrao
+    if isinstance(valor, Decimal):
+        return valor if valor.is_finite() else padrao
+    if isinstance(valor, str):
+        return decimal_nfe(valor.strip(), padrao)
+    try:
+        resultado = Decimal(str(valor))
+    except (InvalidOperation, ValueError, TypeError):
+        return padrao
+    return resultado if resultado.is_finite() else padrao
+
+
+def escalado_nfe(texto: Optional[str], casas: int, padrao: int = 0) -> int:
+    """
+    Campo numérico da NF-e como inteiro escalado (``casas=2`` -> centavos)
+
+    No formato do leiaute a conversão usa só ``int`` sobre os dígitos, sem
+    Decimal; casas excedentes são arredondadas ROUND_HALF_UP (afastando do
+    zero, como no Decimal).
+    """
+    if not texto:
+        return padrao
+    if formato_nfe(texto):
+        ponto = texto.find('.')
+        if ponto < 0:
+            return int(texto) * 10 ** casas
+        excesso = len(texto) - ponto - 1 - casas
+        digitos = int(texto[:ponto] + texto[ponto + 1:])
+        if excesso <= 0:
+            return digitos * 10 ** -excesso
+        escala = 10 ** excesso
+        quociente, resto = divmod(abs(digitos), escala)
+        if resto * 2 >= escala:
+            quociente += 1
+        return -quociente if digitos < 0 else quociente
+    valor = decimal_br(texto, None)
+    if valor is None:
+        return padrao
+    return int(valor.scaleb(casas).quantize(_UM, rounding=ROUND_HALF_UP))
+
+
+def centavos_nfe(texto: Optional[str], padrao: int = 0) -> int:
+    """Valor monetário da NF-e direto em centavos inteiros"""
+    return escalado_nfe(texto, 2, padrao)
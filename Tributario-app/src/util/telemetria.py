@@ -0,0 +1,255 @@
+"""
+Instrumentação: eventos de log estruturados e spans por etapa
+
+Sem nenhum destino configurado, ``evento`` e ``span`` retornam na primeira
+linha (o span devolvido é um objeto nulo compartilhado): nada é formatado nem
+medido. Os campos são passados como argumentos nomeados e só viram texto no
+destino, então chamadas em laços quentes não pagam f-strings.
+
+Etapas instrumentadas: ``triagem``, ``parse``, ``extracao``, ``calculo``,
+``render`` e ``exportacao``. Cada span emite a duração em ms, a contagem de
+itens (quando informada) e os campos de contexto (ex.: ``arquivo``).
+
+Destinos e campos de contexto valem só para o contexto de execução atual
+(``contextvars``): cada thread, como a de uma sessão do Streamlit, e cada
+worker do pool tem os seus. Os eventos de uma sessão nunca chegam ao coletor de
+outra, e um destino deixa de existir junto com a thread que o registrou.
+
+Destinos (``configurar``/``adicionar``):
+    ArquivoJSONL('data/outputs/trace.jsonl')  # uma linha JSON por evento
+    ColetorMemoria()                          # mantém os eventos para a interface
+    SaidaTexto()                              # linhas legíveis no stderr (modo debug)
+
+Exemplo:
+    with telemetria.contexto(arquivo=nome), telemetria.span('calculo') as s:
+        comparativo = calculadora.realizar_comparacao(nota)
+        s.itens = len(nota.itens)
+"""
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, IO, List, Mapping, Optional, Tuple
+
+
+ETAPAS = ('triagem', 'parse', 'extracao', 'calculo', 'render', 'exportacao')
+
+Evento = Dict[str, Any]
+
+# Destinos ativos no contexto atual (vazio = instrumentação desligada); tuplas, nunca alteradas no lugar
+_DESTINOS: ContextVar[Tuple[Any, ...]] = ContextVar('telemetria_destinos', default=())
+# Campos acrescentados a todos os eventos do contexto (ex.: arquivo em processamento)
+_CONTEXTO: ContextVar[Mapping[str, Any]] = ContextVar('telemetria_contexto', default={})
+
+
+class ArquivoJSONL:
+    """Grava cada evento como uma linha JSON (modo append, seguro para vários processos)"""
+
+    def __init__(self, caminho: str):
+        diretorio = os.path.dirname(caminho)
+        if diretorio:
+            os.makedirs(diretorio, exist_ok=True)
+        self.caminho = caminho
+        self._arquivo = open(caminho, 'a', encoding='utf-8', buffering=1)
+        self._lock = threading.Lock()
+
+    def emitir(self, evento: Evento):
+        linha = json.dumps(evento, ensure_ascii=False, default=str) + '\n'
+        with self._lock:
+            self._arquivo.write(linha)
+
+    def fechar(self):
+        self._arquivo.close()
+
+
+class ColetorMemoria:
+    """Guarda os eventos mais recentes em memória (ex.: painel de desempenho da interface)"""
+
+    def __init__(self, max_eventos: int = 100_000):
+        self.eventos: deque = deque(maxlen=max_eventos)
+
+    def emitir(self, evento: Evento):
+        self.eventos.append(evento)
+
+    def drenar(self) -> List[Evento]:
+        """Retorna e descarta os eventos coletados"""
+        eventos = list(self.eventos)
+        self.eventos.clear()
+        return eventos
+
+    def spans(self, etapa: Optional[str] = None) -> List[Evento]:
+        return [e for e in self.eventos if e.get('tipo') == 'span' and (etapa is None or e['etapa'] == etapa)]
+
+    def resumo(self) -> List[Dict[str, Any]]:
+        """Totais por etapa: chamadas, tempo total/máximo (ms), itens e o arquivo mais lento"""
+        etapas: Dict[str, Dict[str, Any]] = {}
+        for span in self.spans():
+            linha = etapas.setdefault(span['etapa'], {
+                'etapa': span['etapa'], 'chamadas': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                'itens': 0, 'mais_lento': None,
+            })
+            linha['chamadas'] += 1
+            linha['total_ms'] += span['duracao_ms']
+            linha['itens'] += span.get('itens') or 0
+            if span['duracao_ms'] >= linha['max_ms']:
+                linha['max_ms'] = span['duracao_ms']
+                linha['mais_lento'] = span.get('arquivo')
+        ordem = {etapa: i for i, etapa in enumerate(ETAPAS)}
+        return sorted(etapas.values(), key=lambda linha: ordem.get(linha['etapa'], len(ordem)))
+
+    def fechar(self):
+        pass
+
+
+class SaidaTexto:
+    """Linhas legíveis (``[DEBUG] ...``) em um stream de texto, padrão stderr"""
+
+    def __init__(self, stream: Optional[IO[str]] = None):
+        self.stream = stream
+
+    def emitir(self, evento: Evento):
+        campos = ' '.join(f"{chave}={valor}" for chave, valor in evento.items()
+                          if chave not in ('tipo', 'nome', 'nivel', 'ts', 'pid'))
+        rotulo = evento.get('nome') or evento.get('etapa')
+        print(f"[{evento.get('nivel', 'info').upper()}] {rotulo} {campos}".rstrip(),
+              file=self.stream or sys.stderr)
+
+    def fechar(self):
+        pass
+
+
+def ativo() -> bool:
+    """True se há algum destino configurado (use para pular preparação de campos caros)"""
+    return bool(_DESTINOS.get())
+
+
+def configurar(*destinos) -> List[Any]:
+    """Substitui os destinos do contexto atual; sem argumentos, desliga a instrumentação. Retorna os anteriores."""
+    anteriores = list(_DESTINOS.get())
+    _DESTINOS.set(tuple(destinos))
+    return anteriores
+
+
+def adicionar(destino):
+    """Registra o destino no contexto atual (ex.: na thread da sessão do Streamlit)"""
+    destinos = _DESTINOS.get()
+    if destino not in destinos:
+        _DESTINOS.set(destinos + (destino,))
+    return destino
+
+
+def remover(destino):
+    destinos = _DESTINOS.get()
+    if destino in destinos:
+        _DESTINOS.set(tuple(d for d in destinos if d is not destino))
+
+
+def emitir(evento: Evento):
+    """Entrega um evento já montado (ex.: vindo de um worker) aos destinos do contexto atual"""
+    campos = _CONTEXTO.get()
+    if campos:
+        evento = {**campos, **evento}
+    for destino in _DESTINOS.get():
+        destino.emitir(evento)
+
+
+def evento(nome: str, nivel: str = 'debug', campos: Optional[Callable[[], Dict[str, Any]]] = None, **extras):
+    """
+    Evento de log estruturado
+
+    ``campos`` é uma função chamada só com a instrumentação ligada, para
+    dados caros de montar (ex.: ``lambda: {'atributos': dict(raiz.attrib)}``).
+    """
+    if not _DESTINOS.get():
+        return
+    registro = {'tipo': 'log', 'nome': nome, 'nivel': nivel, 'ts': time.time(), 'pid': os.getpid()}
+    if campos is not None:
+        registro.update(campos())
+    registro.update(extras)
+    emitir(registro)
+
+
+class Span:
+    """Mede uma etapa; ``itens`` e ``definir`` acrescentam dados ao evento final"""
+    __slots__ = ('etapa', 'campos', 'itens', '_inicio')
+
+    def __init__(self, etapa: str, campos: Dict[str, Any]):
+        self.etapa = etapa
+        self.campos = campos
+        self.itens: Optional[int] = None
+        self._inicio = 0.0
+
+    def definir(self, **campos):
+        self.campos.update(campos)
+
+    def __enter__(self) -> 'Span':
+        self._inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo_exc, exc, tb):
+        registro = {
+            'tipo': 'span', 'etapa': self.etapa, 'ts': time.time(), 'pid': os.getpid(),
+            'duracao_ms': round((time.perf_counter() - self._inicio) * 1000, 3),
+        }
+        if self.itens is not None:
+            registro['itens'] = self.itens
+        if exc is not None:
+            registro['erro'] = f"{tipo_exc.__name__}: {exc}"
+        registro.update(self.campos)
+        emitir(registro)
+        return False
+
+
+class _SpanNulo:
+    """Span da instrumentação desligada: não mede nem emite nada"""
+    __slots__ = ()
+
+    itens = None
+
+    def __setattr__(self, nome, valor):
+        pass
+
+    def definir(self, **campos):
+        pass
+
+    def __enter__(self) -> '_SpanNulo':
+        return self
+
+    def __exit__(self, tipo_exc, exc, tb):
+        return False
+
+
+_SPAN_NULO = _SpanNulo()
+
+
+class _Contexto:
+    __slots__ = ('campos', '_token')
+
+    def __init__(self, campos: Dict[str, Any]):
+        self.campos = campos
+        self._token = None
+
+    def __enter__(self) -> '_Contexto':
+        self._token = _CONTEXTO.set({**_CONTEXTO.get(), **self.campos})
+        return self
+
+    def __exit__(self, tipo_exc, exc, tb):
+        _CONTEXTO.reset(self._token)
+        return False
+
+
+def contexto(**campos):
+    """Context manager que acrescenta ``campos`` aos eventos emitidos dentro dele (só no contexto atual)"""
+    if not _DESTINOS.get():
+        return _SPAN_NULO
+    return _Contexto(campos)
+
+
+def span(etapa: str, **campos):
+    """Context manager que mede a etapa (objeto nulo compartilhado se a instrumentação está desligada)"""
+    if not _DESTINOS.get():
+        return _SPAN_NULO
+    return Span(etapa, campos)
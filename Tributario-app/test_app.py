@@ -83,6 +83,109 @@ def test_parser_creation():
         print(f"❌ Erro na criação do parser: {e}")
         return False
 
+def test_app_new_recalculo_consistente():
+    """Resultado do upload e recálculo pela sidebar saem do mesmo motor: mesmos totais"""
+    import tempfile
+    from decimal import Decimal
+    from streamlit.logger import set_log_level
+    set_log_level('error')
+    import app_new
+    from app_new import TributaryApp
+    from test_nf_parser import build_xml
+    from test_pipeline import criar_calculadora
+
+    class Upload:
+        def __init__(self, nome, dados):
+            self.name, self.dados = nome, dados
+
+        def getvalue(self):
+            return self.dados
+
+        def getbuffer(self):
+            return memoryview(self.dados)
+
+    app = TributaryApp()
+    app.calculator = criar_calculadora()
+    uploads = [Upload(f"nf_{i}.xml", build_xml(i % 2 == 0).encode('utf-8')) for i in range(3)]
+    cache_padrao = app_new.CACHE_DIR_PADRAO
+    with tempfile.TemporaryDirectory() as cache_dir:
+        app_new.CACHE_DIR_PADRAO = cache_dir
+        try:
+            assert app.process_xml_files(uploads)
+            # Upload repetido: notas vêm do cache de parse, com o mesmo resultado
+            assert os.listdir(cache_dir)
+            primeiro = [c.tributacao_nova for c in app.comparativos]
+            assert app.process_xml_files(uploads)
+            assert [c.tributacao_nova for c in app.comparativos] == primeiro
+        finally:
+            app_new.CACHE_DIR_PADRAO = cache_padrao
+    inicial = [(c.tributacao_atual, c.tributacao_nova) for c in app.comparativos]
+
+    # Outra alíquota e volta ao valor padrão do slider: recalcula pelos agregados
+    config = app.calculator.config_rti
+    config.cbs_aliquota = Decimal('0.5')
+    app.render_sidebar_config()
+    assert config.cbs_aliquota == Decimal('0.009')
+    assert [(c.tributacao_atual, c.tributacao_nova) for c in app.comparativos] == inicial
+
+    # Detalhes montados sob demanda somam o total de cada nota
+    for comparativo in app.comparativos_detalhados():
+        soma = sum(d['total_rti'] for d in comparativo.detalhes_por_item)
+        assert abs(soma - comparativo.tributacao_nova['TOTAL']) <= Decimal('0.01') * len(comparativo.detalhes_por_item)
+    print("✅ Recálculo do app_new igual ao processamento inicial")
+
+
+def test_relatorio_app():
+    """Relatório do app.py: itens do XML + CST + NCM calculados em colunas"""
+    import io
+    import pandas as pd
+    from app import calcular_relatorio
+    from src.parser.xml_parser import extrair_itens_xml
+    from src.regras.indice_ncm import IndiceNCM
+    from test_nf_parser import build_xml
+
+    df_itens = extrair_itens_xml(io.BytesIO(build_xml().encode('utf-8')))
+    cst_df = pd.DataFrame({'CST': ['000', '102'], '% Red. CBS': [0.0, 0.6], '% Red. IBS': [0.0, 0.6],
+                           'ICMS': [0.18, 'isento']})
+    rates_ncm = IndiceNCM({'02063000': {'PIS': 0.0165, 'COFINS': 0.076, 'IPI': 0.0, 'CST': '01'}})
+
+    df = calcular_relatorio(df_itens, cst_df, rates_ncm, cbs_rate=0.009, ibs_rate=0.001)
+    assert list(df['item']) == [1, 2]
+    # Item 1: valores do XML; item 2: COFINS estimado pelo NCM, ICMS não numérico vira zero
+    assert round(df['Despesa Antes Reforma'].iloc[0], 2) == 1.65 + 7.60 + 5.00 + 18.00
+    assert round(df['valor_cofins'].iloc[1], 2) == 0.76 and df['valor_icms'].iloc[1] == 0
+    assert round(df['CBS (%)'].iloc[1], 4) == round(10 * 0.009 * 0.4, 4)
+    print("✅ Relatório do app.py")
+
+
+def test_indice_ncm():
+    """NCM resolvido pela regra mais específica (código > subposição > posição > capítulo)"""
+    import pandas as pd
+    from src.regras.indice_ncm import IndiceNCM
+
+    indice = IndiceNCM({
+        '02': {'PIS': 0.01, 'COFINS': 0.02, 'IPI': 0.0},
+        '0206': {'PIS': 0.0165, 'COFINS': 0.076, 'IPI': 0.05},
+        '0206.30': {'PIS': 0.0, 'COFINS': 0.0, 'IPI': 0.1},
+        '02063000': {'PIS': 0.0165, 'COFINS': 0.076, 'IPI': 0.0, 'CST': '01'},
+    })
+    assert len(indice) == 4 and '020630' in indice
+    assert indice.resolver('02063000')['ncm_regra'] == '02063000'
+    assert indice.resolver('0206.30.90')['IPI'] == 0.1
+    assert indice.resolver('02064100')['ncm_regra'] == '0206'
+    assert indice.resolver(2011000)['ncm_regra'] == '02'  # zero à esquerda perdido
+    assert indice.resolver('03011000') is None
+
+    ncms = pd.Series(['02064100', '03011000', None, '02064100', '02011000'] * 1000)
+    aliquotas = indice.resolver_coluna(ncms)
+    assert aliquotas.index.equals(ncms.index)
+    assert list(aliquotas['ncm_regra'][:5].fillna('-')) == ['0206', '-', '-', '0206', '02']
+    assert aliquotas['COFINS'][:5].isna().tolist() == [False, True, True, False, False]
+    # NCMs repetidos resolvidos uma vez só
+    assert set(indice._memo) == {'02063000', '02063090', '02064100', '02011000', '03011000'}
+    print("✅ Índice de NCM por prefixo")
+
+
 def main():
     """Função principal de teste"""
     print("🚀 Iniciando testes da aplicação tributária...")
@@ -98,6 +201,11 @@ def main():
     
     # Teste de criação do parser
     success &= test_parser_creation()
+
+    # Relatório do app.py
+    test_relatorio_app()
+    test_indice_ncm()
+    test_app_new_recalculo_consistente()
     
     print("\n" + "=" * 50)
     if success:
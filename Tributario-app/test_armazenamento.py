@@ -0,0 +1,114 @@
+"""
+Testes do corpus Parquet (gravação, poda de partições e carga no motor vetorizado)
+"""
+import sys
+import os
+import tempfile
+from decimal import Decimal
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from benchmark import _criar_calculadora, gerar_corpus
+from src.armazenamento.consultas import ConsultaCorpus
+from src.armazenamento.corpus_parquet import CorpusParquet
+from src.calculo.calculadora_vetorizada import CalculadoraVetorizada, ColunasItens
+from src.models import ConfigTributacao
+from src.parser.nf_parser import NFParser
+
+
+def _notas(quantidade=8):
+    parser = NFParser()
+    notas = [parser.parse_nota_fiscal(xml) for xml in gerar_corpus(quantidade, [1, 4], 'misto', seed=11)]
+    # Metade das notas em outro mês para exercitar a poda por partição
+    for nota in notas[::2]:
+        nota.data_emissao = '2025-07-15T10:00:00-03:00'
+    return notas
+
+
+def test_corpus_parquet_roundtrip():
+    """Notas e itens gravados voltam em centavos, com poda por mês e por emitente"""
+    notas = _notas()
+    with tempfile.TemporaryDirectory() as diretorio:
+        corpus = CorpusParquet(diretorio)
+        assert corpus.meses() == []
+        assert len(corpus.ler_itens(['ncm'])) == 0
+
+        assert corpus.gravar(notas, tamanho_lote=3) == len(notas)
+        meses = corpus.meses()
+        assert '2025-07' in meses and len(meses) == 2
+
+        df_notas = corpus.ler_notas()
+        assert len(df_notas) == len(notas)
+        por_chave = df_notas.set_index('chave_acesso')
+        for nota in notas:
+            linha = por_chave.loc[nota.chave_acesso]
+            assert Decimal(int(linha['valor_total_produtos'])) / 100 == nota.valor_total_produtos
+            assert Decimal(int(linha['pis'])) / 100 == nota.get_total_tributo('PIS')
+
+        julho = corpus.ler_itens(['chave_acesso', 'ncm', 'pis_aliquota'], meses=['2025-07'])
+        assert len(julho) == sum(len(n.itens) for n in notas[::2])
+        assert str(julho['ncm'].dtype) == 'category'
+
+        emitente = notas[0].cnpj_emitente
+        assert set(corpus.ler_notas(['cnpj_emitente'], emitentes=[emitente])['cnpj_emitente']) == {emitente}
+
+        # Reimportar com substituição não duplica as partições tocadas
+        corpus.gravar(notas, substituir_particoes=True)
+        assert len(corpus.ler_notas(['chave_acesso'])) == len(notas)
+    print("✅ Corpus Parquet")
+
+
+def test_corpus_parquet_motor_vetorizado():
+    """Itens lidos do Parquet calculam os mesmos totais que os objetos em memória"""
+    notas = _notas()
+    with tempfile.TemporaryDirectory() as diretorio:
+        corpus = CorpusParquet(diretorio)
+        corpus.gravar(notas)
+        colunas, chaves = corpus.carregar_colunas()
+
+    assert sorted(chaves) == sorted(n.chave_acesso for n in notas)
+    calculadora = CalculadoraVetorizada()
+    assert calculadora.totais(colunas) == calculadora.totais(ColunasItens.from_notas(notas))
+    print("✅ Corpus Parquet no motor vetorizado")
+
+
+def test_consultas_agregadas():
+    """Rollups respondem por mês/capítulo NCM e por emitente com os totais do motor vetorizado"""
+    notas = _notas()
+    regras = _criar_calculadora().regras_cst
+    with tempfile.TemporaryDirectory() as diretorio:
+        corpus = CorpusParquet(diretorio)
+        corpus.gravar(notas, tamanho_lote=3)
+        consulta = ConsultaCorpus(corpus, regras_cst=regras)
+
+        esperado = CalculadoraVetorizada(regras_cst=regras).totais(ColunasItens.from_notas(notas))
+        por_mes = consulta.agregar(['mes', 'capitulo_ncm'])
+        assert list(por_mes.columns[:2]) == ['mes', 'capitulo_ncm']
+        for medida in ('valor_produto', 'total_atual', 'cbs_novo', 'ibs_novo'):
+            assert abs(Decimal(str(por_mes[medida].sum())) - esperado[medida]) <= Decimal('0.05'), medida
+        assert por_mes['n_itens'].sum() == sum(len(n.itens) for n in notas)
+
+        # Filtros por partição e por coluna
+        julho = consulta.agregar([], periodo=('2025-07', '2025-07'))
+        assert julho['n_itens'].iloc[0] == sum(len(n.itens) for n in notas[::2])
+        capitulo = por_mes['capitulo_ncm'].iloc[0]
+        filtrado = consulta.agregar(['capitulo_ncm'], capitulo_ncm=[capitulo])
+        assert list(filtrado['capitulo_ncm']) == [capitulo]
+
+        # Nova alíquota recalcula sobre os mesmos rollups
+        dobro = consulta.agregar([], ConfigTributacao(cbs_aliquota=Decimal('0.018')))
+        assert abs(dobro['cbs_novo'].iloc[0] - 2 * float(esperado['cbs_novo'])) < 0.05
+
+        top = consulta.top_emitentes(1)
+        assert top['razao_social_emitente'].iloc[0] == notas[0].razao_social_emitente
+
+        # Rollups reconstruídos a partir dos itens dão o mesmo resultado
+        corpus.reconstruir_rollups()
+        assert consulta.agregar(['mes', 'capitulo_ncm']).equals(por_mes)
+    print("✅ Consultas agregadas")
+
+
+if __name__ == "__main__":
+    test_corpus_parquet_roundtrip()
+    test_corpus_parquet_motor_vetorizado()
+    test_consultas_agregadas()
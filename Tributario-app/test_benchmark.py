@@ -0,0 +1,53 @@
+"""
+Testes do benchmark (corpus sintético e detecção de regressão)
+"""
+import sys
+import os
+import random
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from benchmark import ETAPAS, comparar, executar_etapa, gerar_corpus, gerar_nfe
+from src.parser.nf_parser import NFParser
+
+
+def test_corpus_sintetico():
+    """Todos os estilos de namespace geram NF-e válidas com a contagem de itens pedida"""
+    parser = NFParser()
+    for namespace in ('com', 'sem', 'prefixo'):
+        xml = gerar_nfe(random.Random(1), 7, 12, namespace)
+        nota = parser.parse_nota_fiscal(xml)
+        assert len(nota.itens) == 12, namespace
+        assert nota.numero == '7'
+        assert sum(item.valor_total for item in nota.itens) == nota.valor_total_produtos
+
+    corpus = gerar_corpus(6, [1, 3], 'misto', seed=5)
+    assert corpus == gerar_corpus(6, [1, 3], 'misto', seed=5)
+    assert [len(parser.parse_nota_fiscal(xml).itens) for xml in corpus] == [1, 3] * 3
+    print("✅ Corpus sintético")
+
+
+def test_medicao_e_regressao():
+    """Uma etapa medida devolve vazão e memória; quedas acima da tolerância são apontadas"""
+    medida = executar_etapa('realizar_comparacao', 4, [2], 'com', seed=1)
+    assert medida['docs_por_s'] > 0 and medida['itens_por_s'] > 0
+
+    base = {'etapas': {'parse': {'docs_por_s': 100.0}, 'csv': {'docs_por_s': 100.0}}}
+    atual = {'etapas': {'parse': {'docs_por_s': 70.0}, 'csv': {'docs_por_s': 95.0}}}
+    regressoes = comparar(atual, base, tolerancia=0.2)
+    assert len(regressoes) == 1 and regressoes[0].startswith('parse')
+    print("✅ Medição e detecção de regressão")
+
+
+def test_todas_as_etapas():
+    """Cada etapa do benchmark roda uma vez em um corpus mínimo"""
+    for etapa in ETAPAS:
+        medida = executar_etapa(etapa, 2, [1, 2], 'misto', seed=3)
+        assert medida['segundos'] >= 0 and 'pico_rss_mb' in medida, etapa
+    print("✅ Todas as etapas do benchmark")
+
+
+if __name__ == "__main__":
+    test_corpus_sintetico()
+    test_medicao_e_regressao()
+    test_todas_as_etapas()
@@ -0,0 +1,260 @@
+"""
+Testes da calculadora tributária (índice de CST e cálculo RTI)
+"""
+import sys
+import os
+import io
+import pickle
+import tempfile
+from decimal import Decimal
+
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from src.calculo.calculadora import calcular_tributos
+from src.calculo.calculadora_rti import CalculadoraTributaria
+from src.calculo.calculadora_vetorizada import CalculadoraVetorizada, ColunasItens
+from src.calculo.recalculo import AgregadosRTI
+from src.calculo import tabela_cst
+from src.calculo.tabela_cst import TabelaCSTError, ler_tabela_cst, ler_tabela_cst_compilada, normalizar_cst
+from src.models import ConfigTributacao, ItemNF
+from src.parser.nf_parser import NFParser
+from src.regras.registro import regra, registro_padrao
+from src.regras.regras_tributo import obter_regra_por_cst
+from test_nf_parser import build_xml
+
+
+def test_normalizar_cst():
+    """Códigos lidos da planilha em formato numérico voltam a ter três dígitos"""
+    assert normalizar_cst('.000') == '000'
+    assert normalizar_cst(0.01) == '010'
+    assert normalizar_cst('0.011') == '011'
+    assert normalizar_cst(200.0) == '200'
+    assert normalizar_cst(' 410 ') == '410'
+    assert normalizar_cst('10') == '010'
+    # Só frações de códigos com zero à esquerda viram CST
+    assert normalizar_cst('0.5') == '0.5'
+    assert normalizar_cst('0.0123') == '0.0123'
+    assert normalizar_cst(0.0) == '000'
+    print("✅ Normalização de CST")
+
+
+def test_ler_tabela_cst_cabecalho_deslocado():
+    """Cabeçalho abaixo de linhas em branco é localizado com uma única leitura"""
+    buffer = io.BytesIO()
+    pd.DataFrame([
+        [None, None, None, None],
+        [None, 'CST', 'Exige Trib ', '% Red. CBS'],
+        [None, '.000', 'SIM', None],
+        [None, '200', 'SIM ', '60%'],
+        [None, '410', 'NÃO', '0'],
+    ]).to_excel(buffer, header=False, index=False)
+    buffer.seek(0)
+
+    df_cst = ler_tabela_cst(buffer)
+    assert list(df_cst['CST']) == ['000', '200', '410']
+    assert list(df_cst['Exige Trib']) == [True, True, False]
+    assert list(df_cst['% Red. CBS']) == [0, 0.6, 0]
+    assert list(df_cst['% Red. IBS']) == [0, 0, 0]
+
+    # Versão da planilha com o código na coluna 'Código'
+    buffer = io.BytesIO()
+    pd.DataFrame([
+        ['Código', 'Descrição do CST', 'Exige Trib'],
+        ['200', 'Alíquota reduzida', 'SIM'],
+    ]).to_excel(buffer, header=False, index=False)
+    buffer.seek(0)
+    df_cst = ler_tabela_cst(buffer)
+    assert list(df_cst['CST']) == ['200'] and list(df_cst['Exige Trib']) == [True]
+    print("✅ Leitura da planilha CST")
+
+
+def test_tabela_cst_compilada():
+    """Segunda leitura vem do binário compilado (sem Excel); outra versão força releitura"""
+    buffer = io.BytesIO()
+    pd.DataFrame([
+        ['CST', 'Descrição', 'Exige Trib', 'Monofásica', '% Red. CBS', '% Red. IBS'],
+        ['000', 'Tributação integral', 'SIM', 'NÃO', None, None],
+        ['200', 'Alíquota reduzida', 'SIM', 'NÃO', '60%', '60,5'],
+    ]).to_excel(buffer, header=False, index=False)
+    esperado = ler_tabela_cst(io.BytesIO(buffer.getvalue())).reset_index(drop=True)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        primeira = ler_tabela_cst_compilada(buffer, cache_dir)
+        assert len(os.listdir(cache_dir)) == 1
+
+        leituras = []
+        original = tabela_cst.ler_tabela_cst
+        tabela_cst.ler_tabela_cst = lambda origem: leituras.append(origem) or original(origem)
+        try:
+            segunda = ler_tabela_cst_compilada(buffer, cache_dir)
+            assert leituras == []
+            pd.testing.assert_frame_equal(segunda, esperado)
+            pd.testing.assert_frame_equal(primeira.reset_index(drop=True), segunda)
+            assert list(segunda['% Red. IBS']) == [0, 0.605]
+
+            versao = tabela_cst.TABELA_CST_VERSAO
+            tabela_cst.TABELA_CST_VERSAO = versao + '-nova'
+            try:
+                ler_tabela_cst_compilada(buffer, cache_dir)
+            finally:
+                tabela_cst.TABELA_CST_VERSAO = versao
+            assert len(leituras) == 1
+        finally:
+            tabela_cst.ler_tabela_cst = original
+
+    # Cache padrão fica na raiz do projeto, independente do diretório de trabalho
+    raiz = os.path.dirname(os.path.abspath(__file__))
+    assert tabela_cst.CACHE_CST_DIR_PADRAO == os.path.join(raiz, 'data', 'cache')
+    print("✅ Tabela CST compilada")
+
+
+def test_indice_regras_cst():
+    """Regras são buscadas no índice compilado, com padrão para CST ausente"""
+    calculadora = CalculadoraTributaria()
+    calculadora.carregar_tabela_cst(pd.DataFrame({
+        'CST': ['000', '200', '200', '410'],
+        'Exige Trib': [True, True, False, False],
+        '% Red. CBS': [0, 0.6, 0, None],
+        '% Red. IBS': [0, 0.6, 0, None],
+    }))
+
+    assert set(calculadora.regras_cst) == {'000', '200', '410'}
+    assert calculadora.regras_cst['200'].red_cbs == Decimal('0.6')
+
+    item = ItemNF(1, 'Produto', '02061000', '5102', 'UN', Decimal('1'), Decimal('100'), Decimal('100'), [])
+    item.cst = '200'
+    cbs, ibs = calculadora.calcular_rti_item(item)
+    assert cbs == Decimal('100') * Decimal('0.009') * Decimal('0.4')
+    assert ibs == Decimal('100') * Decimal('0.26') * Decimal('0.4')
+
+    item.cst = '410'
+    assert calculadora.calcular_rti_item(item) == (Decimal('0'), Decimal('0'))
+
+    # CST fora da tabela: tributação integral
+    item.cst = '999'
+    assert calculadora.calcular_rti_item(item)[0] == Decimal('100') * Decimal('0.009')
+
+    # Reduções em percentual (60) ou texto são recusadas, não aplicadas como 6000%
+    for reducao in (60, '60%', -0.1):
+        try:
+            calculadora.carregar_tabela_cst(pd.DataFrame({'CST': ['200'], '% Red. CBS': [reducao]}))
+        except TabelaCSTError as e:
+            assert '% Red. CBS' in str(e) and '200' in str(e)
+        else:
+            raise AssertionError(f"Redução {reducao!r} deveria ser recusada")
+    print("✅ Índice de regras CST")
+
+
+def test_motor_vetorizado_equivale_ao_decimal():
+    """Motor colunar reproduz os totais do cálculo item a item (em centavos)"""
+    calculadora = CalculadoraTributaria(ConfigTributacao(incluir_iss=True))
+    calculadora.carregar_tabela_cst(pd.DataFrame({
+        'CST': ['000'], 'Exige Trib': [True], '% Red. CBS': [0.3], '% Red. IBS': [0.1],
+    }))
+    notas = [NFParser().parse_nota_fiscal(build_xml(i % 2 == 0)) for i in range(3)]
+
+    vetorizada = CalculadoraVetorizada.from_calculadora(calculadora)
+    comparativos = vetorizada.realizar_comparacoes(notas, incluir_detalhes=True)
+    centavo = Decimal('0.01')
+
+    for nota, comparativo in zip(notas, comparativos):
+        esperado = calculadora.realizar_comparacao(nota)
+        for tipo in ('PIS', 'COFINS', 'IPI', 'ICMS', 'ISS'):
+            assert comparativo.tributacao_atual[tipo] == esperado.tributacao_atual[tipo].quantize(centavo)
+        for tipo in ('CBS', 'IBS', 'TOTAL'):
+            assert comparativo.tributacao_nova[tipo] == esperado.tributacao_nova[tipo].quantize(centavo)
+        assert len(comparativo.detalhes_por_item) == len(nota.itens)
+        assert comparativo.detalhes_por_item[0]['ncm'] == nota.itens[0].ncm
+    print("✅ Motor vetorizado equivalente")
+
+
+def test_recalculo_incremental_por_aliquota():
+    """Mudança de alíquota recalculada pelos agregados bate com o cálculo completo"""
+    calculadora = CalculadoraTributaria()
+    calculadora.carregar_tabela_cst(pd.DataFrame({
+        'CST': ['000', '200', '410'], 'Exige Trib': [True, True, False],
+        '% Red. CBS': [0, 0.6, 0], '% Red. IBS': [0, 0.4, 0],
+    }))
+    notas = [NFParser().parse_nota_fiscal(build_xml(i % 2 == 0)) for i in range(4)]
+    for n, nota in enumerate(notas):
+        for item in nota.itens:
+            item.cst = ['000', '200', '410'][(n + item.numero) % 3]
+
+    agregados = AgregadosRTI(notas, calculadora.regras_cst)
+    assert agregados.n_faixas == 3
+    centavo = Decimal('0.01')
+
+    for config in (ConfigTributacao(), ConfigTributacao(Decimal('0.012'), Decimal('0.18'), True, Decimal('0.03'))):
+        calculadora.config_rti = config
+        comparativos = agregados.comparativos(config, incluir_detalhes=True)
+        for nota, comparativo in zip(notas, comparativos):
+            esperado = calculadora.realizar_comparacao(nota)
+            for tipo in ('CBS', 'IBS', 'TOTAL'):
+                assert comparativo.tributacao_nova[tipo] == esperado.tributacao_nova[tipo].quantize(centavo)
+            assert comparativo.tributacao_atual['TOTAL'] == esperado.tributacao_atual['TOTAL'].quantize(centavo)
+            assert len(comparativo.detalhes_por_item) == len(nota.itens)
+    print("✅ Recálculo incremental por alíquota")
+
+
+def test_registro_regras_vigencia():
+    """Regra mais específica por tributo e data; lote igual ao item a item; instantâneo compartilhado"""
+    registro = registro_padrao().com(
+        regra({'CBS': '0.009', 'IBS': '0.001'}, inicio='2026-01-01', fim='2027-01-01'),
+        regra({'CBS': '0.088', 'IBS': '0.177'}, inicio='2027-01-01'),
+        regra({'PIS': '0.0165', 'COFINS': '0.076'}, ncm='0206'),
+        regra({'IBS': '0.05'}, cst='200', inicio='2027-01-01'),
+    )
+    instantaneo = registro.instantaneo()
+    assert instantaneo is registro.instantaneo()
+    assert pickle.loads(pickle.dumps(instantaneo)) is instantaneo
+
+    # Padrões que antes estavam espalhados pelo código
+    assert obter_regra_por_cst('010') == {'PIS': 0.0065, 'COFINS': 0.03, 'ICMS': 0.12}
+    assert obter_regra_por_cst('999')['ICMS'] == 0.18
+    # CST sem regra própria: lote e item a item usam o ICMS do CST 000
+    itens = calcular_tributos(pd.DataFrame({'cst': ['040', '000', '060', None], 'valor_total': [100.0] * 4}))
+    assert list(itens['ICMS']) == [obter_regra_por_cst(c)['ICMS'] * 100 for c in ('040', '000', '060', '000')]
+    assert itens['ICMS'][0] == 18.0
+    assert ConfigTributacao().ibs_aliquota == Decimal('0.26')
+
+    assert instantaneo.resolver('000', '03011000', '2025-05-01')['IBS'] == Decimal('0.26')
+    assert instantaneo.resolver('000', '02063000', '2025-05-01')['PIS'] == Decimal('0.0165')
+    assert instantaneo.resolver('060', '02063000', '2026-12-31') == {
+        'PIS': Decimal('0.0165'), 'COFINS': Decimal('0.076'), 'IPI': Decimal('0'), 'ICMS': Decimal('0'),
+        'ISS': Decimal('0.05'), 'CBS': Decimal('0.009'), 'IBS': Decimal('0.001')}
+    assert instantaneo.resolver('200', '', '2027-01-01')['IBS'] == Decimal('0.05')
+    assert instantaneo.resolver('0', '', '2030-01-01T08:00:00-03:00')['IBS'] == Decimal('0.177')
+
+    lote = pd.DataFrame({
+        'cst': ['000', '060', '200', '200', '010', None] * 200,
+        'ncm': ['02063000', '2063000', '03011000', '02064100', None, '02011000'] * 200,
+        'data': ['2025-05-01', '2026-12-31T10:00:00-03:00', '2027-01-01', '2026-06-01', None, '2028-02-29'] * 200,
+    })
+    aliquotas = instantaneo.resolver_lote(lote['cst'], lote['ncm'], lote['data'], data_padrao='2025-01-01')
+    for i, (cst, ncm, data) in enumerate(lote.head(6).itertuples(index=False)):
+        esperado = instantaneo.resolver(cst, ncm, data if isinstance(data, str) else '2025-01-01')
+        obtido = {tributo: Decimal(str(v)) for tributo, v in aliquotas.loc[i].items() if v == v}
+        assert obtido == esperado, (i, obtido, esperado)
+    assert aliquotas.iloc[6:12].reset_index(drop=True).equals(aliquotas.iloc[:6].reset_index(drop=True))
+
+    # Motor vetorizado: CBS/IBS de cada item pela data de emissão da nota
+    notas = [NFParser().parse_nota_fiscal(build_xml()) for _ in range(2)]
+    notas[1].data_emissao = '2027-03-01'
+    colunas = ColunasItens.from_notas(notas)
+    itens = CalculadoraVetorizada(registro=registro).calcular(colunas)
+    taxas = itens['cbs_novo'] / itens['valor_produto']
+    assert taxas[colunas.nota == 0].round(6).eq(0.009).all()
+    assert taxas[colunas.nota == 1].round(6).eq(0.088).all()
+    print("✅ Registro de regras com vigência")
+
+
+if __name__ == "__main__":
+    test_normalizar_cst()
+    test_ler_tabela_cst_cabecalho_deslocado()
+    test_tabela_cst_compilada()
+    test_indice_regras_cst()
+    test_motor_vetorizado_equivale_ao_decimal()
+    test_recalculo_incremental_por_aliquota()
+    test_registro_regras_vigencia()
@@ -0,0 +1,88 @@
+"""
+Testes dos exportadores em streaming (Excel write-only e CSV em blocos)
+"""
+import sys
+import os
+import io
+from decimal import Decimal
+
+import pandas as pd
+from openpyxl import load_workbook
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from benchmark import _criar_calculadora, gerar_corpus
+from src.exportador.csv_streaming import csv_comparativos, formatar_moeda_br, formatar_numero_br
+from src.exportador.excel_streaming import gerar_excel_streaming
+from src.exportador.linhas import COLUNAS_ITENS
+from src.parser.nf_parser import NFParser
+
+
+def _comparativos(quantidade=6):
+    parser = NFParser()
+    calculadora = _criar_calculadora()
+    return [calculadora.realizar_comparacao(parser.parse_nota_fiscal(xml))
+            for xml in gerar_corpus(quantidade, [1, 4], 'misto', seed=5)]
+
+
+def test_excel_streaming():
+    """Itens divididos em abas no limite de linhas, formatos por coluna e resumos dos agregados"""
+    comparativos = _comparativos()
+    total_itens = sum(len(c.detalhes_por_item) for c in comparativos)
+
+    buffer = io.BytesIO()
+    gerar_excel_streaming(((c, f"nf_{i}.xml") for i, c in enumerate(comparativos)), buffer, limite_linhas=6)
+    workbook = load_workbook(io.BytesIO(buffer.getvalue()))
+
+    abas_itens = [nome for nome in workbook.sheetnames if nome.startswith('Itens')]
+    assert workbook.sheetnames[:3] == ['Resumo por mês', 'Resumo por NCM', 'Resumo por emitente']
+    # Cabeçalho + 5 itens por aba
+    assert len(abas_itens) == -(-total_itens // 5)
+    linhas = [linha for nome in abas_itens for linha in workbook[nome].iter_rows(min_row=2, values_only=True)]
+    assert len(linhas) == total_itens
+    assert [c.value for c in workbook['Itens'][1]] == COLUNAS_ITENS
+    assert workbook['Itens'].cell(2, COLUNAS_ITENS.index('valor_produto') + 1).number_format == '#,##0.00'
+
+    # Resumo geral por mês bate com a soma dos itens
+    posicao = COLUNAS_ITENS.index('total_rti')
+    soma_rti = sum(Decimal(str(linha[posicao])) for linha in linhas)
+    resumo = list(workbook['Resumo por mês'].iter_rows(min_row=2, values_only=True))
+    assert sum(linha[1] for linha in resumo) == total_itens
+    assert abs(sum(Decimal(str(linha[4])) for linha in resumo) - soma_rti) < Decimal('0.01')
+    print("✅ Excel em streaming")
+
+
+def test_csv_streaming():
+    """CSV em blocos: um cabeçalho e um BOM, todas as linhas, formatação brasileira vetorizada"""
+    from app import fmt
+
+    valores = pd.Series([0, 0.005, 1234.565, -98765432.1, 1e9, Decimal('12.345'), None, 'x'])
+    esperado = [fmt(float(v)) for v in valores[:6]] + ['', '']
+    assert formatar_moeda_br(valores).tolist() == esperado
+    # Decimal arredonda ROUND_HALF_UP no valor exato, não no float
+    assert formatar_numero_br(pd.Series([Decimal('1.005'), Decimal('-2.675'), Decimal('12.344')])).tolist() == \
+        ['1,01', '-2,68', '12,34']
+    # Sem "-0,00" quando o valor arredonda para zero
+    assert formatar_moeda_br(pd.Series([-0.004])).tolist() == ['R$\xa00,00']
+    assert formatar_numero_br(pd.Series([33.3333]), casas=2).tolist() == ['33,33']
+
+    comparativos = _comparativos()
+    total_itens = sum(len(c.detalhes_por_item) for c in comparativos)
+    conteudo = csv_comparativos(comparativos, tamanho_bloco=4).read()
+
+    assert conteudo.startswith(b'\xef\xbb\xbf') and conteudo.count(b'\xef\xbb\xbf') == 1
+    linhas = conteudo.decode('utf-8-sig').splitlines()
+    assert linhas[0] == ';'.join(COLUNAS_ITENS)
+    assert len(linhas) == total_itens + 1
+    assert linhas.count(linhas[0]) == 1
+
+    df = pd.read_csv(io.BytesIO(conteudo), sep=';', dtype=str, encoding='utf-8-sig')
+    primeiro = comparativos[0].detalhes_por_item[0]
+    assert df['valor_produto'][0] == formatar_numero_br(pd.Series([primeiro['valor_produto']]))[0]
+    assert ',' in df['valor_produto'][0]
+    print("✅ CSV em blocos")
+
+
+if __name__ == "__main__":
+    test_excel_streaming()
+    test_csv_streaming()
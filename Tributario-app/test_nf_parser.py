@@ -0,0 +1,338 @@
+"""
+Testes do parser de NF-e (com e sem namespace)
+"""
+import sys
+import os
+import io
+import pickle
+import re
+import tempfile
+import tracemalloc
+from decimal import Decimal
+from pathlib import Path
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from src.models import ItemNF, TributoItem
+from src.parser.cache import CACHE_DIR_PADRAO, CacheNotas, hash_conteudo
+from src.parser.nf_parser import NFParser, NFParserError
+from src.parser.nf_stream import NFStreamParser
+from src.parser.triagem import triar
+from src.parser.xml_parser import extrair_itens_xml
+from src.util.numeros import centavos_nfe, decimal_nfe, escalado_nfe
+
+
+NFE_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<nfeProc{ns} versao="4.00">
+  <NFe>
+    <infNFe Id="NFe26250607750628000153650120006461081027022603" versao="4.00">
+      <ide><serie>12</serie><nNF>646108</nNF><dhEmi>2025-06-10T10:00:00-03:00</dhEmi><mod>65</mod></ide>
+      <emit><CNPJ>07750628000153</CNPJ><xNome>Emitente SA</xNome></emit>
+      <dest><CPF>12345678901</CPF><xNome>Consumidor</xNome></dest>
+      <det nItem="1">
+        <prod><xProd>Produto 1</xProd><NCM>02061000</NCM><CFOP>5102</CFOP><uCom>UN</uCom>
+          <qCom>2.0000</qCom><vUnCom>50.00</vUnCom><vProd>100.00</vProd></prod>
+        <imposto>
+          <ICMS><ICMS00><orig>0</orig><CST>00</CST><vBC>100.00</vBC><pICMS>18.00</pICMS><vICMS>18.00</vICMS></ICMS00></ICMS>
+          <IPI><cEnq>999</cEnq><IPITrib><CST>50</CST><vBC>100.00</vBC><pIPI>5.00</pIPI><vIPI>5.00</vIPI></IPITrib></IPI>
+          <PIS><PISAliq><CST>01</CST><vBC>100.00</vBC><pPIS>1.65</pPIS><vPIS>1.65</vPIS></PISAliq></PIS>
+          <COFINS><COFINSAliq><CST>01</CST><vBC>100.00</vBC><pCOFINS>7.60</pCOFINS><vCOFINS>7.60</vCOFINS></COFINSAliq></COFINS>
+        </imposto>
+      </det>
+      <det nItem="2">
+        <prod><xProd>Produto 2</xProd><NCM>02063000</NCM><CFOP>5102</CFOP><uCom>KG</uCom>
+          <vUnCom>10.00</vUnCom><vProd>10.00</vProd></prod>
+        <imposto>
+          <ICMS><ICMSSN102><orig>0</orig><CSOSN>102</CSOSN></ICMSSN102></ICMS>
+          <PIS><PISNT><CST>07</CST></PISNT></PIS>
+        </imposto>
+      </det>
+      <total><ICMSTot><vProd>110.00</vProd><vNF>110.00</vNF></ICMSTot></total>
+    </infNFe>
+  </NFe>
+</nfeProc>"""
+
+
+def build_xml(namespace: bool = True) -> str:
+    return NFE_XML.format(ns=' xmlns="http://www.portalfiscal.inf.br/nfe"' if namespace else '')
+
+
+def build_lote(caminho: Path, quantidade: int):
+    """Grava um lote <enviNFe> com ``quantidade`` NF-e"""
+    nfe = re.search(r'<NFe>.*</NFe>', build_xml(), re.S).group(0)
+    with open(caminho, 'w', encoding='utf-8') as arquivo:
+        arquivo.write('<?xml version="1.0" encoding="UTF-8"?>'
+                      '<enviNFe xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00">'
+                      '<idLote>1</idLote><indSinc>0</indSinc>')
+        for _ in range(quantidade):
+            arquivo.write(nfe)
+        arquivo.write('</enviNFe>')
+
+
+def test_parse_nota_fiscal():
+    """Campos básicos, itens e tributos são extraídos com e sem namespace"""
+    parser = NFParser()
+
+    for namespace in (True, False):
+        nota = parser.parse_nota_fiscal(build_xml(namespace))
+
+        assert nota.numero == '646108'
+        assert nota.serie == '12'
+        assert nota.data_emissao == '2025-06-10'
+        assert nota.chave_acesso == '26250607750628000153650120006461081027022603'
+        assert nota.cnpj_emitente == '07750628000153'
+        assert nota.cnpj_destinatario == '12345678901'
+        assert nota.valor_total_nota == Decimal('110.00')
+        assert len(nota.itens) == 2
+
+        item = nota.itens[0]
+        assert item.ncm == '02061000'
+        assert item.quantidade == Decimal('2')
+        assert [t.tipo for t in item.tributos] == ['PIS', 'COFINS', 'IPI', 'ICMS']
+        assert item.get_tributo('ICMS').valor == Decimal('18.00')
+        assert item.get_tributo('PIS').aliquota == Decimal('0.0165')
+
+        # qCom ausente assume 1; CSOSN é usado como CST do ICMS
+        item = nota.itens[1]
+        assert item.quantidade == Decimal('1')
+        assert item.get_tributo('ICMS').cst == '102'
+        assert item.get_tributo('PIS').valor == Decimal('0')
+
+        assert nota.get_total_tributo('ICMS') == Decimal('18.00')
+
+    print("✅ Parse de NF-e com e sem namespace")
+
+
+def test_modelo_compacto():
+    """Itens com vetor fixo de tributos, totais da nota prontos e serialização compacta"""
+    nota = NFParser().parse_nota_fiscal(build_xml())
+    item = nota.itens[0]
+
+    assert not hasattr(item, '__dict__')
+    assert item.icms is item.get_tributo('icms') and item.icms.valor == Decimal('18.00')
+    assert item.iss is None
+    assert item.valores_tributos() == (Decimal('1.65'), Decimal('7.60'), Decimal('5.00'),
+                                      Decimal('18.00'), Decimal('0'))
+    assert nota.totais_tributos['COFINS'] == Decimal('7.60')
+    assert pickle.loads(pickle.dumps(nota)) == nota
+
+    # Grupo repetido ou tipo fora do vetor ficam em outros_tributos e entram nos totais
+    extra = ItemNF(3, 'Serviço', '', '5933', 'UN', Decimal('1'), Decimal('10'), Decimal('10'), [
+        TributoItem('PIS', '01', Decimal('10'), Decimal('0.01'), Decimal('0.10')),
+        TributoItem('PIS', '01', Decimal('10'), Decimal('0.01'), Decimal('0.20')),
+        TributoItem('FCP', '', Decimal('10'), Decimal('0.02'), Decimal('0.20')),
+    ])
+    assert extra.pis.valor == Decimal('0.10')
+    assert [t.tipo for t in extra.outros_tributos] == ['PIS', 'FCP']
+    assert extra.get_tributo('FCP').valor == Decimal('0.20')
+    nota.itens.append(extra)
+    nota.recalcular_totais()
+    assert nota.get_total_tributo('PIS') == Decimal('1.95')
+    print("✅ Modelo compacto de itens")
+
+
+def test_rejeita_documento_invalido():
+    """XML malformado ou que não é NF-e gera NFParserError"""
+    parser = NFParser()
+
+    for conteudo in ("<nfeProc><NFe>", "<cteProc><CTe/></cteProc>"):
+        try:
+            parser.parse_nota_fiscal(conteudo)
+        except NFParserError:
+            continue
+        raise AssertionError(f"Documento deveria ser rejeitado: {conteudo}")
+
+    assert parser.validate_nf_structure(build_xml()) is True
+    print("✅ Documentos inválidos rejeitados")
+
+
+def test_stream_lote_concatenado():
+    """Streaming produz as mesmas notas do parse completo, inclusive em lotes"""
+    parser = NFParser()
+    stream = NFStreamParser(parser)
+    esperado = parser.parse_nota_fiscal(build_xml())
+
+    lote = (build_xml() + "\n" + build_xml(namespace=False)).encode('utf-8')
+    notas = list(stream.iter_notas(lote))
+    assert notas == [esperado, esperado]
+
+    itens = list(stream.iter_itens(build_xml().encode('utf-8')))
+    assert itens == esperado.itens
+    assert stream.nota_atual['chave_acesso'] == esperado.chave_acesso
+
+    # Como no NFParser, str é o conteúdo (mesmo declarando outro encoding); caminhos vêm como Path
+    latin1 = build_xml().replace('encoding="UTF-8"', 'encoding="ISO-8859-1"', 1)
+    assert list(stream.iter_notas(latin1)) == [esperado]
+    with tempfile.TemporaryDirectory() as diretorio:
+        caminho = Path(diretorio) / 'lote.xml'
+        caminho.write_bytes(lote)
+        assert list(stream.iter_notas(caminho)) == [esperado, esperado]
+    print("✅ Streaming de lote concatenado")
+
+
+def test_stream_lote_memoria_limitada():
+    """O pico de memória do streaming não cresce com o número de notas do lote"""
+    picos = {}
+    with tempfile.TemporaryDirectory() as diretorio:
+        for quantidade in (100, 1000):
+            caminho = Path(diretorio) / f'lote_{quantidade}.xml'
+            build_lote(caminho, quantidade)
+            tracemalloc.start()
+            try:
+                assert sum(1 for _ in NFStreamParser().iter_notas(caminho)) == quantidade
+                picos[quantidade] = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+        tamanho = caminho.stat().st_size
+    assert picos[1000] < picos[100] * 1.5, picos
+    assert picos[1000] < tamanho / 2, (picos, tamanho)
+    print("✅ Memória limitada no streaming de lote")
+
+
+def test_cache_notas():
+    """Cache persistente: hit sem parse, invalidação por versão e despejo LRU"""
+    conteudo = build_xml().encode('utf-8')
+    parser = NFParser()
+
+    with tempfile.TemporaryDirectory() as diretorio:
+        with CacheNotas(diretorio) as cache:
+            nota = cache.parse(conteudo, parser)
+            # Segunda leitura vem do cache, igual à original
+            assert repr(cache.get(hash_conteudo(conteudo))) == repr(nota)
+            assert repr(cache.get_por_chave(nota.chave_acesso)) == repr(nota)
+            # Diretório padrão fica na raiz do projeto, independente do diretório de trabalho
+            assert CACHE_DIR_PADRAO == os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'cache')
+
+        # Outra versão do parser descarta as entradas antigas
+        with CacheNotas(diretorio, versao='outra') as cache:
+            assert cache.get(hash_conteudo(conteudo)) is None
+            assert cache.tamanho_total() == 0
+
+            # Limite pequeno: só as notas mais recentes permanecem
+            cache.put('a', nota)
+            cache.max_bytes = int(cache.tamanho_total() * 2.5)
+            cache.put('b', nota)
+            cache.get('a')
+            cache.put('c', nota)
+            assert cache.get('b') is None
+            assert cache.get('a') is not None and cache.get('c') is not None
+
+    print("✅ Cache de notas: hit, invalidação por versão e LRU")
+
+
+def test_parse_bytes_encoding_declarado():
+    """Bytes, memoryview e arquivo binário são parseados sem decode, respeitando o encoding declarado"""
+    parser = NFParser()
+    esperado = parser.parse_nota_fiscal(build_xml())
+
+    utf8 = build_xml().encode('utf-8')
+    assert repr(parser.parse_nota_fiscal(utf8)) == repr(esperado)
+    assert repr(parser.parse_nota_fiscal(memoryview(utf8))) == repr(esperado)
+    assert repr(parser.parse_nota_fiscal(io.BytesIO(utf8))) == repr(esperado)
+
+    latin1 = (build_xml().replace('encoding="UTF-8"', 'encoding="ISO-8859-1"')
+              .replace('Produto 1', 'Feijão Açúcar').encode('iso-8859-1'))
+    nota = parser.parse_nota_fiscal(memoryview(latin1))
+    assert nota.itens[0].descricao == 'Feijão Açúcar'
+    assert extrair_itens_xml(memoryview(latin1))['produto'].iloc[0] == 'Feijão Açúcar'
+
+    try:
+        parser.parse_nota_fiscal(latin1.replace(b'encoding="ISO-8859-1"', b'encoding="UTF-8"'))
+        assert False, "bytes latin-1 declarados como UTF-8 deveriam falhar"
+    except NFParserError:
+        pass
+    print("✅ Parse de bytes com encoding declarado")
+
+
+def test_decodificacao_numerica():
+    """Caminho estrito do leiaute, fallback brasileiro e inteiros escalados ROUND_HALF_UP"""
+    assert decimal_nfe('1234.56') == Decimal('1234.56')
+    assert decimal_nfe('-0.10') == Decimal('-0.10')
+    assert decimal_nfe('1.234,56') == Decimal('1234.56')
+    assert decimal_nfe('R$ 10,5') == Decimal('10.5')
+    assert decimal_nfe('NaN') == Decimal('0') and decimal_nfe('', None) is None
+
+    assert centavos_nfe('1234.56') == 123456
+    assert centavos_nfe('12') == 1200
+    assert centavos_nfe('0.005') == 1 and centavos_nfe('-0.005') == -1
+    assert centavos_nfe('2.3449') == 234
+    assert centavos_nfe('1.234,565') == 123457
+    assert centavos_nfe('x', padrao=-1) == -1
+    assert escalado_nfe('2.0000', 4) == 20000
+
+    # O extrator usa o mesmo caminho: texto fora do leiaute cai no fallback
+    parser = NFParser()
+    assert parser._extractor.to_decimal('1.234,56') == Decimal('1234.56')
+    assert parser._extractor.to_decimal('Infinity') == Decimal('0')
+    print("✅ Decodificação numérica")
+
+
+def test_extrair_itens_xml():
+    """Extrator do relatório: uma linha tipada por item, com e sem namespace"""
+    for namespace in (True, False):
+        df = extrair_itens_xml(io.BytesIO(build_xml(namespace).encode('utf-8')))
+
+        assert list(df.index) == [1, 2] and df.index.name == 'item'
+        assert list(df['produto']) == ['Produto 1', 'Produto 2']
+        assert list(df['ncm']) == ['02061000', '02063000']
+        assert list(df['cst']) == ['00', '102']
+        assert list(df['valor_produto']) == [100.0, 10.0]
+        assert list(df['valor_pis']) == [1.65, 0.0]
+        assert df['valor_cofins'].iloc[0] == 7.6 and df['valor_ipi'].iloc[0] == 5.0
+        # Sem grupo COFINS/IPI no XML: NaN (o relatório estima pelo NCM)
+        assert df[['valor_cofins', 'valor_ipi']].iloc[1].isna().all()
+    print("✅ Extrator de itens do relatório")
+
+
+def test_triagem():
+    """Triagem pelo prefixo: classifica sem parse completo e o parser recusa o que não é nota"""
+    nfce = build_xml()
+    nfe = nfce.replace('65012', '55012').replace('<mod>65</mod>', '<mod>55</mod>')
+    evento = ('<procEventoNFe xmlns="http://www.portalfiscal.inf.br/nfe"><evento><infEvento>'
+              '<tpEvento>{}</tpEvento></infEvento></evento></procEventoNFe>')
+    casos = {
+        nfce: 'nfce',
+        nfe.encode('utf-8'): 'nfe',
+        '\ufeff  <NFe><infNFe><ide><mod>55</mod></ide></infNFe></NFe>': 'nfe',
+        evento.format('110110'): 'evento',
+        evento.format('110111'): 'cancelamento',
+        '<?xml version="1.0"?><!-- CT-e --><cteProc><CTe/></cteProc>': 'cte',
+        '<html><body/></html>': 'desconhecido',
+        b'PK\x03\x04lixo': 'invalido',
+    }
+    for conteudo, tipo in casos.items():
+        assert triar(conteudo).tipo == tipo, (conteudo, triar(conteudo))
+
+    # Arquivo aberto: só o prefixo é lido e a posição é preservada
+    arquivo = io.BytesIO(nfce.encode('utf-8'))
+    assert triar(arquivo).modelo == '65' and arquivo.tell() == 0
+
+    parser = NFParser()
+    try:
+        parser.parse_nota_fiscal(evento.format('110111'))
+    except NFParserError as e:
+        assert 'cancelamento' in str(e)
+    else:
+        raise AssertionError("Evento de cancelamento deveria ser recusado")
+
+    # NF-e embrulhada por outra raiz (exportação de ERP): aceita como no .//nfeProc anterior
+    corpo = nfce.split('?>', 1)[1] if nfce.lstrip().startswith('<?xml') else nfce
+    embrulhada = f'<?xml version="1.0"?><retornoERP><documento>{corpo}</documento></retornoERP>'
+    triagem = triar(embrulhada)
+    assert triagem.tipo == 'nfce' and triagem.raiz == 'retornoERP'
+    assert parser.validate_nf_structure(embrulhada)
+    assert parser.parse_nota_fiscal(embrulhada, triagem).numero == parser.parse_nota_fiscal(nfce).numero
+    print("✅ Triagem de documentos")
+
+
+if __name__ == "__main__":
+    test_parse_nota_fiscal()
+    test_modelo_compacto()
+    test_rejeita_documento_invalido()
+    test_stream_lote_concatenado()
+    test_stream_lote_memoria_limitada()
+    test_cache_notas()
+    test_parse_bytes_encoding_declarado()
+    test_decodificacao_numerica()
+    test_extrair_itens_xml()
+    test_triagem()
@@ -0,0 +1,354 @@
+"""
+Testes do pipeline de processamento em lote
+"""
+import sys
+import os
+import gzip
+import io
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from decimal import Decimal
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from src.calculo.calculadora_rti import CalculadoraTributaria
+from src.processamento.arquivos import MembroZip, contar_xmls, iter_xmls, tipo_arquivo
+from src.processamento.pipeline import ProcessadorLote
+from src.util import telemetria
+from test_nf_parser import build_lote, build_xml
+
+
+def criar_calculadora() -> CalculadoraTributaria:
+    calculadora = CalculadoraTributaria()
+    calculadora.carregar_tabela_cst(pd.DataFrame({
+        'CST': ['000', '200'],
+        'Exige Trib': [True, True],
+        '% Red. CBS': [0, 0.6],
+        '% Red. IBS': [0, 0.6],
+    }))
+    return calculadora
+
+
+def test_processamento_paralelo_ordenado():
+    """Resultados voltam na ordem de entrada, com erros reportados por arquivo"""
+    arquivos = [(f"nf_{i}.xml", build_xml(i % 2 == 0).encode('utf-8')) for i in range(12)]
+    arquivos[5] = ("invalido.xml", b"<cteProc><CTe/></cteProc>")
+    arquivos[7] = ("latin1.xml", "<nfeProc>ã</nfeProc>".encode('latin-1'))
+
+    progresso = []
+    processador = ProcessadorLote(criar_calculadora(), max_workers=2, tamanho_bloco=3)
+    resultados = processador.processar(arquivos, lambda r, feitos, total: progresso.append(feitos))
+
+    assert [r.nome for r in resultados] == [nome for nome, _ in arquivos]
+    assert progresso == list(range(1, 13))
+    # Iterador ordenado: mesma ordem sem materializar a lista
+    assert [r.nome for r in processador.processar_ordenado(arquivos)] == [nome for nome, _ in arquivos]
+
+    assert resultados[5].erro_parser and not resultados[5].sucesso
+    # CT-e é descartado na triagem, antes do parse
+    assert resultados[5].descartado and resultados[5].tipo_documento == 'cte'
+    assert resultados[0].tipo_documento == 'nfce' and not resultados[0].descartado
+    # Bytes vão direto ao parser: latin-1 sem declaração de encoding é XML inválido
+    assert resultados[7].erro_parser and not resultados[7].sucesso and not resultados[7].descartado
+
+    comparativo = resultados[0].comparativo
+    assert comparativo.tributacao_atual['ICMS'] == Decimal('18.00')
+    assert comparativo.tributacao_nova['CBS'] == Decimal('110.00') * Decimal('0.009')
+    assert len(comparativo.detalhes_por_item) == 2
+    print("✅ Processamento paralelo ordenado")
+
+
+class MembroLento(MembroZip):
+    """Membro que demora a ser lido no worker (simula um primeiro arquivo lento)"""
+    __slots__ = ('dados', 'espera')
+
+    def __init__(self, dados: bytes, espera: float):
+        self.dados = dados
+        self.espera = espera
+
+    def ler(self) -> bytes:
+        time.sleep(self.espera)
+        return self.dados
+
+    def __reduce__(self):
+        return (MembroLento, (self.dados, self.espera))
+
+
+def test_ordenado_com_primeiro_arquivo_lento():
+    """Bloco inicial lento pausa o envio: a entrada não é consumida além da janela"""
+    xml = build_xml().encode('utf-8')
+    consumidos = []
+
+    def entradas():
+        for i in range(200):
+            consumidos.append(i)
+            yield f"nf_{i}.xml", MembroLento(xml, 1.0) if i == 0 else xml
+
+    processador = ProcessadorLote(criar_calculadora(), max_workers=2, tamanho_bloco=2)
+    resultados = processador.processar_ordenado(entradas())
+    primeiro = next(resultados)
+    # Janela de 2 * max_workers blocos de 2 arquivos, mais o bloco que acabou de ser montado
+    assert primeiro.nome == 'nf_0.xml' and primeiro.sucesso
+    assert len(consumidos) <= max(ProcessadorLote.MIN_ARQUIVOS_PARALELO, 4 * 2) + 2, len(consumidos)
+    assert [r.indice for r in resultados] == list(range(1, 200))
+    print("✅ Ordenação com memória limitada")
+
+
+def test_processar_lote_csv():
+    """CLI grava itens e notas na ordem dos arquivos, com CBS/IBS arredondados ao centavo"""
+    from processar_lote import main
+
+    with tempfile.TemporaryDirectory() as tmp:
+        entrada = os.path.join(tmp, 'xmls')
+        os.makedirs(entrada)
+        nomes = [f"nf_{i:02d}.xml" for i in range(12)]
+        for i, nome in enumerate(nomes):
+            with open(os.path.join(entrada, nome), 'w', encoding='utf-8') as f:
+                f.write(build_xml(i % 2 == 0))
+        cst = os.path.join(tmp, 'cst.xlsx')
+        pd.DataFrame({'CST': ['000', '200'], 'Exige Trib': ['SIM', 'SIM'],
+                      '% Red. CBS': [0, 0.6], '% Red. IBS': [0, 0.6]}).to_excel(cst, index=False)
+        saida = os.path.join(tmp, 'saida')
+
+        assert main([entrada, '--cst', cst, '--saida', saida, '--workers', '2',
+                     '--cache', os.path.join(tmp, 'cache'), '--cbs', '0.93', '--ibs', '0.1']) == 0
+
+        arquivos = {nome.split('_')[1]: os.path.join(saida, nome) for nome in os.listdir(saida)}
+        notas = pd.read_csv(arquivos['notas'], sep=';', dtype=str, encoding='utf-8-sig')
+        itens = pd.read_csv(arquivos['itens'], sep=';', dtype=str, encoding='utf-8-sig')
+        assert list(notas['arquivo']) == nomes
+        assert list(itens['arquivo']) == [nome for nome in nomes for _ in range(2)]
+        for coluna in ('CBS', 'IBS', 'total_rti'):
+            assert notas[coluna].str.fullmatch(r'-?\d+\.\d{2}').all(), notas[coluna]
+        for coluna in ('cbs_novo', 'ibs_novo', 'total_rti', 'economia_percentual'):
+            assert itens[coluna].str.fullmatch(r'-?\d+\.\d{2}').all(), itens[coluna]
+    print("✅ CSV do processamento em lote")
+
+
+def test_processar_lote_envinfe():
+    """Lotes <enviNFe> são lidos em streaming e geram uma linha por nota"""
+    import processar_lote
+    from processar_lote import e_lote, expandir_arquivos, main
+
+    with tempfile.TemporaryDirectory() as tmp:
+        entrada = Path(tmp) / 'xmls'
+        entrada.mkdir()
+        build_lote(entrada / 'lote.xml', 5)
+        (entrada / 'nf.xml').write_text(build_xml(), encoding='utf-8')
+        (entrada / 'quebrado.xml').write_text('<enviNFe><NFe><infNFe>', encoding='utf-8')
+        assert e_lote(entrada / 'lote.xml') and not e_lote(entrada / 'nf.xml')
+
+        # Acima do limite, qualquer XML segue em streaming
+        limite = processar_lote.LIMITE_STREAMING
+        processar_lote.LIMITE_STREAMING = 100
+        try:
+            assert e_lote(entrada / 'nf.xml')
+        finally:
+            processar_lote.LIMITE_STREAMING = limite
+
+        # Com XSD o lote segue inteiro para o worker validar
+        assert [nome for nome, _ in expandir_arquivos([entrada / 'lote.xml'], streaming=False)] == ['lote.xml']
+
+        cst = os.path.join(tmp, 'cst.xlsx')
+        pd.DataFrame({'CST': ['000'], 'Exige Trib': ['SIM'],
+                      '% Red. CBS': [0], '% Red. IBS': [0]}).to_excel(cst, index=False)
+        saida = os.path.join(tmp, 'saida')
+        assert main([str(entrada), '--cst', cst, '--saida', saida, '--workers', '2',
+                     '--cache', os.path.join(tmp, 'cache')]) == 0
+
+        arquivos = {nome.split('_')[0] if nome.startswith('erros') else nome.split('_')[1]:
+                    os.path.join(saida, nome) for nome in os.listdir(saida)}
+        notas = pd.read_csv(arquivos['notas'], sep=';', dtype=str, encoding='utf-8-sig')
+        assert list(notas['arquivo']) == [f"lote.xml#{n}" for n in range(1, 6)] + ['nf.xml']
+        assert notas['CBS'].nunique() == 1
+        erros = pd.read_csv(arquivos['erros'], sep=';', dtype=str, encoding='utf-8-sig')
+        assert list(erros['arquivo']) == ['quebrado.xml']
+    print("✅ Lote enviNFe em streaming")
+
+
+def _zip(membros) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as arquivo:
+        for nome, dados in membros:
+            arquivo.writestr(nome, dados)
+    return buffer.getvalue()
+
+
+def _tar_gz(membros, modo: str = 'w:gz') -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode=modo) as arquivo:
+        for nome, dados in membros:
+            info = tarfile.TarInfo(nome)
+            info.size = len(dados)
+            arquivo.addfile(info, io.BytesIO(dados))
+    return buffer.getvalue()
+
+
+def test_lotes_compactados():
+    """ZIP, tar.gz e .gz são lidos membro a membro, em memória ou do disco, sem extrair"""
+    xml = build_xml().encode('utf-8')
+    membros = [(f"lote/nf_{i}.xml", xml) for i in range(10)] + [("leia-me.txt", b"ignorar")]
+
+    zip_bytes = _zip(membros)
+    tar_bytes = _tar_gz(membros)
+    assert tipo_arquivo(zip_bytes[:1024]) == 'zip'
+    assert tipo_arquivo(tar_bytes[:1024]) == 'tar.gz'
+    assert tipo_arquivo(gzip.compress(xml)[:1024]) == 'gzip'
+    assert tipo_arquivo(xml[:1024]) == 'xml'
+
+    # tar.gz não é contado de antemão: exigiria descompactar tudo antes do iter_xmls
+    tar_simples = _tar_gz(membros, 'w')
+    assert tipo_arquivo(tar_simples[:1024]) == 'tar'
+    assert contar_xmls(zip_bytes) == contar_xmls(tar_simples) == 10
+    assert contar_xmls(tar_bytes) is None
+    with tempfile.TemporaryDirectory() as diretorio:
+        caminho = Path(diretorio) / 'lote.tar'
+        caminho.write_bytes(tar_simples)
+        assert contar_xmls(caminho) == 10
+
+    for conteudo in (zip_bytes, tar_bytes, tar_simples):
+        lidos = list(iter_xmls(conteudo, 'lote.zip'))
+        assert [nome for nome, _ in lidos] == [f"lote.zip/lote/nf_{i}.xml" for i in range(10)]
+        assert all(dados == xml for _, dados in lidos)
+    assert list(iter_xmls(gzip.compress(xml), 'nf.xml.gz')) == [('nf.xml', xml)]
+
+    # Membro acima do limite e arquivo corrompido viram erro por arquivo
+    grande = dict(iter_xmls(_zip([("a.xml", xml), ("b.xml", xml * 4)]), 'z', limite=len(xml) * 2))
+    assert grande['z/a.xml'] == xml and not isinstance(grande['z/b.xml'], bytes)
+    corrompido = list(iter_xmls(zip_bytes[:200], 'quebrado.zip'))
+    assert len(corrompido) == 1 and not isinstance(corrompido[0][1], bytes)
+
+    with tempfile.TemporaryDirectory() as diretorio:
+        caminho = Path(diretorio) / 'lote.zip'
+        caminho.write_bytes(zip_bytes)
+        entradas = list(iter_xmls(caminho))
+        assert all(isinstance(conteudo, MembroZip) for _, conteudo in entradas)
+
+        # Membros do ZIP em disco são descompactados nos próprios workers
+        processador = ProcessadorLote(criar_calculadora(), max_workers=2, tamanho_bloco=3)
+        resultados = processador.processar(entradas + corrompido, total=len(entradas))
+        assert [r.sucesso for r in resultados] == [True] * 10 + [False]
+        assert resultados[-1].erro_parser
+        assert resultados[0].comparativo.tributacao_atual['ICMS'] == Decimal('18.00')
+    print("✅ Lotes compactados")
+
+
+XSD_TESTE = """<?xml version="1.0" encoding="UTF-8"?>
+<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" xmlns="http://www.portalfiscal.inf.br/nfe"
+           targetNamespace="http://www.portalfiscal.inf.br/nfe" elementFormDefault="qualified">
+  <xs:element name="nfeProc">
+    <xs:complexType>
+      <xs:sequence><xs:any processContents="skip" maxOccurs="unbounded"/></xs:sequence>
+      <xs:attribute name="versao" use="required">
+        <xs:simpleType><xs:restriction base="xs:string"><xs:enumeration value="4.00"/></xs:restriction></xs:simpleType>
+      </xs:attribute>
+    </xs:complexType>
+  </xs:element>
+</xs:schema>"""
+
+
+def test_validacao_xsd():
+    """Schema compilado uma vez, validado na árvore do parse e falhas reportadas por arquivo"""
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, 'procNFe_v4.00.xsd'), 'w', encoding='utf-8') as f:
+            f.write(XSD_TESTE)
+
+        valido = build_xml().encode('utf-8')
+        fora_do_schema = valido.replace(b'versao="4.00">\n  <NFe>', b'versao="3.10">\n  <NFe>')
+        assert fora_do_schema != valido
+        arquivos = [(f"nf_{i}.xml", fora_do_schema if i == 4 else valido) for i in range(10)]
+
+        for workers in (1, 2):
+            processador = ProcessadorLote(criar_calculadora(), max_workers=workers, tamanho_bloco=2,
+                                          xsd=tmp, cache_dir=tmp)
+            resultados = processador.processar(arquivos)
+            assert [r.sucesso for r in resultados] == [i != 4 for i in range(10)]
+            assert resultados[4].erro_parser and 'versao' in resultados[4].erros_xsd[0]
+            assert resultados[0].comparativo.tributacao_atual['ICMS'] == Decimal('18.00')
+
+        # Sem schema para a raiz: o diretório precisa ter os arquivos do pacote de liberação
+        try:
+            ProcessadorLote(xsd=os.path.join(tmp, 'inexistente'))
+        except FileNotFoundError:
+            pass
+        else:
+            raise AssertionError("Diretório sem schemas deveria ser recusado")
+    print("✅ Validação XSD no lote")
+
+
+def test_telemetria():
+    """Spans por etapa com o nome do arquivo, inclusive os medidos nos workers"""
+    arquivos = [(f"nf_{i}.xml", build_xml().encode('utf-8')) for i in range(10)]
+    arquivos[3] = ("evento.xml", b"<procEventoNFe><evento/></procEventoNFe>")
+
+    anteriores = telemetria.configurar()
+    try:
+        # Desligada: span nulo compartilhado, nada é coletado
+        assert not telemetria.ativo() and telemetria.span('parse') is telemetria.span('calculo')
+
+        coletor = telemetria.ColetorMemoria()
+        telemetria.configurar(coletor)
+        for workers in (1, 2):
+            coletor.drenar()
+            ProcessadorLote(criar_calculadora(), max_workers=workers, tamanho_bloco=2).processar(arquivos)
+            resumo = {linha['etapa']: linha for linha in coletor.resumo()}
+            assert list(resumo) == ['triagem', 'parse', 'extracao', 'calculo']
+            assert resumo['triagem']['chamadas'] == 10 and resumo['parse']['chamadas'] == 9
+            assert resumo['extracao']['itens'] == resumo['calculo']['itens'] == 18
+            assert {span['arquivo'] for span in coletor.spans('triagem')} == {nome for nome, _ in arquivos}
+
+        with tempfile.TemporaryDirectory() as tmp:
+            caminho = os.path.join(tmp, 'trace.jsonl')
+            trace = telemetria.ArquivoJSONL(caminho)
+            telemetria.configurar(trace)
+            with telemetria.contexto(arquivo='a.xml'), telemetria.span('exportacao', formato='csv') as span:
+                span.itens = 3
+            telemetria.evento('teste', valor=Decimal('1.5'))
+            trace.fechar()
+            linhas = pd.read_json(caminho, lines=True)
+            assert list(linhas['tipo']) == ['span', 'log']
+            assert linhas.loc[0, 'arquivo'] == 'a.xml' and linhas.loc[0, 'itens'] == 3
+
+        # Sessões em threads distintas (como no Streamlit): destinos e contexto não se misturam
+        telemetria.configurar()
+        coletores = {}
+        pronto = threading.Barrier(2)
+
+        def sessao(nome):
+            coletores[nome] = telemetria.adicionar(telemetria.ColetorMemoria())
+            with telemetria.contexto(arquivo=f"{nome}.xml"):
+                pronto.wait()
+                for _ in range(50):
+                    with telemetria.span('parse'):
+                        pass
+                pronto.wait()
+
+        threads = [threading.Thread(target=sessao, args=(nome,)) for nome in ('a', 'b')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for nome, coletor in coletores.items():
+            assert {span['arquivo'] for span in coletor.spans()} == {f"{nome}.xml"}
+            assert len(coletor.spans()) == 50
+        # Nada registrado nas threads sobra no contexto principal
+        assert not telemetria.ativo()
+    finally:
+        telemetria.configurar(*anteriores)
+    print("✅ Telemetria por etapa")
+
+
+if __name__ == "__main__":
+    test_processamento_paralelo_ordenado()
+    test_ordenado_com_primeiro_arquivo_lento()
+    test_processar_lote_csv()
+    test_processar_lote_envinfe()
+    test_lotes_compactados()
+    test_validacao_xsd()
+    test_telemetria()